@@ -0,0 +1,4 @@
+from dotenv import load_dotenv
+
+# Load environment variables from .env file, once, before any app module reads them
+load_dotenv()
@@ -0,0 +1,100 @@
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, Query, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import app.crud as crud
+import app.schemas as schemas
+import app.views as views
+from app.database import get_async_read_db
+
+# Async versions of the read endpoints, mounted ahead of the sync ones in
+# app.main when DATABASE_MODE=async. Ids use the :int convertor so static
+# paths such as /movies/export fall through to the sync routes.
+# The logic lives in app.views, shared with the sync routes; run_sync hands it
+# a Session that drives the async connection without blocking the event loop.
+router = APIRouter()
+
+# Endpoint to get a list of movies, optionally filtered and sorted
+@router.get("/movies/", response_model=list[schemas.Movie])
+async def read_movies(request: Request, skip: int = 0, limit: int = 10, cursor: Optional[str] = None,
+                      sort: schemas.MovieSortKey = "created_at", order: schemas.SortOrder = "asc",
+                      filters: schemas.MovieFilters = Depends(), db: AsyncSession = Depends(get_async_read_db)):
+    return await db.run_sync(views.movie_list, request, skip, limit, cursor, sort, order, filters)
+
+# Endpoint to get the top rated movies from the precomputed leaderboards
+@router.get("/movies/top", response_model=list[schemas.LeaderboardEntry])
+async def read_top_movies(genre_id: Optional[int] = None, window: schemas.LeaderboardWindow = "all",
+                          limit: int = Query(10, ge=1, le=100), db: AsyncSession = Depends(get_async_read_db)):
+    return await db.run_sync(views.top_movies, window, genre_id, limit)
+
+# Endpoint to get several movies by ID in one request, in the requested order
+@router.get("/movies/batch", response_model=list[schemas.MovieBatchItem])
+async def read_movie_batch(ids: List[int] = Query(..., min_length=1, max_length=crud.MOVIE_BATCH_MAX_IDS),
+                           db: AsyncSession = Depends(get_async_read_db)):
+    return await db.run_sync(views.movie_batch, ids)
+
+# Endpoint to get a specific movie added by ID (public access)
+@router.get("/movies/{movie_id:int}", response_model=schemas.MovieDetail)
+async def read_movie(movie_id: int, request: Request, db: AsyncSession = Depends(get_async_read_db)):
+    return await db.run_sync(views.movie_detail, request, movie_id)
+
+# Endpoint to get a list of ratings for a movie
+@router.get("/movies/{movie_id:int}/ratings", response_model=list[schemas.Rating])
+async def get_ratings(movie_id: int, limit: int = 100, cursor: Optional[str] = None, db: AsyncSession = Depends(get_async_read_db)):
+    return await db.run_sync(views.movie_ratings, movie_id, limit, cursor)
+
+# Endpoint to get the rating aggregates of a movie
+@router.get("/movies/{movie_id:int}/rating-summary", response_model=schemas.RatingSummary)
+async def get_rating_summary(movie_id: int, db: AsyncSession = Depends(get_async_read_db)):
+    return await db.run_sync(views.rating_summary, movie_id)
+
+# Endpoint to get the movies whose ratings are most similar to a movie's
+@router.get("/movies/{movie_id:int}/similar", response_model=list[schemas.SimilarMovie])
+async def read_similar_movies(movie_id: int, limit: int = Query(10, ge=1, le=100),
+                              db: AsyncSession = Depends(get_async_read_db)):
+    return await db.run_sync(views.similar_movies, movie_id, limit)
+
+# Endpoint to get a page of comment threads for a movie, with replies nested up to max_depth
+@router.get("/movies/{movie_id:int}/comments", response_model=list[schemas.Comment])
+async def get_comments(movie_id: int, response: Response, limit: int = Query(20, ge=1, le=100), cursor: Optional[str] = None,
+                       max_depth: int = Query(3, ge=0, le=crud.COMMENT_MAX_DEPTH), db: AsyncSession = Depends(get_async_read_db)):
+    return await db.run_sync(views.comment_threads, response, movie_id, limit, cursor, max_depth)
+
+# Endpoint to get a page of replies to a comment, with their replies nested up to max_depth
+@router.get("/comments/{comment_id:int}/replies", response_model=list[schemas.Comment])
+async def get_comment_replies(comment_id: int, response: Response, limit: int = Query(20, ge=1, le=100), cursor: Optional[str] = None,
+                              max_depth: int = Query(3, ge=0, le=crud.COMMENT_MAX_DEPTH), db: AsyncSession = Depends(get_async_read_db)):
+    return await db.run_sync(views.comment_replies, response, comment_id, limit, cursor, max_depth)
+
+# Endpoint to get an actor with the ids of the movies they appeared in
+@router.get("/actors/{actor_id:int}", response_model=schemas.Actor)
+async def read_actor(actor_id: int, db: AsyncSession = Depends(get_async_read_db)):
+    return await db.run_sync(views.actor, actor_id)
+
+# Endpoint to get a page of the movies an actor appeared in
+@router.get("/actors/{actor_id:int}/movies", response_model=list[schemas.Movie])
+async def read_actor_movies(actor_id: int, limit: int = Query(20, ge=1, le=100), cursor: Optional[str] = None,
+                            db: AsyncSession = Depends(get_async_read_db)):
+    return await db.run_sync(views.actor_movies, actor_id, limit, cursor)
+
+# Endpoint to get a director with the ids of the movies they directed
+@router.get("/directors/{director_id:int}", response_model=schemas.Director)
+async def read_director(director_id: int, db: AsyncSession = Depends(get_async_read_db)):
+    return await db.run_sync(views.director, director_id)
+
+# Endpoint to get a page of the movies a director directed
+@router.get("/directors/{director_id:int}/movies", response_model=list[schemas.Movie])
+async def read_director_movies(director_id: int, limit: int = Query(20, ge=1, le=100), cursor: Optional[str] = None,
+                               db: AsyncSession = Depends(get_async_read_db)):
+    return await db.run_sync(views.director_movies, director_id, limit, cursor)
+
+# Endpoint to list every genre, served from the in-memory genre registry
+@router.get("/genres/", response_model=list[schemas.Genre])
+async def read_genres(db: AsyncSession = Depends(get_async_read_db)):
+    return await db.run_sync(views.genre_list)
+
+# Endpoint to get a genre by ID
+@router.get("/genres/{genre_id:int}", response_model=schemas.Genre)
+async def read_genre(genre_id: int, db: AsyncSession = Depends(get_async_read_db)):
+    return await db.run_sync(views.genre, genre_id)
@@ -1,35 +1,24 @@
 import os
-import logging
+import time
 from datetime import datetime, timedelta
 from typing import Optional
 
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from dotenv import load_dotenv
 from app.database import SessionLocal, get_db
 
 import app.models as models, app.schemas as schemas, app.database as database
+import app.cache as cache
+import app.hashing as hashing
 
-# Load environment variables from .env file
-load_dotenv()
-
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
-logger = logging.getLogger(__name__)
-
-# Retrieve environment variables with logging
+# Retrieve environment variables
 SECRET_KEY = os.environ.get('SECRET_KEY')
 ALGORITHM = os.environ.get('ALGORITHM')
 ACCESS_TOKEN_EXPIRE_MINUTES = os.environ.get('ACCESS_TOKEN_EXPIRE_MINUTES')
 
-# Debug output
-logger.debug(f"SECRET_KEY: {SECRET_KEY}")
-logger.debug(f"ALGORITHM: {ALGORITHM}")
-logger.debug(f"ACCESS_TOKEN_EXPIRE_MINUTES: {ACCESS_TOKEN_EXPIRE_MINUTES}")
-
 if SECRET_KEY is None:
     raise ValueError("SECRET_KEY environment variable is not set.")
 if ALGORITHM is None:
@@ -43,7 +32,7 @@ except ValueError:
     raise ValueError("ACCESS_TOKEN_EXPIRE_MINUTES must be an integer.")
 
 # Password hashing configuration
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = hashing.pwd_context
 
 # OAuth2 password flow configuration
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
@@ -76,6 +65,16 @@ def authenticate_user(db: Session, username: str, password: str):
         return False
     return user
 
+# Async variant for the login endpoints: the lookup runs on the threadpool and
+# bcrypt on the hashing pool, so neither holds a request thread while waiting
+async def authenticate_user_async(db: Session, username: str, password: str):
+    user = await run_in_threadpool(db.query(models.User).filter(models.User.username == username).first)
+    if not user:
+        return False
+    if not await hashing.verify_password(password, user.password_hash):
+        return False
+    return user
+
 # Verify a JWT token
 def verify_access_token(token: str):
     try:
@@ -91,8 +90,14 @@ def verify_access_token(token: str):
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-# Dependency to get the current user from the token
-def get_current_user(db: Session = Depends(database.get_db), token: str = Depends(oauth2_scheme)):
+# Dependency to get the current user from the token. A token seen before is
+# answered from the principal cache, without decoding it or querying users.
+def get_current_user(db: Session = Depends(database.get_db), token: str = Depends(oauth2_scheme)) -> schemas.Principal:
+    key = cache.token_key(token)
+    principal = cache.principal_cache.get(key)
+    if principal is not None:
+        return principal
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -105,13 +110,19 @@ def get_current_user(db: Session = Depends(database.get_db), token: str = Depend
             raise credentials_exception
     except JWTError:
         raise credentials_exception
+    since = cache.principal_cache.generation()
     user = db.query(models.User).filter(models.User.username == username).first()
     if user is None:
         raise credentials_exception
-    return user
+
+    principal = schemas.Principal.model_validate(user)
+    ttl = min(payload["exp"] - time.time(), cache.principal_cache.ttl) if "exp" in payload else cache.principal_cache.ttl
+    if ttl > 0:
+        cache.principal_cache.set(key, principal, tags=[cache.user_tag(user.id)], ttl=ttl, since=since)
+    return principal
 
 # Dependency to get the current active user
-def get_current_active_user(current_user: schemas.User = Depends(get_current_user)):
+def get_current_active_user(current_user: schemas.Principal = Depends(get_current_user)):
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
@@ -0,0 +1,287 @@
+import hashlib
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Hashable, Iterable, List, NamedTuple, Optional
+
+import orjson
+from fastapi import Response
+
+import app.conditional as conditional
+import app.schemas as schemas
+from app.pagination import NEXT_CURSOR_HEADER, Page
+
+
+class _Entry(NamedTuple):
+    value: Any
+    size: int
+    expires_at: float
+    tags: frozenset
+
+
+class _Invalidation(NamedTuple):
+    generation: int
+    at: float
+
+
+# Thread-safe LRU cache with a TTL per entry, bounded both by entry count and by
+# the total size of the stored values. Entries can carry tags so writes can
+# invalidate exactly the entries they affect.
+#
+# Each tag invalidation is numbered. A filler reads generation() before its
+# query and passes it to set() as `since`; if one of the entry's tags was
+# invalidated in between, the query may have read the data from before the
+# write, so set() drops the value instead of caching it for a whole TTL.
+# Values read from a lagging replica pass `settle` as well: they are dropped
+# while one of their tags was invalidated less than `settle` seconds ago.
+class TTLCache:
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._bytes = 0
+        self._generation = 0
+        # tag -> its last invalidation, oldest first, at most max_entries of
+        # them; _floor stands for the ones pruned or cleared
+        self._invalidated = OrderedDict()
+        self._floor = _Invalidation(0, float("-inf"))
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.stale_fills = 0
+
+    def generation(self) -> int:
+        with self._lock:
+            return self._generation
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires_at <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+    # `size` defaults to the length of bytes values; `ttl` overrides the cache-wide TTL;
+    # `since` is the generation() read before the value was loaded, `settle` the
+    # seconds after an invalidation of one of `tags` during which it is not cached
+    def set(self, key: Hashable, value: Any, size: Optional[int] = None, tags: Iterable[Hashable] = (),
+            ttl: Optional[float] = None, since: Optional[int] = None, settle: float = 0):
+        if size is None:
+            size = len(value) if isinstance(value, (bytes, str)) else sys.getsizeof(value)
+        if size > self.max_bytes or self.max_entries <= 0:
+            return
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        tags = frozenset(tags)
+        with self._lock:
+            if (since is not None or settle > 0) and self._stale(tags, since, settle):
+                self.stale_fills += 1
+                return
+            if key in self._entries:
+                self._remove(key)
+            entry = _Entry(value, size, expires_at, tags)
+            self._entries[key] = entry
+            self._bytes += size
+            for tag in entry.tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+                self.invalidations += 1
+
+    def invalidate_tags(self, *tags: Hashable):
+        with self._lock:
+            self._generation += 1
+            invalidation = _Invalidation(self._generation, time.monotonic())
+            for tag in tags:
+                self._invalidated[tag] = invalidation
+                self._invalidated.move_to_end(tag)
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+                    self.invalidations += 1
+            while len(self._invalidated) > max(self.max_entries, 1):
+                _, self._floor = self._invalidated.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self._bytes = 0
+            self._generation += 1
+            self._invalidated.clear()
+            self._floor = _Invalidation(self._generation, time.monotonic())
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "stale_fills": self.stale_fills,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+            }
+
+    # Caller holds the lock
+    def _stale(self, tags: frozenset, since: Optional[int], settle: float) -> bool:
+        settled_before = time.monotonic() - settle
+        for invalidation in (self._floor, *map(self._invalidated.get, tags)):
+            if invalidation is None:
+                continue
+            if since is not None and invalidation.generation > since:
+                return True
+            if settle > 0 and invalidation.at > settled_before:
+                return True
+        return False
+
+    # Caller holds the lock
+    def _remove(self, key: Hashable):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+        for tag in entry.tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+# Serialized movie responses for GET /movies/ and GET /movies/{movie_id}
+movie_cache = TTLCache(
+    max_entries=int(os.getenv("MOVIE_CACHE_MAX_ENTRIES", "10000")),
+    max_bytes=int(os.getenv("MOVIE_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    ttl=float(os.getenv("MOVIE_CACHE_TTL_SECONDS", "60")),
+)
+
+# Tags: every cached response containing a movie is tagged with it; list pages
+# are also tagged as the last page (a new movie is appended there) or as
+# offset-paged (deleting a movie shifts every later offset). Filtered or
+# re-sorted pages are tagged as such, since any movie write can move a movie
+# into, out of or within them.
+MOVIE_LIST_TAIL = "movies:tail"
+MOVIE_LIST_OFFSET = "movies:offset"
+MOVIE_LIST_FILTERED = "movies:filtered"
+
+def movie_tag(movie_id: int) -> str:
+    return f"movie:{movie_id}"
+
+def movie_key(movie_id: int) -> tuple:
+    return ("movie", movie_id)
+
+def movie_list_key(**params) -> tuple:
+    return ("movies",) + tuple(sorted(params.items()))
+
+
+class CachedMovie(NamedTuple):
+    body: bytes
+    etag: Optional[str]
+    last_modified: Optional[datetime]
+
+class CachedPage(NamedTuple):
+    body: bytes
+    next_cursor: Optional[str]
+    etag: str
+
+
+# `since` is movie_cache.generation() read before the movie was loaded,
+# `settle` the session's database.replica_settle()
+def cache_movie_detail(db_movie, since: Optional[int] = None, settle: float = 0) -> CachedMovie:
+    body = schemas.MovieDetail.model_validate(db_movie).model_dump_json().encode()
+    cached = CachedMovie(body, *conditional.movie_validators(db_movie.id, db_movie.updated_at))
+    movie_cache.set(movie_key(db_movie.id), cached, size=len(body), tags=[movie_tag(db_movie.id)],
+                    since=since, settle=settle)
+    return cached
+
+# Cache a page of crud.get_movie_rows, encoded straight from the row dicts
+def cache_movie_page(key: tuple, page: Page, skip: int = 0, cursor: Optional[str] = None,
+                     filtered: bool = False, since: Optional[int] = None, settle: float = 0) -> CachedPage:
+    body = orjson.dumps(page.items)
+    tags = [movie_tag(movie["id"]) for movie in page.items]
+    if filtered:
+        tags.append(MOVIE_LIST_FILTERED)
+    elif page.next_cursor is None:
+        tags.append(MOVIE_LIST_TAIL)
+    if skip and not cursor:
+        tags.append(MOVIE_LIST_OFFSET)
+    etag = conditional.movie_list_etag((movie["id"], movie["updated_at"]) for movie in page.items)
+    cached = CachedPage(body, page.next_cursor, etag)
+    movie_cache.set(key, cached, size=len(body), tags=tags, since=since, settle=settle)
+    return cached
+
+# Splice cached movie detail bodies into a schemas.MovieBatchItem list
+def movie_batch_body(movie_ids: List[int], movies: Dict[int, Optional[CachedMovie]]) -> bytes:
+    items = [
+        b'{"id":%d,"found":true,"movie":%s}' % (movie_id, movies[movie_id].body) if movies.get(movie_id)
+        else b'{"id":%d,"found":false,"movie":null}' % movie_id
+        for movie_id in movie_ids
+    ]
+    return b"[" + b",".join(items) + b"]"
+
+def json_response(body: bytes, next_cursor: Optional[str] = None, headers: Optional[Dict[str, str]] = None) -> Response:
+    headers = dict(headers or {})
+    if next_cursor:
+        headers[NEXT_CURSOR_HEADER] = next_cursor
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# Invalidation hooks for crud writes
+def invalidate_movie(movie_id: int, created: bool = False, deleted: bool = False):
+    tags = [movie_tag(movie_id), MOVIE_LIST_FILTERED]
+    if created:
+        tags.append(MOVIE_LIST_TAIL)
+    if deleted:
+        tags.append(MOVIE_LIST_OFFSET)
+        known_movies.invalidate_tags(movie_tag(movie_id))
+    movie_cache.invalidate_tags(*tags)
+
+
+# Ids of movies known to exist, so the buffered rating endpoint can answer 404
+# for unknown movies without a query per rating. Deleting a movie drops its id
+# in this process, other workers pick the change up within the TTL.
+known_movies = TTLCache(
+    max_entries=int(os.getenv("KNOWN_MOVIES_MAX_ENTRIES", "100000")),
+    max_bytes=int(os.getenv("KNOWN_MOVIES_MAX_BYTES", str(8 * 1024 * 1024))),
+    ttl=float(os.getenv("KNOWN_MOVIES_TTL_SECONDS", "300")),
+)
+
+
+# Verified JWT principals for auth.get_current_user, keyed by a digest of the
+# token. Entries never outlive the token's `exp`; writes to a user drop them
+# in this process, other workers pick the change up within the TTL.
+principal_cache = TTLCache(
+    max_entries=int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", "50000")),
+    max_bytes=int(os.getenv("PRINCIPAL_CACHE_MAX_BYTES", str(16 * 1024 * 1024))),
+    ttl=float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "60")),
+)
+
+def token_key(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()
+
+def user_tag(user_id: int) -> str:
+    return f"user:{user_id}"
+
+def invalidate_user(user_id: int):
+    principal_cache.invalidate_tags(user_tag(user_id))
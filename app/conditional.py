@@ -0,0 +1,82 @@
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+from fastapi import Request, Response, status
+
+from app.pagination import NEXT_CURSOR_HEADER
+
+# Conditional GET for movie resources. Every movie write, including rating
+# aggregate updates, bumps Movie.updated_at, so a movie's ETag is derived from
+# (id, updated_at) and a list page's from its ids and their updated_at.
+# Lists carry no Last-Modified: a movie dropping out of a page would not move
+# the page's newest updated_at, so only the ETag can validate them.
+
+Validators = Tuple[Optional[str], Optional[datetime]]
+
+
+def movie_validators(movie_id: int, updated_at: Optional[datetime]) -> Validators:
+    if updated_at is None:
+        return None, None
+    return f'"m{movie_id}-{updated_at.timestamp():.6f}"', updated_at
+
+
+def movie_list_etag(versions: Iterable[Tuple[int, Optional[datetime]]]) -> str:
+    digest = hashlib.sha1()
+    latest = None
+    for movie_id, updated_at in versions:
+        digest.update(f"{movie_id},".encode())
+        if updated_at is not None and (latest is None or updated_at > latest):
+            latest = updated_at
+    digest.update(latest.isoformat().encode() if latest else b"-")
+    return f'"l{digest.hexdigest()}"'
+
+
+# updated_at is stored as naive UTC
+def http_date(value: datetime) -> str:
+    return format_datetime(value.replace(tzinfo=timezone.utc), usegmt=True)
+
+
+def is_conditional(request: Request) -> bool:
+    return "if-none-match" in request.headers or "if-modified-since" in request.headers
+
+
+# If-None-Match takes precedence; If-Modified-Since is only consulted without
+# it, at the one second resolution of HTTP dates (RFC 9110 13.2.2)
+def not_modified(request: Request, etag: Optional[str], last_modified: Optional[datetime] = None) -> bool:
+    if etag is None:
+        return False
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is None or last_modified is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return last_modified.replace(tzinfo=timezone.utc, microsecond=0) <= since
+
+
+def validator_headers(etag: Optional[str], last_modified: Optional[datetime] = None,
+                      next_cursor: Optional[str] = None) -> Dict[str, str]:
+    headers = {}
+    if etag is not None:
+        headers["ETag"] = etag
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    if next_cursor:
+        headers[NEXT_CURSOR_HEADER] = next_cursor
+    return headers
+
+
+def not_modified_response(etag: Optional[str], last_modified: Optional[datetime] = None,
+                          next_cursor: Optional[str] = None) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED,
+                    headers=validator_headers(etag, last_modified, next_cursor))
@@ -1,28 +1,83 @@
-from sqlalchemy.orm import Session
-from typing import List, Optional
+import os
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy import case, delete, func, insert, literal, or_, select, tuple_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, joinedload, selectinload
+from typing import Dict, List, Optional, Set, Tuple
 import app.models as models, app.schemas as schemas
+import app.cache as cache
+import app.genres as genres
+import app.leaderboards as leaderboards
+import app.recommendations as recommendations
+import app.search as search
+from app.pagination import Page, encode_cursor, page_of, paginate, paginate_sorted, seek
 from fastapi import FastAPI, HTTPException, Depends
 
 # Genre CRUD Operations
+# Reads come from the in-memory registry in app.genres; writes reload it
 
+# Names taken by genres other workers created are caught by the unique constraint
 def create_genre(db: Session, genre: schemas.GenreCreate) -> models.Genre:
+    if genres.registry.id_of(db, genre.name) is not None:
+        raise HTTPException(status_code=400, detail="Genre already exists")
     db_genre = models.Genre(**genre.model_dump())
     db.add(db_genre)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        # Created by another worker since this one's snapshot loaded
+        db.rollback()
+        genres.registry.load(db)
+        raise HTTPException(status_code=400, detail="Genre already exists")
     db.refresh(db_genre)
+    genres.registry.load(db)
     return db_genre
 
-def get_genre(db: Session, genre_id: int) -> Optional[models.Genre]:
-    return db.query(models.Genre).filter(models.Genre.id == genre_id).first()
+def get_genre(db: Session, genre_id: int) -> Optional[schemas.Genre]:
+    return genres.registry.get(db, genre_id)
 
-def get_genres(db: Session, skip: int = 0, limit: int = 10) -> List[models.Genre]:
-    return db.query(models.Genre).offset(skip).limit(limit).all()
+def get_genres(db: Session) -> List[schemas.Genre]:
+    return genres.registry.all(db)
 
-def delete_genre(db: Session, genre_id: int):
-    db_genre = db.query(models.Genre).filter(models.Genre.id == genre_id).first()
-    if db_genre:
-        db.delete(db_genre)
-        db.commit()
+# get_genres encoded as JSON, once per registry load
+def get_genres_json(db: Session) -> bytes:
+    return genres.registry.body(db)
+
+# Deleting a genre takes it off its movies: their movie_genre rows go, a
+# primary genre_id pointing at it is cleared, and their updated_at moves so
+# cached and conditional responses of those movies are refreshed
+def delete_genre(db: Session, genre_id: int) -> Optional[schemas.Genre]:
+    row = db.execute(select(models.Genre.id, models.Genre.name).where(models.Genre.id == genre_id)).first()
+    if row is None:
+        return None
+
+    has_genre = or_(
+        models.Movie.genre_id == genre_id,
+        models.Movie.id.in_(select(models.MovieGenre.movie_id).where(models.MovieGenre.genre_id == genre_id)),
+    )
+    movie_ids = db.scalars(select(models.Movie.id).where(has_genre)).all()
+    if movie_ids:
+        db.execute(
+            update(models.Movie).where(has_genre)
+            .values(genre_id=case((models.Movie.genre_id == genre_id, None), else_=models.Movie.genre_id)),
+            execution_options={"synchronize_session": False},
+        )
+        db.execute(delete(models.MovieGenre).where(models.MovieGenre.genre_id == genre_id))
+    leaderboards.remove_genre(db, genre_id)
+    db.execute(delete(models.Genre).where(models.Genre.id == genre_id))
+    db.commit()
+    genres.registry.load(db)
+    if movie_ids:
+        cache.movie_cache.invalidate_tags(*map(cache.movie_tag, movie_ids), cache.MOVIE_LIST_FILTERED)
+    return schemas.Genre(id=row.id, name=row.name)
+
+# The movies relationship of Actor and Director loads whole Movie objects;
+# the schemas only carry their ids, which are read separately
+def _person(schema, person, movie_ids: List[int]):
+    return schema(id=person.id, name=person.name, date_of_birth=person.date_of_birth, bio=person.bio,
+                  movies=movie_ids)
 
 # Actor CRUD Operations
 
@@ -36,8 +91,28 @@ def create_actor(db: Session, actor: schemas.ActorCreate) -> models.Actor:
 def get_actor(db: Session, actor_id: int) -> Optional[models.Actor]:
     return db.query(models.Actor).filter(models.Actor.id == actor_id).first()
 
-def get_actors(db: Session, skip: int = 0, limit: int = 10) -> List[models.Actor]:
-    return db.query(models.Actor).offset(skip).limit(limit).all()
+# Movie ids of an actor from the (actor_id, movie_id) index alone, without loading movies
+def get_actor_movie_ids(db: Session, actor_id: int) -> List[int]:
+    credits = models.movie_actor_association.c
+    return db.scalars(select(credits.movie_id).where(credits.actor_id == actor_id).order_by(credits.movie_id)).all()
+
+# schemas.Actor for an actor, with the ids of their movies
+def get_actor_detail(db: Session, actor_id: int) -> Optional[schemas.Actor]:
+    db_actor = get_actor(db, actor_id)
+    if db_actor is None:
+        return None
+    return _person(schemas.Actor, db_actor, get_actor_movie_ids(db, actor_id))
+
+# A page of an actor's movies by movie id: the page of ids is read from the
+# association index, then only those movies are loaded, as plain rows
+def get_actor_movie_rows(db: Session, actor_id: int, cursor: Optional[str] = None, limit: int = 20) -> Page:
+    credits = models.movie_actor_association.c
+    page = paginate(db.query(credits.movie_id).filter(credits.actor_id == actor_id), [credits.movie_id],
+                    cursor=cursor, limit=limit)
+    return Page(get_movie_rows_by_ids(db, [row.movie_id for row in page.items]), page.next_cursor)
+
+def get_actors(db: Session, skip: int = 0, limit: int = 10, cursor: Optional[str] = None) -> Page:
+    return paginate(db.query(models.Actor), [models.Actor.id], cursor=cursor, limit=limit, skip=skip)
 
 def delete_actor(db: Session, actor_id: int):
     db_actor = db.query(models.Actor).filter(models.Actor.id == actor_id).first()
@@ -57,8 +132,29 @@ def create_director(db: Session, director: schemas.DirectorCreate) -> models.Dir
 def get_director(db: Session, director_id: int) -> Optional[models.Director]:
     return db.query(models.Director).filter(models.Director.id == director_id).first()
 
-def get_directors(db: Session, skip: int = 0, limit: int = 10) -> List[models.Director]:
-    return db.query(models.Director).offset(skip).limit(limit).all()
+# Movie ids of a director in the order they were added, from the
+# (director_id, created_at, id) index alone
+def get_director_movie_ids(db: Session, director_id: int) -> List[int]:
+    return db.scalars(
+        select(models.Movie.id).where(models.Movie.director_id == director_id)
+        .order_by(models.Movie.created_at, models.Movie.id)
+    ).all()
+
+# schemas.Director for a director, with the ids of their movies
+def get_director_detail(db: Session, director_id: int) -> Optional[schemas.Director]:
+    db_director = get_director(db, director_id)
+    if db_director is None:
+        return None
+    return _person(schemas.Director, db_director, get_director_movie_ids(db, director_id))
+
+# A page of a director's movies in the order they were added, as plain rows
+def get_director_movie_rows(db: Session, director_id: int, cursor: Optional[str] = None, limit: int = 20) -> Page:
+    query = db.query(models.Movie.id, models.Movie.created_at).filter(models.Movie.director_id == director_id)
+    page = paginate(query, [models.Movie.created_at, models.Movie.id], cursor=cursor, limit=limit)
+    return Page(get_movie_rows_by_ids(db, [row.id for row in page.items]), page.next_cursor)
+
+def get_directors(db: Session, skip: int = 0, limit: int = 10, cursor: Optional[str] = None) -> Page:
+    return paginate(db.query(models.Director), [models.Director.id], cursor=cursor, limit=limit, skip=skip)
 
 def delete_director(db: Session, director_id: int):
     db_director = db.query(models.Director).filter(models.Director.id == director_id).first()
@@ -68,7 +164,55 @@ def delete_director(db: Session, director_id: int):
 
 # Movie CRUD Operations
 
+# Named eager-loading profiles for Movie queries, so serializing a page of
+# movies costs a fixed number of queries instead of one per relationship per row.
+# "summary" loads the id lists behind schemas.Movie; "detail" loads the
+# genres, cast and director embedded in schemas.MovieDetail.
+MOVIE_LOAD_PROFILES = {
+    "summary": (
+        selectinload(models.Movie.genres).load_only(models.Genre.id),
+        selectinload(models.Movie.cast).load_only(models.Actor.id),
+    ),
+    "detail": (
+        selectinload(models.Movie.genres),
+        selectinload(models.Movie.cast).load_only(models.Actor.id, models.Actor.name),
+        joinedload(models.Movie.director).load_only(models.Director.id, models.Director.name),
+    ),
+}
+
+def _movie_query(db: Session, profile: Optional[str] = None):
+    query = db.query(models.Movie)
+    if profile is not None:
+        if profile not in MOVIE_LOAD_PROFILES:
+            raise ValueError(f"Unknown movie load profile: {profile}")
+        query = query.options(*MOVIE_LOAD_PROFILES[profile])
+    return query
+
+# Genre ids are checked against the genre registry without a query, cast ids
+# with one id-only query; returns both without duplicates
+def _resolve_links(db: Session, movie: schemas.MovieBase) -> Tuple[List[int], List[int]]:
+    genre_ids, unknown = genres.registry.resolve(db, movie.genre_ids or ())
+    if unknown:
+        raise HTTPException(status_code=400, detail="Some genre IDs are invalid")
+    cast_ids = list(dict.fromkeys(movie.cast_ids or ()))
+    if cast_ids:
+        actors = db.scalars(select(models.Actor.id).where(models.Actor.id.in_(cast_ids))).all()
+        if len(actors) != len(cast_ids):
+            raise HTTPException(status_code=400, detail="Some actor IDs are invalid")
+    return genre_ids, cast_ids
+
+# One multi-row insert per association table
+def _insert_links(db: Session, movie_id: int, genre_ids: List[int], cast_ids: List[int]):
+    if genre_ids:
+        db.execute(insert(models.MovieGenre.__table__),
+                   [{"movie_id": movie_id, "genre_id": genre_id} for genre_id in genre_ids])
+    if cast_ids:
+        db.execute(insert(models.movie_actor_association),
+                   [{"movie_id": movie_id, "actor_id": actor_id} for actor_id in cast_ids])
+
 def create_movie(db: Session, movie: schemas.MovieCreate, user_id: int) -> models.Movie:
+    genre_ids, cast_ids = _resolve_links(db, movie)
+
     db_movie = models.Movie(
         title=movie.title,
         description=movie.description,
@@ -77,72 +221,376 @@ def create_movie(db: Session, movie: schemas.MovieCreate, user_id: int) -> model
         rating=movie.rating,
         language=movie.language,
         trailer_url=movie.trailer_url,
-        genre_id=movie.genre_ids[0] if movie.genre_ids else None,
-        director_id=movie.director_id
+        genre_id=genre_ids[0] if genre_ids else None,
+        director_id=movie.director_id,
+        owner_id=user_id
     )
-    
-    # Add actors to the movie
-    if movie.cast_ids:
-        actors = db.query(models.Actor).filter(models.Actor.id.in_(movie.cast_ids)).all()
-        if len(actors) != len(movie.cast_ids):
-            raise HTTPException(status_code=400, detail="Some actor IDs are invalid")
-        db_movie.cast = actors
-    
     db.add(db_movie)
+    db.flush()
+
+    _insert_links(db, db_movie.id, genre_ids, cast_ids)
+    search.index_movies(db, [db_movie.id])
     db.commit()
     db.refresh(db_movie)
+    cache.invalidate_movie(db_movie.id, created=True)
     return db_movie
 
 
-def get_movie_by_id(db: Session, movie_id: int) -> Optional[models.Movie]:
-    return db.query(models.Movie).filter(models.Movie.id == movie_id).first()
-
-def get_movies(db: Session, skip: int = 0, limit: int = 10) -> List[models.Movie]:
-    return db.query(models.Movie).offset(skip).limit(limit).all()
-
+def get_movie_by_id(db: Session, movie_id: int, profile: Optional[str] = None) -> Optional[models.Movie]:
+    return _movie_query(db, profile).filter(models.Movie.id == movie_id).first()
+
+# Sort keys of GET /movies/, each paged on (column, id) and backed by a
+# matching index in models.Movie; movies without a value come last
+MOVIE_SORT_KEYS = {
+    "created_at": models.Movie.created_at,
+    "release_date": models.Movie.release_date,
+    "rating": models.Movie.rating_average,
+    "duration": models.Movie.duration,
+    "title": models.Movie.title,
+}
+MOVIE_NOT_NULL_SORT_KEYS = {"created_at", "title"}
+
+# Genre and actor filters look the movie ids up in the association tables'
+# (genre_id, movie_id) / (actor_id, movie_id) indexes
+def _filter_movies(query, filters: schemas.MovieFilters):
+    Movie = models.Movie
+    if filters.genre_id is not None:
+        query = query.filter(Movie.id.in_(
+            select(models.MovieGenre.movie_id).where(models.MovieGenre.genre_id == filters.genre_id)
+        ))
+    if filters.actor_id is not None:
+        cast = models.movie_actor_association.c
+        query = query.filter(Movie.id.in_(select(cast.movie_id).where(cast.actor_id == filters.actor_id)))
+    if filters.director_id is not None:
+        query = query.filter(Movie.director_id == filters.director_id)
+    if filters.language is not None:
+        query = query.filter(Movie.language == filters.language)
+    ranges = (
+        (Movie.release_date, filters.released_from, filters.released_to),
+        (Movie.rating_average, filters.min_rating, filters.max_rating),
+        (Movie.duration, filters.min_duration, filters.max_duration),
+    )
+    for column, low, high in ranges:
+        if low is not None:
+            query = query.filter(column >= low)
+        if high is not None:
+            query = query.filter(column <= high)
+    return query
+
+def _movie_page(query, skip: int, limit: int, cursor: Optional[str], filters: Optional[schemas.MovieFilters],
+                sort: str, order: str) -> Page:
+    if sort not in MOVIE_SORT_KEYS or order not in ("asc", "desc"):
+        raise ValueError(f"Unknown movie sort order: {sort} {order}")
+    if filters is not None:
+        query = _filter_movies(query, filters)
+    # Default-order cursors stay unscoped, as issued before sorting was added
+    scope = None if (sort, order) == ("created_at", "asc") else f"{sort}:{order}"
+    return paginate_sorted(query, MOVIE_SORT_KEYS[sort], models.Movie.id, cursor=cursor, limit=limit, skip=skip,
+                           descending=order == "desc", nullable=sort not in MOVIE_NOT_NULL_SORT_KEYS, scope=scope)
+
+# Movies are paged on (created_at, id) by default, backed by ix_movies_created_at_id
+def get_movies(db: Session, skip: int = 0, limit: int = 10, cursor: Optional[str] = None,
+               profile: str = "summary", filters: Optional[schemas.MovieFilters] = None,
+               sort: str = "created_at", order: str = "asc") -> Page:
+    return _movie_page(_movie_query(db, profile), skip, limit, cursor, filters, sort, order)
+
+# The page get_movies would return as (id, updated_at, sort key...) rows, for
+# revalidating a list response without loading or serializing the movies
+def get_movie_versions(db: Session, skip: int = 0, limit: int = 10, cursor: Optional[str] = None,
+                       filters: Optional[schemas.MovieFilters] = None, sort: str = "created_at",
+                       order: str = "asc") -> Page:
+    query = db.query(models.Movie.id, models.Movie.updated_at, *MOVIE_SORT_KEYS.values())
+    return _movie_page(query, skip, limit, cursor, filters, sort, order)
+
+# Fast path for list responses: the columns of schemas.Movie as plain rows,
+# with the genre and cast ids of the page joined in by one query each, ready
+# to be encoded without building ORM entities or Pydantic models
+MOVIE_ROW_COLUMNS = [getattr(models.Movie, name) for name in schemas.Movie.model_fields if name not in ("genre_ids", "cast_ids")]
+
+# movie id -> related ids, for a batch of movies
+def get_related_ids(db: Session, owner_column, related_column, movie_ids: List[int]) -> Dict[int, List[int]]:
+    related = defaultdict(list)
+    if movie_ids:
+        rows = db.execute(
+            select(owner_column, related_column).where(owner_column.in_(movie_ids)).order_by(owner_column, related_column)
+        )
+        for movie_id, related_id in rows:
+            related[movie_id].append(related_id)
+    return related
+
+def _with_related_ids(db: Session, rows: list) -> List[dict]:
+    movie_ids = [row.id for row in rows]
+    genres = get_related_ids(db, models.MovieGenre.movie_id, models.MovieGenre.genre_id, movie_ids)
+    cast = get_related_ids(db, models.movie_actor_association.c.movie_id, models.movie_actor_association.c.actor_id, movie_ids)
+    return [dict(row._mapping, genre_ids=genres.get(row.id, []), cast_ids=cast.get(row.id, [])) for row in rows]
+
+def get_movie_rows(db: Session, skip: int = 0, limit: int = 10, cursor: Optional[str] = None,
+                   filters: Optional[schemas.MovieFilters] = None, sort: str = "created_at",
+                   order: str = "asc") -> Page:
+    page = _movie_page(db.query(*MOVIE_ROW_COLUMNS), skip, limit, cursor, filters, sort, order)
+    return Page(_with_related_ids(db, page.items), page.next_cursor)
+
+# Movie rows for a list of ids, in that order; ids with no movie are skipped
+def get_movie_rows_by_ids(db: Session, movie_ids: List[int]) -> List[dict]:
+    if not movie_ids:
+        return []
+    rows = {row.id: row for row in db.query(*MOVIE_ROW_COLUMNS).filter(models.Movie.id.in_(set(movie_ids)))}
+    return _with_related_ids(db, [rows[movie_id] for movie_id in movie_ids if movie_id in rows])
+
+# (id, updated_at) of one movie, or None if it does not exist
+def get_movie_version(db: Session, movie_id: int):
+    return db.execute(
+        select(models.Movie.id, models.Movie.updated_at).where(models.Movie.id == movie_id)
+    ).first()
+
+# Most ids accepted by GET /movies/batch
+MOVIE_BATCH_MAX_IDS = int(os.getenv("MOVIE_BATCH_MAX_IDS", "100"))
+
+# Movies for a list of ids with one IN query and one eager-load profile, in
+# the requested order; None marks ids with no movie
+def get_movies_by_ids(db: Session, movie_ids: List[int], profile: str = "summary") -> List[Optional[models.Movie]]:
+    if not movie_ids:
+        return []
+    movies = {movie.id: movie for movie in _movie_query(db, profile).filter(models.Movie.id.in_(set(movie_ids)))}
+    return [movies.get(movie_id) for movie_id in movie_ids]
+
+# Ranked full-text search over titles, descriptions and cast/director names
+def search_movies(db: Session, query: str, cursor: Optional[str] = None, limit: int = 10) -> Page:
+    matches = search.search_movie_ids(db, query, cursor=cursor, limit=limit)
+    movie_ids = [row.id for row in matches.items]
+    if not movie_ids:
+        return Page([], matches.next_cursor)
+    movies = {movie.id: movie for movie in _movie_query(db, "summary").filter(models.Movie.id.in_(movie_ids))}
+    return Page([movies[movie_id] for movie_id in movie_ids if movie_id in movies], matches.next_cursor)
+
+# genre_ids and cast_ids, when sent, replace the movie's genres and cast; the
+# first genre becomes its primary genre_id and its leaderboard entries move
+# to the new genres' lists
 def update_movie(db: Session, movie_id: int, movie_update: schemas.MovieUpdate) -> Optional[models.Movie]:
     db_movie = db.query(models.Movie).filter(models.Movie.id == movie_id).first()
     if not db_movie:
         return None
     
-    for var, value in vars(movie_update).items():
+    for var, value in movie_update.model_dump(exclude={"genre_ids", "cast_ids"}).items():
         if value is not None:
             setattr(db_movie, var, value)
+
+    links = {"genre_ids", "cast_ids"} & movie_update.model_fields_set
+    if links:
+        genre_ids, cast_ids = _resolve_links(db, movie_update)
+        if "genre_ids" in links:
+            db.execute(delete(models.MovieGenre).where(models.MovieGenre.movie_id == movie_id))
+            db_movie.genre_id = genre_ids[0] if genre_ids else None
+        if "cast_ids" in links:
+            db.execute(delete(models.movie_actor_association).where(models.movie_actor_association.c.movie_id == movie_id))
+        _insert_links(db, movie_id, genre_ids if "genre_ids" in links else [], cast_ids if "cast_ids" in links else [])
+        # The row itself may not change, but its responses do
+        db_movie.updated_at = datetime.utcnow()
     
+    db.flush()
+    search.index_movies(db, [movie_id])
+    if "genre_ids" in links:
+        leaderboards.refresh_movies(db, [movie_id])
     db.commit()
     db.refresh(db_movie)
+    cache.invalidate_movie(movie_id)
     return db_movie
 
 def delete_movie(db: Session, movie_id: int):
     db_movie = db.query(models.Movie).filter(models.Movie.id == movie_id).first()
     if db_movie:
         db.delete(db_movie)
+        search.remove_movies(db, [movie_id])
+        leaderboards.remove_movies(db, [movie_id])
+        recommendations.remove_movies(db, [movie_id])
         db.commit()
+        cache.invalidate_movie(movie_id, deleted=True)
 
 # Rating CRUD Operations
 
-def create_rating(db: Session, rating: schemas.RatingCreate) -> models.Rating:
-    db_rating = models.Rating(**rating.model_dump())
+# Adjust a movie's rating aggregates in SQL, so concurrent writers cannot lose
+# updates; runs in the caller's transaction alongside the rating row change.
+def _apply_rating_delta(db: Session, movie_id: int, count_delta: int, sum_delta: float):
+    new_count = models.Movie.rating_count + count_delta
+    new_sum = models.Movie.rating_sum + sum_delta
+    db.execute(
+        update(models.Movie)
+        .where(models.Movie.id == movie_id)
+        .values(
+            rating_count=new_count,
+            rating_sum=new_sum,
+            rating_average=case((new_count > 0, new_sum / new_count), else_=None),
+        )
+    )
 
-    db.add(db_rating)
+# Rating a movie again replaces the user's earlier rating
+def create_rating(db: Session, rating: schemas.RatingCreate, user_id: int) -> models.Rating:
+    db_rating = db.query(models.Rating).filter(
+        models.Rating.user_id == user_id, models.Rating.movie_id == rating.movie_id
+    ).first()
+    now = datetime.utcnow()
+    replaced = []
+    if db_rating is None:
+        db_rating = models.Rating(**rating.model_dump(), user_id=user_id, rated_at=now)
+        db.add(db_rating)
+        _apply_rating_delta(db, db_rating.movie_id, 1, db_rating.rating)
+    else:
+        _apply_rating_delta(db, db_rating.movie_id, 0, rating.rating - db_rating.rating)
+        replaced.append((db_rating.movie_id, db_rating.rating, db_rating.rated_at))
+        db_rating.rating = rating.rating
+        db_rating.rated_at = now
+    leaderboards.record_ratings(db, [(rating.movie_id, rating.rating, now)], replaced)
     db.commit()
     db.refresh(db_rating)
+    cache.invalidate_movie(db_rating.movie_id)
     return db_rating
 
+# Rows per multi-row statement of upsert_ratings
+RATING_UPSERT_CHUNK = 1000
+
+UPSERT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+def _chunks(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+# Write {(user_id, movie_id): rating} in one transaction with multi-row
+# INSERT .. ON CONFLICT (user_id, movie_id) DO UPDATE, and move each movie's
+# aggregates by the difference to the ratings being replaced. Ratings of movies
+# or users deleted in the meantime are dropped. Returns the ids of the movies
+# written. The movies' leaderboard entries are refreshed in the same transaction.
+# Rows are written and locked in key order, so concurrent writers cannot deadlock.
+def upsert_ratings(db: Session, ratings: Dict[Tuple[int, int], float]) -> Set[int]:
+    dialect = db.get_bind().dialect.name
+    if dialect not in UPSERT_INSERTS:
+        raise ValueError(f"Rating upserts are not supported on '{dialect}' databases")
+
+    movie_ids = set(db.scalars(select(models.Movie.id).where(models.Movie.id.in_({movie_id for _, movie_id in ratings}))))
+    user_ids = set(db.scalars(select(models.User.id).where(models.User.id.in_({user_id for user_id, _ in ratings}))))
+    keys = sorted(key for key in ratings if key[0] in user_ids and key[1] in movie_ids)
+    if not keys:
+        return set()
+
+    previous = {}
+    for chunk in _chunks(keys, RATING_UPSERT_CHUNK):
+        rows = db.execute(
+            select(models.Rating.user_id, models.Rating.movie_id, models.Rating.rating, models.Rating.rated_at)
+            .where(tuple_(models.Rating.user_id, models.Rating.movie_id).in_(chunk))
+        )
+        previous.update(((row.user_id, row.movie_id), row) for row in rows)
+
+    now = datetime.utcnow()
+    for chunk in _chunks(keys, RATING_UPSERT_CHUNK):
+        statement = UPSERT_INSERTS[dialect](models.Rating).values([
+            {"user_id": user_id, "movie_id": movie_id, "rating": ratings[user_id, movie_id], "rated_at": now}
+            for user_id, movie_id in chunk
+        ])
+        db.execute(statement.on_conflict_do_update(
+            index_elements=["user_id", "movie_id"],
+            set_={"rating": statement.excluded.rating, "rated_at": statement.excluded.rated_at},
+        ))
+
+    deltas = defaultdict(lambda: [0, 0.0])
+    for key in keys:
+        delta = deltas[key[1]]
+        if key in previous:
+            delta[1] += ratings[key] - previous[key].rating
+        else:
+            delta[0] += 1
+            delta[1] += ratings[key]
+    for movie_id in sorted(deltas):
+        _apply_rating_delta(db, movie_id, *deltas[movie_id])
+    leaderboards.record_ratings(
+        db,
+        [(movie_id, ratings[user_id, movie_id], now) for user_id, movie_id in keys],
+        [(row.movie_id, row.rating, row.rated_at) for row in previous.values()],
+    )
+    db.commit()
+    for movie_id in deltas:
+        cache.invalidate_movie(movie_id)
+    return set(deltas)
+
 def get_rating(db: Session, rating_id: int) -> Optional[models.Rating]:
     return db.query(models.Rating).filter(models.Rating.id == rating_id).first()
 
-def get_ratings_for_movie(db: Session, movie_id: int):
-    return db.query(models.Rating).filter(models.Rating.movie_id == movie_id).all()
+def get_ratings_for_movie(db: Session, movie_id: int, limit: int = 100, cursor: Optional[str] = None) -> Page:
+    query = db.query(models.Rating).filter(models.Rating.movie_id == movie_id)
+    return paginate(query, [models.Rating.id], cursor=cursor, limit=limit)
 
-def get_ratings(db: Session, skip: int = 0, limit: int = 10) -> List[models.Rating]:
-    return db.query(models.Rating).offset(skip).limit(limit).all()
+# get_ratings_for_movie as plain dicts with the fields of schemas.Rating
+RATING_ROW_COLUMNS = [getattr(models.Rating, name) for name in schemas.Rating.model_fields]
+
+def get_rating_rows(db: Session, movie_id: int, limit: int = 100, cursor: Optional[str] = None) -> Page:
+    query = db.query(*RATING_ROW_COLUMNS).filter(models.Rating.movie_id == movie_id)
+    page = paginate(query, [models.Rating.id], cursor=cursor, limit=limit)
+    return Page([row._asdict() for row in page.items], page.next_cursor)
+
+def get_ratings(db: Session, skip: int = 0, limit: int = 10, cursor: Optional[str] = None) -> Page:
+    return paginate(db.query(models.Rating), [models.Rating.id], cursor=cursor, limit=limit, skip=skip)
 
 def delete_rating(db: Session, rating_id: int):
     db_rating = db.query(models.Rating).filter(models.Rating.id == rating_id).first()
     if db_rating:
+        _apply_rating_delta(db, db_rating.movie_id, -1, -db_rating.rating)
+        leaderboards.record_ratings(db, [], [(db_rating.movie_id, db_rating.rating, db_rating.rated_at)])
         db.delete(db_rating)
         db.commit()
+        cache.invalidate_movie(db_rating.movie_id)
+
+# O(1) read of the maintained aggregates, without touching the ratings table
+def get_rating_summary(db: Session, movie_id: int) -> Optional[schemas.RatingSummary]:
+    row = db.execute(
+        select(models.Movie.id, models.Movie.rating_count, models.Movie.rating_sum, models.Movie.rating_average)
+        .where(models.Movie.id == movie_id)
+    ).first()
+    if row is None:
+        return None
+    return schemas.RatingSummary(movie_id=row.id, rating_count=row.rating_count,
+                                 rating_sum=row.rating_sum, average=row.rating_average)
+
+# Rebuild every movie's aggregates from the ratings table, e.g. to backfill
+# existing data after adding the columns
+def recompute_rating_aggregates(db: Session):
+    count = select(func.count(models.Rating.id)).where(models.Rating.movie_id == models.Movie.id).scalar_subquery()
+    total = select(func.coalesce(func.sum(models.Rating.rating), 0.0)).where(models.Rating.movie_id == models.Movie.id).scalar_subquery()
+    average = select(func.avg(models.Rating.rating)).where(models.Rating.movie_id == models.Movie.id).scalar_subquery()
+    db.execute(
+        update(models.Movie).values(rating_count=count, rating_sum=total, rating_average=average),
+        execution_options={"synchronize_session": False},
+    )
+    db.commit()
+
+# The top `limit` movies of a leaderboard with their scores: one index range
+# scan of the precomputed list, then the movies with one IN query
+def get_leaderboard(db: Session, window: str = "all", genre_id: Optional[int] = None,
+                    limit: int = 10) -> List[schemas.LeaderboardEntry]:
+    entries = leaderboards.top(db, window, genre_id or leaderboards.ALL_GENRES, limit)
+    movies = get_movies_by_ids(db, [entry.movie_id for entry in entries])
+    return [
+        schemas.LeaderboardEntry(rank=rank, score=entry.score, votes=entry.votes, average=entry.average,
+                                 movie=schemas.Movie.model_validate(movie))
+        for rank, (entry, movie) in enumerate(zip(entries, movies), start=1) if movie is not None
+    ]
+
+# A movie's precomputed most similar movies, or None if the movie does not exist
+def get_similar_movies(db: Session, movie_id: int, limit: int = 10) -> Optional[List[schemas.SimilarMovie]]:
+    neighbors = recommendations.similar(db, movie_id, limit)
+    if not neighbors and get_movie_version(db, movie_id) is None:
+        return None
+    movies = get_movies_by_ids(db, [neighbor.neighbor_id for neighbor in neighbors])
+    return [
+        schemas.SimilarMovie(similarity=neighbor.similarity, movie=schemas.Movie.model_validate(movie))
+        for neighbor, movie in zip(neighbors, movies) if movie is not None
+    ]
+
+# Recommendations for a user from the similar-movie lists of their ratings
+def get_recommendations(db: Session, user_id: int, limit: int = 10) -> List[schemas.Recommendation]:
+    scored = recommendations.for_user(db, user_id, limit)
+    movies = get_movies_by_ids(db, [row.neighbor_id for row in scored])
+    return [
+        schemas.Recommendation(score=row.score, movie=schemas.Movie.model_validate(movie))
+        for row, movie in zip(scored, movies) if movie is not None
+    ]
 
 # User CRUD Operations
 
@@ -164,14 +612,23 @@ def get_user_by_email(db: Session, email: str) -> Optional[models.User]:
 def get_user_by_username(db: Session, username: str) -> Optional[models.User]:
     return db.query(models.User).filter(models.User.username == username).first()
 
-def get_users(db: Session, skip: int = 0, limit: int = 10) -> List[models.User]:
-    return db.query(models.User).offset(skip).limit(limit).all()
+def get_users(db: Session, skip: int = 0, limit: int = 10, cursor: Optional[str] = None) -> Page:
+    return paginate(db.query(models.User), [models.User.id], cursor=cursor, limit=limit, skip=skip)
+
+def deactivate_user(db: Session, user_id: int) -> Optional[models.User]:
+    db_user = db.query(models.User).filter(models.User.id == user_id).first()
+    if db_user:
+        db_user.is_active = False
+        db.commit()
+        cache.invalidate_user(user_id)
+    return db_user
 
 def delete_user(db: Session, user_id: int):
     db_user = db.query(models.User).filter(models.User.id == user_id).first()
     if db_user:
         db.delete(db_user)
         db.commit()
+        cache.invalidate_user(user_id)
 
 # Comment CRUD Operations
 def create_comment(db: Session, comment: schemas.CommentCreate, user_id: int):
@@ -184,5 +641,82 @@ def create_comment(db: Session, comment: schemas.CommentCreate, user_id: int):
 def get_comments_for_movie(db: Session, movie_id: int):
     return db.query(models.Comment).filter(models.Comment.movie_id == movie_id).all()
 
+# Upper bound for the max_depth of thread queries
+COMMENT_MAX_DEPTH = 10
+# Replies nested under each comment of a thread query; the rest are paged
+# through GET /comments/{id}/replies from the comment's replies_cursor
+COMMENT_MAX_REPLIES = int(os.getenv("COMMENT_MAX_REPLIES", "10"))
+
+# Load the reply trees under the given root comments with one recursive CTE,
+# down to max_depth levels and COMMENT_MAX_REPLIES replies per comment, and
+# assemble them in a single pass. Rows come back ordered by depth, so every
+# parent is built before its replies.
+def _load_comment_trees(db: Session, root_ids: List[int], max_depth: int) -> List[schemas.Comment]:
+    if not root_ids:
+        return []
+
+    comment = models.Comment
+    columns = (comment.id, comment.movie_id, comment.user_id, comment.content, comment.parent_id)
+    # The replies of the roots' movies, numbered within each parent; recursive
+    # CTE steps cannot use window functions themselves
+    replies = (
+        select(*columns, func.row_number().over(partition_by=comment.parent_id, order_by=comment.id).label("position"))
+        .where(comment.movie_id.in_(select(comment.movie_id).where(comment.id.in_(root_ids))),
+               comment.parent_id.is_not(None))
+        .subquery("replies")
+    )
+    tree = (
+        select(*columns, literal(0).label("depth"))
+        .where(comment.id.in_(root_ids))
+        .cte(name="comment_tree", recursive=True)
+    )
+    tree = tree.union_all(
+        select(replies.c.id, replies.c.movie_id, replies.c.user_id, replies.c.content, replies.c.parent_id,
+               (tree.c.depth + 1).label("depth"))
+        .join(tree, replies.c.parent_id == tree.c.id)
+        .where(tree.c.depth < max_depth, replies.c.position <= COMMENT_MAX_REPLIES)
+    )
+    reply_counts = (
+        select(comment.parent_id, func.count().label("reply_count"))
+        .where(comment.parent_id.in_(select(tree.c.id)))
+        .group_by(comment.parent_id)
+        .subquery("reply_counts")
+    )
+
+    nodes = {}
+    for row in db.execute(
+        select(tree, func.coalesce(reply_counts.c.reply_count, 0).label("reply_count"))
+        .outerjoin(reply_counts, reply_counts.c.parent_id == tree.c.id)
+        .order_by(tree.c.depth, tree.c.id)
+    ):
+        node = schemas.Comment(id=row.id, movie_id=row.movie_id, user_id=row.user_id, content=row.content,
+                               parent_id=row.parent_id, replies=[], reply_count=row.reply_count)
+        nodes[row.id] = node
+        if row.depth > 0:
+            nodes[row.parent_id].replies.append(node)
+    for node in nodes.values():
+        if node.replies and len(node.replies) < node.reply_count:
+            node.replies_cursor = encode_cursor([node.replies[-1].id])
+    return [nodes[root_id] for root_id in root_ids]
+
+# A page of a movie's top-level comments, each with its replies nested
+def get_comment_threads(db: Session, movie_id: int, cursor: Optional[str] = None,
+                        limit: int = 20, max_depth: int = 3) -> Page:
+    roots = select(models.Comment.id).where(models.Comment.movie_id == movie_id,
+                                            models.Comment.parent_id.is_(None))
+    page = page_of(db.execute(seek(roots, [models.Comment.id], cursor=cursor, limit=limit)).all(),
+                   [models.Comment.id], limit)
+    threads = _load_comment_trees(db, [row.id for row in page.items], min(max_depth, COMMENT_MAX_DEPTH))
+    return Page(threads, page.next_cursor)
+
+# A page of the direct replies to a comment, each with its own replies nested
+def get_comment_replies(db: Session, comment_id: int, cursor: Optional[str] = None,
+                        limit: int = 20, max_depth: int = 3) -> Page:
+    roots = select(models.Comment.id).where(models.Comment.parent_id == comment_id)
+    page = page_of(db.execute(seek(roots, [models.Comment.id], cursor=cursor, limit=limit)).all(),
+                   [models.Comment.id], limit)
+    replies = _load_comment_trees(db, [row.id for row in page.items], min(max_depth, COMMENT_MAX_DEPTH))
+    return Page(replies, page.next_cursor)
+
 def get_comment_by_id(db: Session, comment_id: int):
     return db.query(models.Comment).filter(models.Comment.id == comment_id).first()
\ No newline at end of file
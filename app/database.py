@@ -1,21 +1,186 @@
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from dotenv import load_dotenv
+import contextvars
 import os
+import threading
+import time
+from typing import Callable, Dict, Optional
 
-load_dotenv()
+from fastapi import Request
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.pool import QueuePool
+
+import app.metrics as metrics
+
+# The one declarative base every model is defined on
+Base = declarative_base()
 
 # Fetch DATABASE_URL from environment variables
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-if DATABASE_URL is None:
-    raise ValueError("DATABASE_URL environment variable is not set")
+# Optional read replica for the read endpoints (get_read_db). After a write, the
+# writing client's reads go to the primary for READ_YOUR_WRITES_SECONDS through
+# a cookie; everyone else keeps reading the replica. So that in-process caches
+# are not refilled from a replica that has not caught up with the write that
+# invalidated them, replica reads are not cached for READ_YOUR_WRITES_SECONDS
+# after an invalidation (see replica_settle).
+READ_DATABASE_URL = os.getenv("READ_DATABASE_URL")
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+READ_PRIMARY_COOKIE = "read_primary_until"
 
-# Create SQLAlchemy engine
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
+# Connection pool settings, applied to every engine. Size, overflow and timeout
+# only apply to queue pools; SQLite memory databases and aiosqlite use others.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+def engine_options(url: str) -> dict:
+    parsed = make_url(url)
+    options = {"pool_pre_ping": DB_POOL_PRE_PING, "pool_recycle": DB_POOL_RECYCLE}
+    if issubclass(parsed.get_dialect().get_pool_class(parsed), QueuePool):
+        options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+    return options
+
+# Async mode: DATABASE_MODE=async serves the read endpoints from an AsyncEngine
+# instead of the threadpool. The async URL defaults to DATABASE_URL with its
+# driver swapped (asyncpg for Postgres, aiosqlite for SQLite).
+DATABASE_MODE = os.getenv("DATABASE_MODE", "sync")
+
+if DATABASE_MODE not in ("sync", "async"):
+    raise ValueError("DATABASE_MODE must be 'sync' or 'async'")
+
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+def to_async_url(url: str) -> str:
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for '{backend}' databases")
+    return parsed.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL")
+ASYNC_READ_DATABASE_URL = os.getenv("ASYNC_READ_DATABASE_URL")
+
+def _require(url: Optional[str]) -> str:
+    if url is None:
+        raise ValueError("DATABASE_URL environment variable is not set")
+    return url
+
+# Engines are created on first use rather than at import, so importing the app
+# loads no database driver and opens no connection until a request needs one.
+# Each is registered under its pool name for the metrics.
+_lock = threading.Lock()
+_engines: Dict[str, object] = {}
+
+def _lazy_engine(name: str, create: Callable[[], object], factory) -> object:
+    engine = _engines.get(name)
+    if engine is None:
+        with _lock:
+            engine = _engines.get(name)
+            if engine is None:
+                engine = create()
+                metrics.instrument_engine(getattr(engine, "sync_engine", engine), name)
+                factory.configure(bind=engine)
+                _engines[name] = engine
+    return engine
+
+def get_engine() -> Engine:
+    def create():
+        url = _require(DATABASE_URL)
+        return create_engine(url, **engine_options(url))
+    return _lazy_engine("sync", create, SessionLocal)
+
+def get_read_engine() -> Engine:
+    if READ_DATABASE_URL is None:
+        engine = get_engine()
+        ReadSessionLocal.configure(bind=engine)
+        return engine
+    return _lazy_engine("replica", lambda: create_engine(READ_DATABASE_URL, **engine_options(READ_DATABASE_URL)),
+                        ReadSessionLocal)
+
+# Only build the async engines when they are used, so sync deployments do not need the async driver
+def get_async_engine() -> AsyncEngine:
+    def create():
+        url = ASYNC_DATABASE_URL or to_async_url(_require(DATABASE_URL))
+        return create_async_engine(url, **engine_options(url))
+    return _lazy_engine("async", create, AsyncSessionLocal)
+
+def get_async_read_engine() -> AsyncEngine:
+    if READ_DATABASE_URL is None and ASYNC_READ_DATABASE_URL is None:
+        engine = get_async_engine()
+        AsyncReadSessionLocal.configure(bind=engine)
+        return engine
+    def create():
+        url = ASYNC_READ_DATABASE_URL or to_async_url(READ_DATABASE_URL)
+        return create_async_engine(url, **engine_options(url))
+    return _lazy_engine("async_replica", create, AsyncReadSessionLocal)
+
+# Close pooled connections at shutdown; a disposed engine reconnects if used again
+async def dispose_engines():
+    for engine in list(_engines.values()):
+        if isinstance(engine, AsyncEngine):
+            await engine.dispose()
+        else:
+            engine.dispose()
+
+
+# Session factories that create their engine on the first session
+class _LazySessionmaker(sessionmaker):
+    def __init__(self, create_bind: Callable[[], object], **kw):
+        super().__init__(**kw)
+        self._create_bind = create_bind
+
+    def __call__(self, **local_kw):
+        if "bind" not in local_kw and self.kw.get("bind") is None:
+            self._create_bind()
+        return super().__call__(**local_kw)
+
+class _LazyAsyncSessionmaker(async_sessionmaker):
+    def __init__(self, create_bind: Callable[[], object], **kw):
+        super().__init__(**kw)
+        self._create_bind = create_bind
+
+    def __call__(self, **local_kw):
+        if "bind" not in local_kw and self.kw.get("bind") is None:
+            self._create_bind()
+        return super().__call__(**local_kw)
+
+SessionLocal = _LazySessionmaker(get_engine, autocommit=False, autoflush=False)
+ReadSessionLocal = _LazySessionmaker(get_read_engine, autocommit=False, autoflush=False)
+AsyncSessionLocal = _LazyAsyncSessionmaker(get_async_engine, autoflush=False, expire_on_commit=False, class_=AsyncSession)
+AsyncReadSessionLocal = _LazyAsyncSessionmaker(get_async_read_engine, autoflush=False, expire_on_commit=False,
+                                               class_=AsyncSession)
+
+
+# Read-your-writes: commits on the primary are recorded for the current request
+# through a holder the middleware puts in the context
+_request_writes: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("request_writes", default=None)
+
+@event.listens_for(SessionLocal, "after_commit")
+def _record_write(session):
+    writes = _request_writes.get()
+    if writes is not None:
+        writes.append(time.time())
+
+def reads_from_primary(request: Request) -> bool:
+    now = time.time()
+    try:
+        until = float(request.cookies.get(READ_PRIMARY_COOKIE, 0))
+    except ValueError:
+        return False
+    # A client can only extend its own stickiness by writing
+    return now < until <= now + READ_YOUR_WRITES_SECONDS
+
+# Seconds after an invalidation during which values read through `db` must not
+# be cached: the replica lag allowance for replica sessions, 0 for the primary
+def replica_settle(db) -> float:
+    return READ_YOUR_WRITES_SECONDS if db.info.get("replica") else 0
 
 def get_db():
     db = SessionLocal()
@@ -23,3 +188,60 @@ def get_db():
         yield db
     finally:
         db.close()
+
+# Session for read-only endpoints: the replica when one is configured
+def get_read_db(request: Request):
+    replica = READ_DATABASE_URL is not None and not reads_from_primary(request)
+    db = ReadSessionLocal(info={"replica": True}) if replica else SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def get_async_read_db(request: Request):
+    replica = (READ_DATABASE_URL or ASYNC_READ_DATABASE_URL) is not None and not reads_from_primary(request)
+    async with (AsyncReadSessionLocal(info={"replica": True}) if replica else AsyncSessionLocal()) as db:
+        yield db
+
+
+# ASGI middleware: after a request that committed to the primary, sets a cookie
+# keeping the client's reads on the primary for READ_YOUR_WRITES_SECONDS
+class ReadYourWritesMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        writes = []
+        token = _request_writes.set(writes)
+
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start" and writes:
+                until = writes[-1] + READ_YOUR_WRITES_SECONDS
+                cookie = (f"{READ_PRIMARY_COOKIE}={until:.3f}; Max-Age={int(READ_YOUR_WRITES_SECONDS) + 1}; "
+                          "Path=/; HttpOnly; SameSite=Lax")
+                message = dict(message, headers=list(message.get("headers", [])) + [(b"set-cookie", cookie.encode())])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_cookie)
+        finally:
+            _request_writes.reset(token)
+
+
+# `from app.database import engine` keeps working, creating the engine when accessed
+def __getattr__(name):
+    if name == "engine":
+        return get_engine()
+    if name == "async_engine":
+        return get_async_engine()
+    if name == "read_engine":
+        return get_read_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,76 @@
+import csv
+import io
+import os
+from datetime import datetime
+from typing import Iterator, List, Optional
+
+import orjson
+from sqlalchemy import select
+
+import app.crud as crud
+import app.models as models
+from app.database import ReadSessionLocal
+
+# Rows fetched per round trip from the server-side cursor
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+EXPORT_COLUMNS = (
+    models.Movie.id, models.Movie.title, models.Movie.description, models.Movie.release_date,
+    models.Movie.duration, models.Movie.rating, models.Movie.language, models.Movie.poster_url,
+    models.Movie.trailer_url, models.Movie.director_id, models.Movie.rating_count,
+    models.Movie.rating_average, models.Movie.created_at, models.Movie.updated_at,
+)
+EXPORT_FIELDS = [column.key for column in EXPORT_COLUMNS] + ["genre_ids", "cast_ids"]
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+# Stream movies in batches from a server-side cursor (yield_per), joining in
+# the genre and cast ids of each batch with one query per association table,
+# so memory stays flat whatever the catalog size. Reads go to the replica
+# when one is configured.
+def iter_movie_batches(updated_since: Optional[datetime] = None) -> Iterator[List[dict]]:
+    db = ReadSessionLocal()
+    try:
+        stmt = select(*EXPORT_COLUMNS)
+        if updated_since is not None:
+            stmt = stmt.where(models.Movie.updated_at >= updated_since).order_by(models.Movie.updated_at, models.Movie.id)
+        else:
+            stmt = stmt.order_by(models.Movie.id)
+
+        result = db.execute(stmt, execution_options={"yield_per": EXPORT_BATCH_SIZE})
+        for partition in result.partitions():
+            movie_ids = [row.id for row in partition]
+            genres = crud.get_related_ids(db, models.MovieGenre.movie_id, models.MovieGenre.genre_id, movie_ids)
+            cast = crud.get_related_ids(db, models.movie_actor_association.c.movie_id, models.movie_actor_association.c.actor_id, movie_ids)
+            yield [
+                dict(row._mapping, genre_ids=genres.get(row.id, []), cast_ids=cast.get(row.id, []))
+                for row in partition
+            ]
+    finally:
+        db.close()
+
+
+def ndjson_stream(updated_since: Optional[datetime] = None) -> Iterator[bytes]:
+    for batch in iter_movie_batches(updated_since):
+        yield b"".join(orjson.dumps(movie, option=orjson.OPT_APPEND_NEWLINE) for movie in batch)
+
+
+# CSV with one header row; id lists are space separated
+def csv_stream(updated_since: Optional[datetime] = None) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    for batch in iter_movie_batches(updated_since):
+        for movie in batch:
+            movie["genre_ids"] = " ".join(map(str, movie["genre_ids"]))
+            movie["cast_ids"] = " ".join(map(str, movie["cast_ids"]))
+            writer.writerow(movie)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
@@ -0,0 +1,106 @@
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+import orjson
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import app.models as models
+import app.schemas as schemas
+
+# Every genre, held in memory by each worker. Genres are a handful of rows
+# that rarely change, so movie writes validate and resolve their genre_ids
+# here instead of querying, and GET /genres/ is served from a body encoded
+# once per load.
+#
+# Each load is an immutable, numbered snapshot that replaces the previous one
+# whole, so a reader never sees half of a reload. crud.create_genre and
+# crud.delete_genre reload it in the writing worker as soon as they commit;
+# other workers pick the change up after GENRE_REGISTRY_TTL seconds, or at
+# once when a movie names a genre id their snapshot does not have.
+GENRE_REGISTRY_TTL = float(os.getenv("GENRE_REGISTRY_TTL", "60"))
+
+
+class Snapshot(NamedTuple):
+    version: int
+    genres: Dict[int, schemas.Genre]
+    ids_by_name: Dict[str, int]
+    body: bytes
+    loaded_at: float
+
+
+class GenreRegistry:
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._snapshot: Optional[Snapshot] = None
+        self._version = 0
+        # Serializes loads, so a slow load cannot replace a newer snapshot
+        self._lock = threading.Lock()
+        self.loads = 0
+
+    def load(self, db: Session) -> Snapshot:
+        with self._lock:
+            rows = db.execute(select(models.Genre.id, models.Genre.name).order_by(models.Genre.id)).all()
+            genres = {row.id: schemas.Genre(id=row.id, name=row.name) for row in rows}
+            self._version += 1
+            self.loads += 1
+            self._snapshot = Snapshot(
+                version=self._version,
+                genres=genres,
+                ids_by_name={genre.name: genre.id for genre in genres.values()},
+                body=orjson.dumps([genre.model_dump() for genre in genres.values()]),
+                loaded_at=time.monotonic(),
+            )
+            return self._snapshot
+
+    # The current snapshot, loaded first if there is none or it expired
+    def snapshot(self, db: Session) -> Snapshot:
+        snapshot = self._snapshot
+        if snapshot is None or time.monotonic() - snapshot.loaded_at >= self.ttl:
+            snapshot = self.load(db)
+        return snapshot
+
+    # Drop the snapshot; the next use loads a new one
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+
+    def get(self, db: Session, genre_id: int) -> Optional[schemas.Genre]:
+        return self.snapshot(db).genres.get(genre_id)
+
+    def all(self, db: Session) -> List[schemas.Genre]:
+        return list(self.snapshot(db).genres.values())
+
+    # GET /genres/ as JSON
+    def body(self, db: Session) -> bytes:
+        return self.snapshot(db).body
+
+    def id_of(self, db: Session, name: str) -> Optional[int]:
+        return self.snapshot(db).ids_by_name.get(name)
+
+    # The given ids without duplicates, in order, and the ones that name no
+    # genre. An unknown id may be a genre another worker just created, so the
+    # snapshot is reloaded once before an id is reported unknown.
+    def resolve(self, db: Session, genre_ids: Iterable[int]):
+        genre_ids = list(dict.fromkeys(genre_ids))
+        snapshot = self.snapshot(db)
+        unknown = [genre_id for genre_id in genre_ids if genre_id not in snapshot.genres]
+        if unknown:
+            snapshot = self.load(db)
+            unknown = [genre_id for genre_id in unknown if genre_id not in snapshot.genres]
+        return genre_ids, unknown
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        return {
+            "version": snapshot.version if snapshot else None,
+            "genres": len(snapshot.genres) if snapshot else 0,
+            "age_seconds": time.monotonic() - snapshot.loaded_at if snapshot else None,
+            "ttl_seconds": self.ttl,
+            "loads": self.loads,
+        }
+
+
+registry = GenreRegistry(GENRE_REGISTRY_TTL)
@@ -0,0 +1,123 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+# Password hashing configuration
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+# bcrypt work runs on a dedicated pool instead of the request threads:
+# HASH_EXECUTOR   "process" (default, parallel across cores) or "thread"
+# HASH_WORKERS    pool size
+# HASH_CONCURRENCY  hashes in flight at once, the rest wait in a queue
+# HASH_MAX_QUEUE  waiting hashes beyond which requests are rejected with 503;
+#                 0 rejects whatever cannot start at once
+HASH_EXECUTOR = os.getenv("HASH_EXECUTOR", "process")
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(os.cpu_count() or 1)))
+HASH_CONCURRENCY = int(os.getenv("HASH_CONCURRENCY", str(HASH_WORKERS)))
+HASH_MAX_QUEUE = int(os.getenv("HASH_MAX_QUEUE", "64"))
+
+if HASH_EXECUTOR not in ("process", "thread"):
+    raise ValueError("HASH_EXECUTOR must be 'process' or 'thread'")
+
+
+# Worker functions, importable by the pool's child processes
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+def _verify(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+class HashingPool:
+    def __init__(self, kind: str, workers: int, concurrency: int, max_queue: int):
+        self.kind = kind
+        self.workers = workers
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self._executor: Optional[Executor] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop = None
+        # Counters are only touched from the event loop
+        self.queued = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.max_queued = 0
+        self.wait_seconds = 0.0
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                # spawn: forking a process that runs an event loop and threads is unsafe
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            else:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="hashing")
+        return self._executor
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._loop = loop
+        return self._semaphore
+
+    async def run(self, fn, *args):
+        semaphore = self._get_semaphore()
+        if semaphore.locked() and self.queued >= self.max_queue:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many concurrent password checks, retry shortly",
+                headers={"Retry-After": "1"},
+            )
+
+        loop = asyncio.get_running_loop()
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        started = loop.time()
+        try:
+            await semaphore.acquire()
+        finally:
+            self.queued -= 1
+        self.wait_seconds += loop.time() - started
+
+        self.in_flight += 1
+        try:
+            return await loop.run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "executor": self.kind,
+            "workers": self.workers,
+            "concurrency": self.concurrency,
+            "max_queue": self.max_queue,
+            "queued": self.queued,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "max_queued": self.max_queued,
+            "wait_seconds": self.wait_seconds,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+pool = HashingPool(HASH_EXECUTOR, HASH_WORKERS, HASH_CONCURRENCY, HASH_MAX_QUEUE)
+
+async def hash_password(password: str) -> str:
+    return await pool.run(_hash, password)
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await pool.run(_verify, plain_password, hashed_password)
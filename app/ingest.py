@@ -0,0 +1,169 @@
+import os
+from typing import AsyncIterator, List, Optional, Set, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+import app.cache as cache
+import app.genres as genres
+import app.models as models
+import app.schemas as schemas
+import app.search as search
+
+# Rows written per multi-row INSERT and commit
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+# Per-row errors listed in the result; further failures are only counted
+BULK_MAX_REPORTED_ERRORS = int(os.getenv("BULK_MAX_REPORTED_ERRORS", "1000"))
+# Longest accepted NDJSON line, so one runaway line cannot exhaust memory
+BULK_MAX_LINE_BYTES = 1024 * 1024
+
+Row = Tuple[int, schemas.MovieCreate]
+
+
+def _record_error(result: schemas.BulkIngestResult, line: int, error: str):
+    result.failed += 1
+    if len(result.errors) < BULK_MAX_REPORTED_ERRORS:
+        result.errors.append(schemas.BulkIngestError(line=line, error=error))
+
+
+def _validation_message(exc: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in error['loc']) or 'row'}: {error['msg']}" for error in exc.errors()
+    )
+
+
+# Split a byte stream into lines without buffering more than one line. A line
+# longer than BULK_MAX_LINE_BYTES is yielded as None and the rest of it is
+# skipped up to its newline, so it fails as one row and the stream goes on.
+async def _lines(stream: AsyncIterator[bytes]) -> AsyncIterator[Optional[bytes]]:
+    buffer = b""
+    skipping = False
+    async for data in stream:
+        if skipping:
+            end = data.find(b"\n")
+            if end < 0:
+                continue
+            data, skipping = data[end + 1:], False
+        buffer += data
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield None if len(line) > BULK_MAX_LINE_BYTES else line
+        if len(buffer) > BULK_MAX_LINE_BYTES:
+            yield None
+            buffer, skipping = b"", True
+    if buffer:
+        yield buffer
+
+
+def _existing_ids(db: Session, column, ids: Set[int]) -> Set[int]:
+    if not ids:
+        return set()
+    return set(db.scalars(select(column).where(column.in_(ids))))
+
+
+def _insert_movies(db: Session, rows: List[Row], owner_id: int):
+    movie_ids = db.scalars(
+        insert(models.Movie).returning(models.Movie.id, sort_by_parameter_order=True),
+        [
+            dict(
+                movie.model_dump(exclude={"genre_ids", "cast_ids"}),
+                genre_id=movie.genre_ids[0] if movie.genre_ids else None,
+                owner_id=owner_id,
+            )
+            for _, movie in rows
+        ],
+    ).all()
+
+    genre_rows = [
+        {"movie_id": movie_id, "genre_id": genre_id}
+        for movie_id, (_, movie) in zip(movie_ids, rows)
+        for genre_id in dict.fromkeys(movie.genre_ids or ())
+    ]
+    if genre_rows:
+        db.execute(insert(models.MovieGenre.__table__), genre_rows)
+
+    actor_rows = [
+        {"movie_id": movie_id, "actor_id": actor_id}
+        for movie_id, (_, movie) in zip(movie_ids, rows)
+        for actor_id in dict.fromkeys(movie.cast_ids or ())
+    ]
+    if actor_rows:
+        db.execute(insert(models.movie_actor_association), actor_rows)
+
+    search.index_movies(db, movie_ids)
+
+
+# Write one chunk: resolve every genre reference of the chunk against the
+# genre registry and every director and actor reference with one query per
+# table, then insert the valid rows together. If the chunk still fails, retry
+# its rows one at a time to isolate the bad ones.
+def write_chunk(db: Session, chunk: List[Row], owner_id: int, result: schemas.BulkIngestResult):
+    _, unknown_genres = genres.registry.resolve(db, (i for _, movie in chunk for i in movie.genre_ids or ()))
+    unknown_genres = set(unknown_genres)
+    directors = _existing_ids(db, models.Director.id, {movie.director_id for _, movie in chunk if movie.director_id is not None})
+    actors = _existing_ids(db, models.Actor.id, {i for _, movie in chunk for i in movie.cast_ids or ()})
+
+    rows = []
+    for line, movie in chunk:
+        missing = []
+        if set(movie.genre_ids or ()) & unknown_genres:
+            missing.append(f"genre ids {sorted(set(movie.genre_ids) & unknown_genres)}")
+        if movie.director_id is not None and movie.director_id not in directors:
+            missing.append(f"director id {movie.director_id}")
+        if set(movie.cast_ids or ()) - actors:
+            missing.append(f"actor ids {sorted(set(movie.cast_ids) - actors)}")
+        if missing:
+            _record_error(result, line, "Unknown " + ", ".join(missing))
+        else:
+            rows.append((line, movie))
+    if not rows:
+        return
+
+    try:
+        _insert_movies(db, rows, owner_id)
+        db.commit()
+        result.inserted += len(rows)
+    except SQLAlchemyError:
+        db.rollback()
+        for row in rows:
+            try:
+                _insert_movies(db, [row], owner_id)
+                db.commit()
+                result.inserted += 1
+            except SQLAlchemyError as exc:
+                db.rollback()
+                _record_error(result, row[0], str(getattr(exc, "orig", exc)))
+    # New movies are appended after the current last page, and may match any filter
+    cache.movie_cache.invalidate_tags(cache.MOVIE_LIST_TAIL, cache.MOVIE_LIST_FILTERED)
+
+
+# Ingest a stream of NDJSON movies (one schemas.MovieCreate per line) in
+# chunks of `chunk_size`, holding at most one chunk in memory
+async def ingest_ndjson(stream: AsyncIterator[bytes], db: Session, owner_id: int,
+                        chunk_size: int = BULK_CHUNK_SIZE) -> schemas.BulkIngestResult:
+    result = schemas.BulkIngestResult()
+    chunk: List[Row] = []
+    line_number = 0
+    async for line in _lines(stream):
+        line_number += 1
+        if line is None:
+            result.received += 1
+            _record_error(result, line_number, f"Line longer than {BULK_MAX_LINE_BYTES} bytes")
+            continue
+        if not line.strip():
+            continue
+        result.received += 1
+        try:
+            chunk.append((line_number, schemas.MovieCreate.model_validate_json(line)))
+        except ValidationError as exc:
+            _record_error(result, line_number, _validation_message(exc))
+            continue
+        if len(chunk) >= chunk_size:
+            await run_in_threadpool(write_chunk, db, chunk, owner_id, result)
+            chunk = []
+    if chunk:
+        await run_in_threadpool(write_chunk, db, chunk, owner_id, result)
+    return result
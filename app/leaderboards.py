@@ -0,0 +1,245 @@
+import os
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from time import monotonic
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import Date, delete, func, insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+import app.models as models
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Top rated movies, precomputed per window and genre (genre_id 0 is the list
+# over all genres) in leaderboard_entries, so reading a list is a range scan
+# of its first k rows however many ratings there are.
+#
+# Scores are Bayesian averages, (rating_sum + m * C) / (votes + m), where m is
+# LEADERBOARD_MIN_VOTES and C the window's mean rating from leaderboard_priors:
+# a movie needs around m votes before its own average outweighs the mean.
+# "all" is computed from the movies' rating aggregates, "week" from per-day
+# rating buckets of the last 7 days.
+#
+# Rating writes refresh the rated movies' entries in their own transaction.
+# Priors, and week scores of movies not rated since older ratings left the
+# window, only move on a rebuild, which should run daily:
+#
+#     python -m app.leaderboards
+#
+# A window without ratings gets the all-time mean as its prior, or
+# LEADERBOARD_DEFAULT_PRIOR when there are no ratings at all, so a rebuild
+# stores a prior for every window. Workers read the stored priors with one
+# query every LEADERBOARD_PRIORS_TTL seconds.
+LEADERBOARD_MIN_VOTES = float(os.getenv("LEADERBOARD_MIN_VOTES", "10"))
+LEADERBOARD_DEFAULT_PRIOR = float(os.getenv("LEADERBOARD_DEFAULT_PRIOR", "5"))
+LEADERBOARD_PRIORS_TTL = float(os.getenv("LEADERBOARD_PRIORS_TTL", "300"))
+
+# Window name -> days counted, None for all time
+WINDOWS: Dict[str, Optional[int]] = {"all": None, "week": 7}
+ALL_GENRES = 0
+# Day buckets older than the longest window are not kept
+BUCKET_DAYS = max(days for days in WINDOWS.values() if days)
+# Movies per refresh statement
+REFRESH_CHUNK = 1000
+
+UPSERT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+# (movie_id, rating, rated_at) of a rating added or removed
+Change = Tuple[int, float, Optional[datetime]]
+
+
+def _insert(db: Session, table):
+    dialect = db.get_bind().dialect.name
+    if dialect not in UPSERT_INSERTS:
+        raise ValueError(f"Leaderboards are not supported on '{dialect}' databases")
+    return UPSERT_INSERTS[dialect](table)
+
+
+def _chunks(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _window_start(days: int) -> date:
+    return datetime.utcnow().date() - timedelta(days=days - 1)
+
+
+# Record ratings added and removed (replacing a rating is both) in the day
+# buckets, then refresh the movies' entries; runs in the caller's transaction
+# after the movies' rating aggregates were moved
+def record_ratings(db: Session, added: Iterable[Change], removed: Iterable[Change] = ()):
+    oldest = _window_start(BUCKET_DAYS)
+    buckets = defaultdict(lambda: [0, 0.0])
+    movie_ids = set()
+    for sign, changes in ((1, added), (-1, removed)):
+        for movie_id, rating, rated_at in changes:
+            movie_ids.add(movie_id)
+            if rated_at is not None and rated_at.date() >= oldest:
+                bucket = buckets[movie_id, rated_at.date()]
+                bucket[0] += sign
+                bucket[1] += sign * rating
+
+    # Sorted, so concurrent writers lock the buckets in the same order
+    rows = [
+        {"movie_id": movie_id, "day": day, "votes": votes, "rating_sum": total}
+        for (movie_id, day), (votes, total) in sorted(buckets.items()) if votes or total
+    ]
+    table = models.MovieRatingDay.__table__
+    for chunk in _chunks(rows, REFRESH_CHUNK):
+        statement = _insert(db, table).values(chunk)
+        db.execute(statement.on_conflict_do_update(
+            index_elements=["movie_id", "day"],
+            set_={"votes": table.c.votes + statement.excluded.votes,
+                  "rating_sum": table.c.rating_sum + statement.excluded.rating_sum},
+        ))
+    refresh_movies(db, movie_ids)
+
+
+# Mean rating of each window, with the fallbacks above; scans the catalog and
+# the day buckets, so only a rebuild calls it
+def _compute_priors(db: Session) -> Dict[str, float]:
+    means = {}
+    for window, days in WINDOWS.items():
+        if days is None:
+            votes, total = db.execute(select(func.sum(models.Movie.rating_count), func.sum(models.Movie.rating_sum))).one()
+        else:
+            day = models.MovieRatingDay
+            votes, total = db.execute(
+                select(func.sum(day.votes), func.sum(day.rating_sum)).where(day.day >= _window_start(days))
+            ).one()
+        if votes:
+            means[window] = total / votes
+    fallback = means.get("all", LEADERBOARD_DEFAULT_PRIOR)
+    return {window: means.get(window, fallback) for window in WINDOWS}
+
+
+# (priors, loaded at) of the last read in this process
+_loaded_priors: Optional[Tuple[Dict[str, float], float]] = None
+
+# The priors stored by the last rebuild; LEADERBOARD_DEFAULT_PRIOR for windows
+# stored by none yet
+def _priors(db: Session) -> Dict[str, float]:
+    global _loaded_priors
+    loaded = _loaded_priors
+    if loaded is None or monotonic() - loaded[1] >= LEADERBOARD_PRIORS_TTL:
+        stored = dict(db.execute(select(models.LeaderboardPrior.period, models.LeaderboardPrior.mean)).all())
+        loaded = _loaded_priors = ({window: stored.get(window, LEADERBOARD_DEFAULT_PRIOR) for window in WINDOWS},
+                                   monotonic())
+    return loaded[0]
+
+
+# Drop this process's priors; the next refresh reads them again
+def invalidate_priors():
+    global _loaded_priors
+    _loaded_priors = None
+
+
+# (movie_id, votes, rating_sum) of the movies within a window
+def _window_totals(db: Session, movie_ids: List[int], days: Optional[int]):
+    if days is None:
+        movie = models.Movie
+        return db.execute(select(movie.id, movie.rating_count, movie.rating_sum).where(movie.id.in_(movie_ids)))
+    day = models.MovieRatingDay
+    return db.execute(
+        select(day.movie_id, func.sum(day.votes), func.sum(day.rating_sum))
+        .where(day.movie_id.in_(movie_ids), day.day >= _window_start(days))
+        .group_by(day.movie_id)
+    )
+
+
+# Recompute the entries of the given movies in every window and genre list
+def refresh_movies(db: Session, movie_ids: Iterable[int], priors: Optional[Dict[str, float]] = None):
+    movie_ids = sorted(set(movie_ids))
+    if not movie_ids:
+        return
+    priors = priors or _priors(db)
+    entry = models.LeaderboardEntry
+    for chunk in _chunks(movie_ids, REFRESH_CHUNK):
+        genres = defaultdict(lambda: [ALL_GENRES])
+        for movie_id, genre_id in db.execute(
+            select(models.MovieGenre.movie_id, models.MovieGenre.genre_id).where(models.MovieGenre.movie_id.in_(chunk))
+        ):
+            genres[movie_id].append(genre_id)
+
+        rows = []
+        for window, days in WINDOWS.items():
+            for movie_id, votes, total in _window_totals(db, chunk, days):
+                if not votes:
+                    continue
+                score = (total + LEADERBOARD_MIN_VOTES * priors[window]) / (votes + LEADERBOARD_MIN_VOTES)
+                rows += [
+                    {"period": window, "genre_id": genre_id, "movie_id": movie_id,
+                     "score": score, "votes": votes, "average": total / votes}
+                    for genre_id in genres[movie_id]
+                ]
+        db.execute(delete(entry).where(entry.movie_id.in_(chunk)))
+        if rows:
+            db.execute(insert(entry), rows)
+
+
+# Drop deleted movies from the lists and buckets
+def remove_movies(db: Session, movie_ids: Iterable[int]):
+    movie_ids = list(movie_ids)
+    if movie_ids:
+        db.execute(delete(models.LeaderboardEntry).where(models.LeaderboardEntry.movie_id.in_(movie_ids)))
+        db.execute(delete(models.MovieRatingDay).where(models.MovieRatingDay.movie_id.in_(movie_ids)))
+
+
+# Drop the list of a deleted genre
+def remove_genre(db: Session, genre_id: int):
+    db.execute(delete(models.LeaderboardEntry).where(models.LeaderboardEntry.genre_id == genre_id))
+
+
+# Rebuild buckets, priors and every list from the ratings table in one
+# transaction, so readers keep seeing the previous lists until it commits
+def rebuild(db: Session):
+    global _loaded_priors
+    rating, day = models.Rating, models.MovieRatingDay
+    rated_on = func.date(rating.rated_at, type_=Date)
+    db.execute(delete(day))
+    db.execute(insert(day).from_select(
+        ["movie_id", "day", "votes", "rating_sum"],
+        select(rating.movie_id, rated_on, func.count(rating.id), func.sum(rating.rating))
+        .where(rating.rated_at >= datetime.combine(_window_start(BUCKET_DAYS), time.min))
+        .group_by(rating.movie_id, rated_on),
+    ))
+
+    db.execute(delete(models.LeaderboardPrior))
+    priors = _compute_priors(db)
+    db.execute(insert(models.LeaderboardPrior), [{"period": window, "mean": mean} for window, mean in priors.items()])
+
+    db.execute(delete(models.LeaderboardEntry))
+    last_id = 0
+    while True:
+        movie_ids = db.scalars(
+            select(models.Movie.id).where(models.Movie.id > last_id, models.Movie.rating_count > 0)
+            .order_by(models.Movie.id).limit(REFRESH_CHUNK)
+        ).all()
+        if not movie_ids:
+            break
+        refresh_movies(db, movie_ids, priors)
+        last_id = movie_ids[-1]
+    db.commit()
+    _loaded_priors = (priors, monotonic())
+
+
+# The first `limit` entries of a list, best first
+def top(db: Session, window: str, genre_id: int = ALL_GENRES, limit: int = 10):
+    entry = models.LeaderboardEntry
+    return db.execute(
+        select(entry.movie_id, entry.score, entry.votes, entry.average)
+        .where(entry.period == window, entry.genre_id == genre_id)
+        .order_by(entry.score.desc(), entry.movie_id.desc())
+        .limit(limit)
+    ).all()
+
+
+if __name__ == "__main__":
+    from app.database import SessionLocal
+
+    with SessionLocal() as db:
+        rebuild(db)
+    logger.info("Leaderboards rebuilt")
@@ -1,29 +1,42 @@
-from fastapi import Depends, FastAPI, HTTPException, status
+import os
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import List, Literal, Optional
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Query, Request, Response, status
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
 from app.auth import (
-    get_password_hash, verify_password, create_access_token, authenticate_user,
+    get_password_hash, verify_password, create_access_token, authenticate_user, authenticate_user_async,
     verify_access_token, get_current_user, get_current_active_user, pwd_context
 )
 import app.crud as crud
 import app.schemas as schemas
 import app.models as models
-from app.database import engine, Base, SessionLocal, get_db
-from app.models import Base
-from logger import get_logger
-from dotenv import load_dotenv
-
-# Load environment variables from .env file
-load_dotenv()
+import app.cache as cache
+import app.export as export
+import app.genres as genres
+import app.search as search
+import app.hashing as hashing
+import app.ingest as ingest
+import app.metrics as metrics
+import app.rating_buffer as rating_buffer
+import app.views as views
+import app.migrate as migrate
+import app.database as database
+from app.database import SessionLocal, get_db, get_read_db, DATABASE_MODE
+from app.pagination import NEXT_CURSOR_HEADER
+from logger import get_logger, stop_logging, RequestIdMiddleware
 
 logger = get_logger(__name__)
 
-# Create all database tables
-Base.metadata.create_all(bind=engine)
+# Run the schema migration at startup. Off by default: deploys run
+# `python -m app.migrate` once, and workers touch no database before their first request
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "false").lower() in ("1", "true", "yes")
 
-# Initialize the FastAPI app
-app = FastAPI()
+router = APIRouter()
 
 class Token(BaseModel):
     access_token: str
@@ -33,9 +46,9 @@ class TokenRequest(BaseModel):
     username: str
     password: str
 
-@app.post("/token", response_model=Token)
-def login(form_data: TokenRequest, db: Session = Depends(get_db)):
-    user = authenticate_user(db, form_data.username, form_data.password)
+@router.post("/token", response_model=Token)
+async def login(form_data: TokenRequest, db: Session = Depends(get_db)):
+    user = await authenticate_user_async(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
     access_token = create_access_token(data={"sub": user.username})
@@ -53,16 +66,20 @@ def get_db():
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 # Endpoint to register a new user
-@app.post("/signup", response_model=schemas.User)
-def signup(user: schemas.UserCreate, db: Session = Depends(get_db)):
+# Existence checks run before hashing, so rejected signups cost no bcrypt work
+@router.post("/signup", response_model=schemas.User)
+async def signup(user: schemas.UserCreate, db: Session = Depends(get_db)):
     logger.info('Creating user...')
-    db_user = crud.get_user_by_username(db, username=user.username)
-    hashed_password = pwd_context.hash(user.password)
+    db_user = await run_in_threadpool(crud.get_user_by_username, db, username=user.username)
     if db_user:
-        logger.warning(f"User with username {user.username} already exists.")
+        logger.warning("User with username %s already exists.", user.username)
         raise HTTPException(status_code=400, detail="Username already registered")
+    if await run_in_threadpool(crud.get_user_by_email, db, email=user.email):
+        raise HTTPException(status_code=400, detail="Email already registered")
+    hashed_password = await hashing.hash_password(user.password)
+    db_user = await run_in_threadpool(crud.create_user, db=db, user=user, hashed_password=hashed_password)
     logger.info('User successfully created.')
-    return crud.create_user(db=db, user=user, hashed_password=hashed_password)
+    return db_user
 
 # Verify user credentials and return a user
 # def authenticate_user(db: Session, username: str, password: str):
@@ -74,14 +91,21 @@ def signup(user: schemas.UserCreate, db: Session = Depends(get_db)):
 #     return user
 
 # Endpoint to get current logged-in user
-@app.get("/users/me/", response_model=schemas.User)
-def read_users_me(current_user: schemas.User = Depends(get_current_active_user)):
-    return current_user
+@router.get("/users/me/", response_model=schemas.User)
+def read_users_me(current_user: schemas.Principal = Depends(get_current_active_user), db: Session = Depends(get_db)):
+    return crud.get_user(db, user_id=current_user.id)
+
+# Endpoint to get movie recommendations for the current user, based on their ratings
+@router.get("/users/me/recommendations", response_model=list[schemas.Recommendation])
+def read_recommendations(limit: int = Query(10, ge=1, le=100),
+                         current_user: schemas.Principal = Depends(get_current_active_user),
+                         db: Session = Depends(get_read_db)):
+    return crud.get_recommendations(db, user_id=current_user.id, limit=limit)
 
 # Endpoint to obtain a token
-@app.post("/login", response_model=schemas.Token)
-def login_for_access_token(db: Session = Depends(get_db), form_data: OAuth2PasswordRequestForm = Depends()):
-    user = authenticate_user(db, form_data.username, form_data.password)
+@router.post("/login", response_model=schemas.Token)
+async def login_for_access_token(db: Session = Depends(get_db), form_data: OAuth2PasswordRequestForm = Depends()):
+    user = await authenticate_user_async(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -93,27 +117,70 @@ def login_for_access_token(db: Session = Depends(get_db), form_data: OAuth2Passw
 
 
 # Endpoint to create a movie
-@app.post("/movies/", response_model=schemas.Movie)
-def create_movie(movie: schemas.MovieCreate, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_active_user)):
+@router.post("/movies/", response_model=schemas.Movie)
+def create_movie(movie: schemas.MovieCreate, db: Session = Depends(get_db), current_user: schemas.Principal = Depends(get_current_active_user)):
     return crud.create_movie(db=db, movie=movie, user_id=current_user.id)
 
-
-# Endpoint to get a list of movies
-@app.get("/movies/", response_model=list[schemas.Movie])
-def read_movies(skip: int = 0, limit: int = 10, db: Session = Depends(get_db)):
-    return crud.get_movies(db, skip=skip, limit=limit)
+# Endpoint to stream many movies in as NDJSON, one MovieCreate object per line
+@router.post("/movies/bulk", response_model=schemas.BulkIngestResult)
+async def bulk_create_movies(request: Request, chunk_size: int = Query(ingest.BULK_CHUNK_SIZE, ge=1, le=10000),
+                             db: Session = Depends(get_db), current_user: schemas.Principal = Depends(get_current_active_user)):
+    return await ingest.ingest_ndjson(request.stream(), db, owner_id=current_user.id, chunk_size=chunk_size)
+
+# Endpoint to get a list of movies, optionally filtered and sorted
+# Pass the X-Next-Cursor header of a response as `cursor` to fetch the next page
+# with the same filters and sort; `skip` is only kept for backward compatibility
+# with offset-paging clients.
+# Responses are served from the in-process movie cache when possible.
+@router.get("/movies/", response_model=list[schemas.Movie])
+def read_movies(request: Request, skip: int = 0, limit: int = 10, cursor: Optional[str] = None,
+                sort: schemas.MovieSortKey = "created_at", order: schemas.SortOrder = "asc",
+                filters: schemas.MovieFilters = Depends(), db: Session = Depends(get_read_db)):
+    return views.movie_list(db, request, skip, limit, cursor, sort, order, filters)
+
+# Endpoint to search movies by title, description and cast/director names, best matches first
+@router.get("/movies/search", response_model=list[schemas.Movie])
+def search_movies(response: Response, q: str = Query(..., min_length=1), limit: int = Query(10, ge=1, le=100),
+                  cursor: Optional[str] = None, db: Session = Depends(get_read_db)):
+    page = crud.search_movies(db, query=q, cursor=cursor, limit=limit)
+    if page.next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = page.next_cursor
+    return page.items
+
+# Endpoint to get the top rated movies of all time or of the last week,
+# optionally of one genre, from the precomputed leaderboards
+@router.get("/movies/top", response_model=list[schemas.LeaderboardEntry])
+def read_top_movies(genre_id: Optional[int] = None, window: schemas.LeaderboardWindow = "all",
+                    limit: int = Query(10, ge=1, le=100), db: Session = Depends(get_read_db)):
+    return views.top_movies(db, window, genre_id, limit)
+
+# Endpoint to stream the whole catalog as NDJSON or CSV, optionally only the
+# movies changed since a timestamp for incremental exports
+@router.get("/movies/export")
+def export_movies(export_format: Literal["ndjson", "csv"] = Query("ndjson", alias="format"), updated_since: Optional[datetime] = None,
+                  current_user: schemas.Principal = Depends(get_current_user)):
+    stream = export.ndjson_stream if export_format == "ndjson" else export.csv_stream
+    return StreamingResponse(
+        stream(updated_since),
+        media_type=export.MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f"attachment; filename=movies.{export_format}"},
+    )
+
+# Endpoint to get several movies by ID in one request, in the requested order
+# Cached movies come from the movie cache, the rest are loaded with one query.
+@router.get("/movies/batch", response_model=list[schemas.MovieBatchItem])
+def read_movie_batch(ids: List[int] = Query(..., min_length=1, max_length=crud.MOVIE_BATCH_MAX_IDS),
+                     db: Session = Depends(get_read_db)):
+    return views.movie_batch(db, ids)
 
 # Endpoint to get a specific movie added by ID (public access)
-@app.get("/movies/{movie_id}", response_model=schemas.Movie)
-def read_movie(movie_id: int, db: Session = Depends(get_db)):
-    db_movie = crud.get_movie_by_id(db, movie_id=movie_id)
-    if db_movie is None:
-        raise HTTPException(status_code=404, detail="Movie not found")
-    return db_movie
+@router.get("/movies/{movie_id}", response_model=schemas.MovieDetail)
+def read_movie(movie_id: int, request: Request, db: Session = Depends(get_read_db)):
+    return views.movie_detail(db, request, movie_id)
 
 # Endpoint to update a movie
-@app.put("/movies/{movie_id}", response_model=schemas.Movie)
-def update_movie(movie_id: int, movie: schemas.MovieCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+@router.put("/movies/{movie_id}", response_model=schemas.Movie)
+def update_movie(movie_id: int, movie: schemas.MovieCreate, db: Session = Depends(get_db), current_user: schemas.Principal = Depends(get_current_user)):
     db_movie = crud.get_movie_by_id(db, movie_id=movie_id)
     if db_movie is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Movie not found")
@@ -121,7 +188,7 @@ def update_movie(movie_id: int, movie: schemas.MovieCreate, db: Session = Depend
     if db_movie.owner_id != current_user.id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to edit this movie")
     
-    return crud.update_movie(db=db, movie=movie, movie_id=movie_id, user_id=current_user.id)
+    return crud.update_movie(db=db, movie_id=movie_id, movie_update=movie)
 
 # Endpoint to delete a movie
 # @app.delete("/movies/{movie_id}", response_model=schemas.Movie)
@@ -129,8 +196,8 @@ def update_movie(movie_id: int, movie: schemas.MovieCreate, db: Session = Depend
 #     return crud.delete_movie(db=db, movie_id=movie_id)
 
 #Endpoint to delete a movie only by a user who listed it
-@app.delete("/movies/{movie_id}", response_model=schemas.Movie)
-def delete_movie(movie_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+@router.delete("/movies/{movie_id}", response_model=schemas.Movie)
+def delete_movie(movie_id: int, db: Session = Depends(get_db), current_user: schemas.Principal = Depends(get_current_user)):
     db_movie = crud.get_movie_by_id(db, movie_id=movie_id)
     if db_movie is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Movie not found")
@@ -138,35 +205,46 @@ def delete_movie(movie_id: int, db: Session = Depends(get_db), current_user: mod
     if db_movie.owner_id != current_user.id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to delete this movie")
     
-    deleted_movie = crud.delete_movie(db=db, movie_id=movie_id, user_id=current_user.id)
-    if deleted_movie is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Movie not found")
+    # Serialize before deleting, the instance cannot be loaded afterwards
+    deleted_movie = schemas.Movie.model_validate(db_movie)
+    crud.delete_movie(db=db, movie_id=movie_id)
     return deleted_movie
 
 
 
-#Endpoint to rate a movie
-@app.post("/movies/{movie_id}/rate", response_model=schemas.Rating)
-def rate_movie(movie_id: int, rating: schemas.RatingCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    db_movie = crud.get_movie_by_id(db, movie_id=movie_id)
-    if db_movie is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Movie not found")
-    
+#Endpoint to rate a movie; rating it again replaces the earlier rating
+# With RATING_INGEST_MODE=buffered the rating is queued and acknowledged with 202
+@router.post("/movies/{movie_id}/rate", response_model=schemas.Rating,
+             responses={202: {"model": schemas.RatingAccepted, "description": "Rating queued for a batched write"}})
+async def rate_movie(movie_id: int, rating: schemas.RatingCreate, db: Session = Depends(get_db), current_user: schemas.Principal = Depends(get_current_user)):
     rating.movie_id = movie_id
-    return crud.create_rating(db=db, rating=rating, user_id=current_user.id)
+    if rating_buffer.RATING_INGEST_MODE == "buffered":
+        await rating_buffer.buffer.add(db, current_user.id, movie_id, rating.rating)
+        accepted = schemas.RatingAccepted(movie_id=movie_id, user_id=current_user.id, rating=rating.rating)
+        return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content=accepted.model_dump())
 
-# Endpoint to get a list of movies rated by a user
-@app.get("/movies/{movie_id}/ratings", response_model=list[schemas.Rating])
-def get_ratings(movie_id: int, db: Session = Depends(get_db)):
-    db_movie = crud.get_movie_by_id(db, movie_id=movie_id)
-    if db_movie is None:
+    if await run_in_threadpool(crud.get_movie_version, db, movie_id) is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Movie not found")
+    return await run_in_threadpool(crud.create_rating, db=db, rating=rating, user_id=current_user.id)
+
+# Endpoint to get the rating aggregates of a movie
+@router.get("/movies/{movie_id}/rating-summary", response_model=schemas.RatingSummary)
+def get_rating_summary(movie_id: int, db: Session = Depends(get_read_db)):
+    return views.rating_summary(db, movie_id)
+
+# Endpoint to get the movies whose ratings are most similar to a movie's
+@router.get("/movies/{movie_id}/similar", response_model=list[schemas.SimilarMovie])
+def read_similar_movies(movie_id: int, limit: int = Query(10, ge=1, le=100), db: Session = Depends(get_read_db)):
+    return views.similar_movies(db, movie_id, limit)
 
-    return crud.get_ratings_for_movie(db=db, movie_id=movie_id)
+# Endpoint to get a list of movies rated by a user
+@router.get("/movies/{movie_id}/ratings", response_model=list[schemas.Rating])
+def get_ratings(movie_id: int, limit: int = 100, cursor: Optional[str] = None, db: Session = Depends(get_read_db)):
+    return views.movie_ratings(db, movie_id, limit, cursor)
 
 # Endpoint to add a comment to a movie
-@app.post("/movies/{movie_id}/comments", response_model=schemas.Comment)
-def add_comment(movie_id: int, comment: schemas.CommentCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+@router.post("/movies/{movie_id}/comments", response_model=schemas.Comment)
+def add_comment(movie_id: int, comment: schemas.CommentCreate, db: Session = Depends(get_db), current_user: schemas.Principal = Depends(get_current_user)):
     db_movie = crud.get_movie_by_id(db, movie_id=movie_id)
     if db_movie is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Movie not found")
@@ -174,18 +252,21 @@ def add_comment(movie_id: int, comment: schemas.CommentCreate, db: Session = Dep
     comment.movie_id = movie_id
     return crud.create_comment(db=db, comment=comment, user_id=current_user.id)
 
-# Endpoint to get a list of comments for a movie
-@app.get("/movies/{movie_id}/comments", response_model=list[schemas.Comment])
-def get_comments(movie_id: int, db: Session = Depends(get_db)):
-    db_movie = crud.get_movie_by_id(db, movie_id=movie_id)
-    if db_movie is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Movie not found")
+# Endpoint to get a page of comment threads for a movie, with replies nested up to max_depth
+@router.get("/movies/{movie_id}/comments", response_model=list[schemas.Comment])
+def get_comments(movie_id: int, response: Response, limit: int = Query(20, ge=1, le=100), cursor: Optional[str] = None,
+                 max_depth: int = Query(3, ge=0, le=crud.COMMENT_MAX_DEPTH), db: Session = Depends(get_read_db)):
+    return views.comment_threads(db, response, movie_id, limit, cursor, max_depth)
 
-    return crud.get_comments_for_movie(db=db, movie_id=movie_id)
+# Endpoint to get a page of replies to a comment, with their replies nested up to max_depth
+@router.get("/comments/{comment_id}/replies", response_model=list[schemas.Comment])
+def get_comment_replies(comment_id: int, response: Response, limit: int = Query(20, ge=1, le=100), cursor: Optional[str] = None,
+                        max_depth: int = Query(3, ge=0, le=crud.COMMENT_MAX_DEPTH), db: Session = Depends(get_read_db)):
+    return views.comment_replies(db, response, comment_id, limit, cursor, max_depth)
 
 # Endpoint to add comment to a comment (nested comment)
-@app.post("/comments/{comment_id}/reply", response_model=schemas.Comment)
-def add_nested_comment(comment_id: int, comment: schemas.CommentCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+@router.post("/comments/{comment_id}/reply", response_model=schemas.Comment)
+def add_nested_comment(comment_id: int, comment: schemas.CommentCreate, db: Session = Depends(get_db), current_user: schemas.Principal = Depends(get_current_user)):
     db_comment = crud.get_comment_by_id(db, comment_id=comment_id)
     if db_comment is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Comment not found")
@@ -194,6 +275,102 @@ def add_nested_comment(comment_id: int, comment: schemas.CommentCreate, db: Sess
     comment.movie_id = db_comment.movie_id  # Ensure the movie ID is inherited
     return crud.create_comment(db=db, comment=comment, user_id=current_user.id)
 
+# Endpoint to create a genre
+@router.post("/genres/", response_model=schemas.Genre)
+def create_genre(genre: schemas.GenreCreate, db: Session = Depends(get_db), current_user: schemas.Principal = Depends(get_current_active_user)):
+    return crud.create_genre(db=db, genre=genre)
+
+# Endpoint to list every genre, served from the in-memory genre registry
+@router.get("/genres/", response_model=list[schemas.Genre])
+def read_genres(db: Session = Depends(get_read_db)):
+    return views.genre_list(db)
+
+# Endpoint to get a genre by ID
+@router.get("/genres/{genre_id}", response_model=schemas.Genre)
+def read_genre(genre_id: int, db: Session = Depends(get_read_db)):
+    return views.genre(db, genre_id)
+
+# Endpoint to delete a genre; it is taken off every movie that had it
+@router.delete("/genres/{genre_id}", response_model=schemas.Genre)
+def delete_genre(genre_id: int, db: Session = Depends(get_db), current_user: schemas.Principal = Depends(get_current_active_user)):
+    genre = crud.delete_genre(db, genre_id=genre_id)
+    if genre is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Genre not found")
+    return genre
+
+# Endpoint to get an actor with the ids of the movies they appeared in
+@router.get("/actors/{actor_id}", response_model=schemas.Actor)
+def read_actor(actor_id: int, db: Session = Depends(get_read_db)):
+    return views.actor(db, actor_id)
+
+# Endpoint to get a page of the movies an actor appeared in
+@router.get("/actors/{actor_id}/movies", response_model=list[schemas.Movie])
+def read_actor_movies(actor_id: int, limit: int = Query(20, ge=1, le=100), cursor: Optional[str] = None,
+                      db: Session = Depends(get_read_db)):
+    return views.actor_movies(db, actor_id, limit, cursor)
+
+# Endpoint to get a director with the ids of the movies they directed
+@router.get("/directors/{director_id}", response_model=schemas.Director)
+def read_director(director_id: int, db: Session = Depends(get_read_db)):
+    return views.director(db, director_id)
+
+# Endpoint to get a page of the movies a director directed
+@router.get("/directors/{director_id}/movies", response_model=list[schemas.Movie])
+def read_director_movies(director_id: int, limit: int = Query(20, ge=1, le=100), cursor: Optional[str] = None,
+                         db: Session = Depends(get_read_db)):
+    return views.director_movies(db, director_id, limit, cursor)
+
+
+# Endpoint to inspect the password hashing pool
+@router.get("/hashing/stats")
+def hashing_stats():
+    return hashing.pool.stats()
+
+# Endpoint to inspect the write-behind rating buffer
+@router.get("/ratings/buffer/stats")
+def rating_buffer_stats():
+    return rating_buffer.buffer.stats()
+
+# Endpoint to inspect the in-process caches
+@router.get("/cache/stats")
+def cache_stats():
+    return {"movies": cache.movie_cache.stats(), "principals": cache.principal_cache.stats(),
+            "known_movies": cache.known_movies.stats(), "genres": genres.registry.stats()}
+
+# Endpoint to scrape request, query and connection pool metrics in Prometheus text format
+@router.get("/metrics")
+def read_metrics():
+    return metrics.metrics_response()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if MIGRATE_ON_STARTUP:
+        await run_in_threadpool(migrate.migrate, database.get_engine())
+    yield
+    await rating_buffer.buffer.stop()
+    hashing.pool.shutdown()
+    await database.dispose_engines()
+    stop_logging()
+
+# Application factory: middleware, routers and the startup/shutdown lifespan
+def create_app() -> FastAPI:
+    application = FastAPI(lifespan=lifespan)
+    application.add_middleware(metrics.MetricsMiddleware)
+    if database.READ_DATABASE_URL or database.ASYNC_READ_DATABASE_URL:
+        application.add_middleware(database.ReadYourWritesMiddleware)
+    # Outermost, so every log line written while handling a request carries its id
+    application.add_middleware(RequestIdMiddleware)
+    # In async mode the async read endpoints are registered first so they take precedence;
+    # sync deployments never import them
+    if DATABASE_MODE == "async":
+        import app.async_routes as async_routes
+        application.include_router(async_routes.router)
+    application.include_router(router)
+    return application
+
+app = create_app()
+
 
 # Start Uvicorn server if this script is run directly
 if __name__ == "__main__":
@@ -0,0 +1,266 @@
+import bisect
+import contextvars
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from fastapi import Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Queries slower than this are logged with their statement and route
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "500"))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = Tuple[str, ...]
+
+
+def _label_text(names: Sequence[str], values: Labels, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+# Minimal Prometheus metric types; every child of a metric shares one lock
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield f"{self.name}_total{_label_text(self.labels, labels)} {_number(value)}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket (+Inf last), sum]
+        self._values: Dict[Labels, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts[0][index] += 1
+            counts[1] += value
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = [(labels, list(counts), total) for labels, (counts, total) in self._values.items()]
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="%s"' % ("+Inf" if bound == float("inf") else _number(bound))
+                yield f"{self.name}_bucket{_label_text(self.labels, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_label_text(self.labels, labels)} {_number(total)}"
+            yield f"{self.name}_count{_label_text(self.labels, labels)} {cumulative}"
+
+
+# Gauge read from a callback at scrape time, returning {labels: value}
+class CallbackGauge:
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str], collect: Callable[[], Dict[Labels, float]]):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._collect = collect
+
+    def samples(self) -> Iterable[str]:
+        for labels, value in self._collect().items():
+            yield f"{self.name}{_label_text(self.labels, labels)} {_number(value)}"
+
+
+REGISTRY: List = []
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+def metrics_response() -> Response:
+    return Response(content=render(), media_type=CONTENT_TYPE)
+
+
+http_request_duration = register(Histogram(
+    "http_request_duration_seconds", "Request latency by route", ["method", "route", "status"]))
+request_queries = register(Histogram(
+    "db_request_queries", "SQL statements executed per request", ["route"], buckets=QUERY_COUNT_BUCKETS))
+request_sql_duration = register(Histogram(
+    "db_request_sql_duration_seconds", "Total SQL time per request", ["route"]))
+query_duration = register(Histogram(
+    "db_query_duration_seconds", "Duration of individual SQL statements"))
+slow_queries = register(Counter(
+    "db_slow_queries", "SQL statements slower than SLOW_QUERY_MS", ["route"]))
+pool_checkout_wait = register(Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection", ["pool"]))
+
+
+# Per-request accumulators, reached from engine events through a context
+# variable; Starlette's threadpool and AsyncSession.run_sync both run in a
+# copy of the request's context, so the same object is updated.
+class RequestStats:
+    __slots__ = ("scope", "queries", "sql_seconds", "pool_wait_seconds")
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.pool_wait_seconds = 0.0
+
+    # The router records the matched route in the scope before calling the endpoint
+    @property
+    def route(self) -> str:
+        return _route_name(self.scope)
+
+_request_stats: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar("request_stats", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    query_duration.observe(elapsed)
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.sql_seconds += elapsed
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        route = stats.route if stats is not None else "background"
+        slow_queries.inc(route)
+        logger.warning("Slow query (%.1f ms) in %s: %s", elapsed * 1000, route, " ".join(statement.split())[:1000])
+
+# after_cursor_execute does not fire for a statement that raised; drop its
+# start time, or it stays on the pooled connection for the connection's life
+def _handle_error(context):
+    started = context.connection.info.get("query_started") if context.connection is not None else None
+    if started:
+        started.pop()
+
+
+# Pools have no event before a checkout starts, so the pool's connect() is
+# wrapped to time the wait; dispose() replaces the pool, which is wrapped again
+def _time_checkouts(engine: Engine, name: str):
+    pool = engine.pool
+    connect = pool.connect
+
+    def timed_connect():
+        started = time.perf_counter()
+        try:
+            return connect()
+        finally:
+            waited = time.perf_counter() - started
+            pool_checkout_wait.observe(waited, name)
+            stats = _request_stats.get()
+            if stats is not None:
+                stats.pool_wait_seconds += waited
+
+    pool.connect = timed_connect
+
+
+_pools: Dict[str, Engine] = {}
+
+def _pool_gauge(method: str) -> Callable[[], Dict[Labels, float]]:
+    def collect():
+        return {(name,): getattr(engine.pool, method)() for name, engine in _pools.items() if hasattr(engine.pool, method)}
+    return collect
+
+register(CallbackGauge("db_pool_size", "Configured size of the connection pool", ["pool"], _pool_gauge("size")))
+register(CallbackGauge("db_pool_checked_out", "Connections currently checked out", ["pool"], _pool_gauge("checkedout")))
+register(CallbackGauge("db_pool_checked_in", "Idle connections in the pool", ["pool"], _pool_gauge("checkedin")))
+register(CallbackGauge("db_pool_overflow", "Connections open beyond the pool size", ["pool"], _pool_gauge("overflow")))
+
+
+# Hook an engine into the query and pool metrics under the given pool label
+def instrument_engine(engine: Engine, name: str):
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+    event.listen(engine, "engine_disposed", lambda conn: _time_checkouts(engine, name))
+    _time_checkouts(engine, name)
+    _pools[name] = engine
+
+
+def _route_name(scope) -> str:
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    endpoint = scope.get("endpoint")
+    return getattr(endpoint, "__name__", "unmatched")
+
+
+# ASGI middleware: times every HTTP request by route template and adds a
+# Server-Timing header with the total, SQL and pool wait time spent before
+# the response started
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(scope)
+        token = _request_stats.set(stats)
+        started = time.perf_counter()
+        status = "500"
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+                total_ms = (time.perf_counter() - started) * 1000
+                timing = (f'app;dur={total_ms:.1f}, db;dur={stats.sql_seconds * 1000:.1f};desc="{stats.queries} queries", '
+                          f"pool;dur={stats.pool_wait_seconds * 1000:.1f}")
+                message = dict(message, headers=list(message.get("headers", [])) + [(b"server-timing", timing.encode())])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_stats.reset(token)
+            route = stats.route
+            http_request_duration.observe(time.perf_counter() - started, scope["method"], route, status)
+            request_queries.observe(stats.queries, route)
+            request_sql_duration.observe(stats.sql_seconds, route)
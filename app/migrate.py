@@ -0,0 +1,111 @@
+from sqlalchemy import func, insert, inspect, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateColumn
+
+import app.crud as crud
+import app.leaderboards as leaderboards
+import app.models as models
+import app.search as search
+from app.database import get_engine
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Schema migration step, run once per deploy instead of on every worker boot:
+#
+#     python -m app.migrate
+#
+# Creates missing tables, then any column or index declared on a model after
+# its table was created (create_all skips tables that exist), then the search
+# index, then backfills new columns and tables. Every step checks first, so
+# running it again is a no-op. Added columns must be nullable or have a server
+# default.
+def migrate(engine: Engine):
+    tables = set(inspect(engine).get_table_names())
+    created = [table.name for table in models.Base.metadata.sorted_tables if table.name not in tables]
+    if "movie_search" not in tables:
+        created.append("movie_search")
+    added = []
+    models.Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        preparer = conn.dialect.identifier_preparer
+        for table in models.Base.metadata.sorted_tables:
+            columns = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in columns:
+                    logger.info("Adding column %s.%s", table.name, column.name)
+                    definition = CreateColumn(column).compile(dialect=conn.dialect)
+                    conn.execute(text(f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {definition}"))
+                    added.append((table.name, column.name))
+            existing = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing:
+                    logger.info("Creating index %s", index.name)
+                    if index.name in BEFORE_INDEX:
+                        BEFORE_INDEX[index.name](conn)
+                    index.create(conn, checkfirst=True)
+    search.create_search_index(engine)
+    # Columns first: the new tables are built from them
+    with engine.begin() as conn:
+        for name in added:
+            if name in AFTER_ADD:
+                logger.info("Backfilling %s.%s", *name)
+                AFTER_ADD[name](conn)
+        _backfill_movie_genres(conn, refresh_leaderboards="leaderboard_entries" not in created)
+        for name in created:
+            if name in AFTER_CREATE:
+                logger.info("Backfilling %s", name)
+                AFTER_CREATE[name](conn)
+
+
+# Ratings predate the one-rating-per-user constraint: keep each user's latest
+# rating of a movie and rebuild the aggregates from what is left
+def _dedupe_ratings(conn):
+    latest = select(func.max(models.Rating.id)).group_by(models.Rating.user_id, models.Rating.movie_id)
+    removed = conn.execute(models.Rating.__table__.delete().where(models.Rating.id.not_in(latest))).rowcount
+    if removed:
+        logger.info("Removed %d superseded ratings", removed)
+        crud.recompute_rating_aggregates(Session(bind=conn))
+
+BEFORE_INDEX = {"uq_ratings_user_id_movie_id": _dedupe_ratings}
+
+# Aggregates of the ratings that predate the aggregate columns
+def _recompute_rating_aggregates(conn):
+    crud.recompute_rating_aggregates(Session(bind=conn))
+
+AFTER_ADD = {("movies", "rating_count"): _recompute_rating_aggregates}
+
+# Movies created before crud.create_movie wrote movie_genre only carry their
+# genre in movies.genre_id, but genre filters and genre leaderboards read
+# movie_genre. Only movies missing their row are touched, so this runs on
+# every migration.
+def _backfill_movie_genres(conn, refresh_leaderboards: bool):
+    movie, link = models.Movie, models.MovieGenre
+    rows = conn.execute(
+        select(movie.id.label("movie_id"), movie.genre_id)
+        .where(movie.genre_id.in_(select(models.Genre.id)))
+        .where(~select(link.movie_id).where(link.movie_id == movie.id, link.genre_id == movie.genre_id).exists())
+    ).mappings().all()
+    if not rows:
+        return
+    logger.info("Backfilling movie_genre for %d movies", len(rows))
+    conn.execute(insert(link.__table__), [dict(row) for row in rows])
+    if refresh_leaderboards:
+        leaderboards.refresh_movies(Session(bind=conn), [row["movie_id"] for row in rows])
+
+# Lists for the ratings that predate the leaderboard tables
+def _build_leaderboards(conn):
+    leaderboards.rebuild(Session(bind=conn))
+
+# Index the movies that predate the search index
+def _index_movies(conn):
+    search.rebuild_index(Session(bind=conn))
+
+AFTER_CREATE = {"leaderboard_entries": _build_leaderboards, "movie_search": _index_movies}
+
+
+if __name__ == "__main__":
+    migrate(get_engine())
+    logger.info("Schema is up to date")
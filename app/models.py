@@ -1,15 +1,16 @@
-from sqlalchemy import Column, Integer, String, Text, Date, Float, ForeignKey, Table, DateTime, Boolean
+from sqlalchemy import Column, Integer, String, Text, Date, Float, ForeignKey, Table, DateTime, Boolean, Index
 from sqlalchemy.orm import relationship
-from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
 
-Base = declarative_base()
+from app.database import Base
 
 # Association Table for many-to-many relationship between movies and actors
 movie_actor_association = Table(
     'movie_actor', Base.metadata,
     Column('movie_id', Integer, ForeignKey('movies.id'), primary_key=True),
-    Column('actor_id', Integer, ForeignKey('actors.id'), primary_key=True)
+    Column('actor_id', Integer, ForeignKey('actors.id'), primary_key=True),
+    # GET /movies/?actor_id= looks up movie ids by actor
+    Index('ix_movie_actor_actor_id_movie_id', 'actor_id', 'movie_id')
 )
 
 # Genre Model
@@ -70,12 +71,18 @@ class Movie(Base):
     trailer_url = Column(String)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # Rating aggregates, kept in sync by crud.create_rating / crud.delete_rating
+    rating_count = Column(Integer, nullable=False, default=0, server_default='0')
+    rating_sum = Column(Float, nullable=False, default=0.0, server_default='0')
+    rating_average = Column(Float)
     
     genre_id = Column(Integer, ForeignKey('genres.id', ondelete='SET NULL'), index=True)
-    director_id = Column(Integer, ForeignKey('directors.id', ondelete='SET NULL'), index=True)
+    director_id = Column(Integer, ForeignKey('directors.id', ondelete='SET NULL'))
     owner_id = Column(Integer, ForeignKey("users.id"))
     
-    genre = relationship("Genre", back_populates="movies")
+    # Primary genre only; Genre.movies is the many-to-many side through movie_genre
+    genre = relationship("Genre")
     director = relationship("Director", back_populates="movies")
     owner = relationship("User", back_populates="movies")
     ratings = relationship("Rating", back_populates="movie")
@@ -87,6 +94,29 @@ class Movie(Base):
     )
     genres = relationship('Genre', secondary='movie_genre', back_populates='movies')
 
+    @property
+    def genre_ids(self):
+        return [genre.id for genre in self.genres]
+
+    @property
+    def cast_ids(self):
+        return [actor.id for actor in self.cast]
+
+    __table_args__ = (
+        # Keyset pagination sort key for GET /movies/
+        Index('ix_movies_created_at_id', 'created_at', 'id'),
+        # Incremental catalog exports (updated_since)
+        Index('ix_movies_updated_at_id', 'updated_at', 'id'),
+        # Equality filters of GET /movies/, in the default sort order
+        Index('ix_movies_director_id_created_at_id', 'director_id', 'created_at', 'id'),
+        Index('ix_movies_language_created_at_id', 'language', 'created_at', 'id'),
+        # Range filters and sort keys of GET /movies/
+        Index('ix_movies_release_date_id', 'release_date', 'id'),
+        Index('ix_movies_rating_average_id', 'rating_average', 'id'),
+        Index('ix_movies_duration_id', 'duration', 'id'),
+        Index('ix_movies_title_id', 'title', 'id'),
+    )
+
     def __repr__(self):
         return f"<Movie(id={self.id}, title='{self.title}')>"
   
@@ -96,6 +126,11 @@ class MovieGenre(Base):
     movie_id = Column(Integer, ForeignKey('movies.id'), primary_key=True)
     genre_id = Column(Integer, ForeignKey('genres.id'), primary_key=True)
 
+    __table_args__ = (
+        # GET /movies/?genre_id= looks up movie ids by genre
+        Index('ix_movie_genre_genre_id_movie_id', 'genre_id', 'movie_id'),
+    )
+
 # Rating Model
 class Rating(Base):
     __tablename__ = "ratings"
@@ -104,13 +139,85 @@ class Rating(Base):
     movie_id = Column(Integer, ForeignKey("movies.id"))
     user_id = Column(Integer, ForeignKey("users.id"))
     rating = Column(Float)
+    # When the rating was given or last replaced; null for ratings older than the column
+    rated_at = Column(DateTime, default=datetime.utcnow)
     
     movie = relationship("Movie", back_populates="ratings")
     user = relationship("User", back_populates="ratings")
 
+    __table_args__ = (
+        Index('ix_ratings_movie_id_id', 'movie_id', 'id'),
+        # One rating per user and movie; rating again replaces it
+        Index('uq_ratings_user_id_movie_id', 'user_id', 'movie_id', unique=True),
+        # Leaderboard rebuilds read the recent ratings
+        Index('ix_ratings_rated_at', 'rated_at'),
+        # Recommendations read a user's most recent ratings
+        Index('ix_ratings_user_id_rated_at', 'user_id', 'rated_at'),
+    )
+
     def __repr__(self):
         return f"<Rating(id={self.id}, movie_id={self.movie_id}, user_id={self.user_id}, rating={self.rating})>"
 
+# Ratings of a movie per day, for the windowed leaderboards (app.leaderboards)
+class MovieRatingDay(Base):
+    __tablename__ = 'movie_rating_days'
+
+    movie_id = Column(Integer, ForeignKey('movies.id'), primary_key=True)
+    day = Column(Date, primary_key=True)
+    votes = Column(Integer, nullable=False, default=0)
+    rating_sum = Column(Float, nullable=False, default=0.0)
+
+# Precomputed ranked lists of GET /movies/top, one per window and genre
+class LeaderboardEntry(Base):
+    __tablename__ = 'leaderboard_entries'
+
+    period = Column(String, primary_key=True)
+    # 0 for the list over all genres
+    genre_id = Column(Integer, primary_key=True)
+    movie_id = Column(Integer, ForeignKey('movies.id'), primary_key=True)
+    score = Column(Float, nullable=False)
+    votes = Column(Integer, nullable=False)
+    average = Column(Float, nullable=False)
+
+    __table_args__ = (
+        # A list read is a range scan of its first k rows
+        Index('ix_leaderboard_entries_period_genre_id_score', 'period', 'genre_id', 'score', 'movie_id'),
+        Index('ix_leaderboard_entries_movie_id', 'movie_id'),
+    )
+
+# Mean rating of each leaderboard window, the prior of its Bayesian scores
+class LeaderboardPrior(Base):
+    __tablename__ = 'leaderboard_priors'
+
+    period = Column(String, primary_key=True)
+    mean = Column(Float, nullable=False)
+
+# Nearest neighbours of each movie by rating similarity (app.recommendations)
+class MovieNeighbor(Base):
+    __tablename__ = 'movie_neighbors'
+
+    movie_id = Column(Integer, ForeignKey('movies.id'), primary_key=True)
+    neighbor_id = Column(Integer, ForeignKey('movies.id'), primary_key=True)
+    similarity = Column(Float, nullable=False)
+
+    __table_args__ = (
+        # A movie's list, most similar first
+        Index('ix_movie_neighbors_movie_id_similarity', 'movie_id', 'similarity', 'neighbor_id'),
+        # Incremental refreshes replace the entries pointing at re-rated movies
+        Index('ix_movie_neighbors_neighbor_id', 'neighbor_id'),
+    )
+
+# One run of the neighbour build; the latest run's ratings_through is where
+# the next incremental refresh picks up
+class NeighborBuild(Base):
+    __tablename__ = 'movie_neighbor_builds'
+
+    id = Column(Integer, primary_key=True)
+    ratings_through = Column(DateTime)
+    movies = Column(Integer, nullable=False)
+    incremental = Column(Boolean, nullable=False, default=False)
+    finished_at = Column(DateTime, default=datetime.utcnow)
+
 # User Model
 class User(Base):
     __tablename__ = 'users'
@@ -142,5 +249,11 @@ class Comment(Base):
     user = relationship("User", back_populates="comments")
     parent = relationship("Comment", remote_side=[id], backref="replies")
 
+    __table_args__ = (
+        # Top-level threads of a movie, and the recursive walk down a thread
+        Index('ix_comments_movie_id_parent_id_id', 'movie_id', 'parent_id', 'id'),
+        Index('ix_comments_parent_id_id', 'parent_id', 'id'),
+    )
+
     def __repr__(self):
         return f"<Comment(id={self.id}, movie_id={self.movie_id}, user_id={self.user_id})>"
\ No newline at end of file
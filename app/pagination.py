@@ -0,0 +1,125 @@
+import base64
+import binascii
+import json
+from datetime import date, datetime
+from typing import Any, List, NamedTuple, Optional, Sequence
+
+from fastapi import HTTPException, status
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Query
+
+# Response header carrying the opaque token for the next page
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class Page(NamedTuple):
+    items: list
+    next_cursor: Optional[str]
+
+
+# Encode the sort key values of the last row into an opaque, url-safe token.
+# `scope` names the sort order, so a cursor is rejected by any other order.
+def encode_cursor(values: Sequence[Any], scope: Optional[str] = None) -> str:
+    payload = [value.isoformat() if isinstance(value, (date, datetime)) else value for value in values]
+    if scope is not None:
+        payload.insert(0, scope)
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+# Decode a cursor back into values typed like the columns they are compared against
+def decode_cursor(cursor: str, columns: Sequence[Any], scope: Optional[str] = None) -> List[Any]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list):
+            raise ValueError("cursor is not a list")
+        if scope is not None:
+            if not values or values.pop(0) != scope:
+                raise ValueError("cursor belongs to another sort order")
+        if len(values) != len(columns):
+            raise ValueError("cursor does not match the sort key")
+        return [_coerce(column, value) for column, value in zip(columns, values)]
+    except (ValueError, TypeError, binascii.Error):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+def _coerce(column: Any, value: Any) -> Any:
+    if value is None:
+        return None
+    python_type = column.type.python_type
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    if python_type is date:
+        return date.fromisoformat(value)
+    return python_type(value)
+
+
+# Keyset pagination: seek past the cursor on an indexed sort key instead of
+# scanning and discarding `skip` rows. `skip` is only honoured when no cursor
+# is given, for clients that still page with offsets. Works on both ORM
+# queries and select() statements; one extra row is fetched to detect the end.
+def seek(query, columns: Sequence[Any], cursor: Optional[str] = None, limit: int = 10, skip: int = 0):
+    if cursor:
+        query = query.filter(tuple_(*columns) > tuple_(*decode_cursor(cursor, columns)))
+    query = query.order_by(*columns)
+    if skip and not cursor:
+        query = query.offset(skip)
+    return query.limit(limit + 1)
+
+# Build a Page from the rows of a seek() query
+def page_of(rows: list, columns: Sequence[Any], limit: int, scope: Optional[str] = None) -> Page:
+    if len(rows) <= limit:
+        return Page(list(rows), None)
+
+    rows = rows[:limit]
+    last = rows[-1]
+    return Page(rows, encode_cursor([getattr(last, column.key) for column in columns], scope))
+
+def paginate(query: Query, columns: Sequence[Any], cursor: Optional[str] = None,
+             limit: int = 10, skip: int = 0) -> Page:
+    return page_of(seek(query, columns, cursor=cursor, limit=limit, skip=skip).all(), columns, limit)
+
+# Keyset pagination on a sort column plus a unique tie-breaker, in either
+# direction. For a nullable column NULLs come last: non-NULL rows are read
+# from the (column, tiebreak) index and the NULL rows, ordered by tiebreak,
+# only once those run out, so both sections stay index seeks instead of one
+# sort over `column IS NULL`. The cursor is scoped to `scope`.
+def paginate_sorted(query: Query, column: Any, tiebreak: Any, cursor: Optional[str] = None, limit: int = 10,
+                    skip: int = 0, descending: bool = False, nullable: bool = True,
+                    scope: Optional[str] = None) -> Page:
+    columns = [column, tiebreak]
+    order = [c.desc() if descending else c.asc() for c in columns]
+
+    def after(values):
+        return tuple_(*columns) < tuple_(*values) if descending else tuple_(*columns) > tuple_(*values)
+
+    if not nullable:
+        if cursor:
+            query = query.filter(after(decode_cursor(cursor, columns, scope)))
+        query = query.order_by(*order)
+        if skip and not cursor:
+            query = query.offset(skip)
+        return page_of(query.limit(limit + 1).all(), columns, limit, scope)
+
+    def nulls(after_id, count):
+        nulls_query = query.filter(column.is_(None))
+        if after_id is not None:
+            nulls_query = nulls_query.filter(tiebreak < after_id if descending else tiebreak > after_id)
+        return nulls_query.order_by(order[1]).limit(count).all()
+
+    if skip and not cursor:
+        # Offset paging cannot seek, so it sorts on the NULLs-last expression
+        rows = query.order_by(column.is_(None), *order).offset(skip).limit(limit + 1).all()
+        return page_of(rows, columns, limit, scope)
+
+    if cursor:
+        value, last_id = decode_cursor(cursor, columns, scope)
+        if value is None:
+            return page_of(nulls(last_id, limit + 1), columns, limit, scope)
+        rows = query.filter(after([value, last_id])).order_by(*order).limit(limit + 1).all()
+    else:
+        rows = query.filter(column.isnot(None)).order_by(*order).limit(limit + 1).all()
+    if len(rows) <= limit:
+        rows += nulls(None, limit + 1 - len(rows))
+    return page_of(rows, columns, limit, scope)
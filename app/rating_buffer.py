@@ -0,0 +1,162 @@
+import asyncio
+import os
+from typing import Dict, Optional, Set, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+import app.cache as cache
+import app.crud as crud
+import app.metrics as metrics
+from app.database import SessionLocal
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# "direct" writes and commits each rating inside its request. "buffered"
+# acknowledges with 202 once the rating is queued in memory; a background task
+# writes the queue in batched upserts when it reaches RATING_FLUSH_SIZE or
+# every RATING_FLUSH_INTERVAL seconds, and drains it on shutdown. Ratings
+# still queued when a worker dies are lost.
+RATING_INGEST_MODE = os.getenv("RATING_INGEST_MODE", "direct")
+RATING_FLUSH_SIZE = int(os.getenv("RATING_FLUSH_SIZE", "1000"))
+RATING_FLUSH_INTERVAL = float(os.getenv("RATING_FLUSH_INTERVAL", "1.0"))
+# Beyond this many queued ratings (e.g. while the database is down) new ones get 503
+RATING_BUFFER_MAX = int(os.getenv("RATING_BUFFER_MAX", "50000"))
+
+if RATING_INGEST_MODE not in ("direct", "buffered"):
+    raise ValueError("RATING_INGEST_MODE must be 'direct' or 'buffered'")
+
+Key = Tuple[int, int]  # (user_id, movie_id)
+
+
+def _write(ratings: Dict[Key, float]) -> Set[int]:
+    with SessionLocal() as db:
+        return crud.upsert_ratings(db, ratings)
+
+
+# Write a batch that failed for a reason other than the database being
+# unavailable one rating at a time, so the ratings that fail on their own are
+# dropped instead of blocking the rest forever. Returns the number written
+# and the ratings to queue again.
+def _write_each(ratings: Dict[Key, float]) -> Tuple[int, Dict[Key, float]]:
+    written, retry = 0, {}
+    for (user_id, movie_id), rating in ratings.items():
+        try:
+            _write({(user_id, movie_id): rating})
+            written += 1
+        except OperationalError:
+            retry[user_id, movie_id] = rating
+        except Exception:
+            logger.exception("Dropping the buffered rating of movie %d by user %d", movie_id, user_id)
+    return written, retry
+
+
+# The queue is a dict keyed by (user_id, movie_id), so a user re-rating a movie
+# before the flush only keeps the latest value. It is only touched from the
+# event loop; flushes swap it out and write the old one in the threadpool.
+# A batch is queued again when the database is unavailable (OperationalError,
+# which includes deadlocks); any other failure is retried rating by rating.
+class RatingBuffer:
+    def __init__(self, flush_size: int, flush_interval: float, max_pending: int):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.pending: Dict[Key, float] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.written = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.dropped = 0
+        self.rejected = 0
+
+    # Ratings of movies deleted after the check are dropped by upsert_ratings
+    async def add(self, db: Session, user_id: int, movie_id: int, rating: float):
+        if cache.known_movies.get(movie_id) is None:
+            since = cache.known_movies.generation()
+            if await run_in_threadpool(crud.get_movie_version, db, movie_id) is None:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Movie not found")
+            cache.known_movies.set(movie_id, True, size=1, tags=[cache.movie_tag(movie_id)], since=since)
+
+        key = (user_id, movie_id)
+        if key not in self.pending and len(self.pending) >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Rating buffer is full")
+        self.pending[key] = rating
+        if self._task is None:
+            self.start()
+        if len(self.pending) >= self.flush_size:
+            self._wakeup.set()
+
+    def start(self):
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+        await self.flush()
+
+    async def flush(self):
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, {}
+        try:
+            await run_in_threadpool(_write, batch)
+        except OperationalError:
+            self.failed_flushes += 1
+            logger.exception("Writing %d buffered ratings failed; they stay queued", len(batch))
+            self._requeue(batch)
+            return
+        except Exception:
+            self.failed_flushes += 1
+            logger.exception("Writing %d buffered ratings failed; writing them one at a time", len(batch))
+            written, retry = await run_in_threadpool(_write_each, batch)
+            self.written += written
+            self.dropped += len(batch) - written - len(retry)
+            self._requeue(retry)
+            return
+        self.flushes += 1
+        self.written += len(batch)
+
+    # Ratings queued meanwhile are newer and win
+    def _requeue(self, ratings: Dict[Key, float]):
+        self.pending = {**ratings, **self.pending}
+
+    # Stop the flusher after a final flush of everything queued
+    async def stop(self):
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        if self.pending:
+            logger.error("Dropping %d buffered ratings that could not be written", len(self.pending))
+
+    def stats(self) -> dict:
+        return {
+            "mode": RATING_INGEST_MODE,
+            "pending": len(self.pending),
+            "written": self.written,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+        }
+
+
+buffer = RatingBuffer(RATING_FLUSH_SIZE, RATING_FLUSH_INTERVAL, RATING_BUFFER_MAX)
+
+metrics.register(metrics.CallbackGauge(
+    "rating_buffer_pending", "Ratings queued in the write-behind buffer", [], lambda: {(): len(buffer.pending)}))
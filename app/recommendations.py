@@ -0,0 +1,292 @@
+import argparse
+import itertools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Tuple
+
+from sqlalchemy import delete, func, insert, select, tuple_
+from sqlalchemy.orm import Session
+
+import app.models as models
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Item-item collaborative filtering. Each movie is the vector of its ratings,
+# centred on the movie's mean rating; two movies are as similar as the cosine
+# of their vectors, shrunk by n / (n + RECOMMENDER_SHRINKAGE) for the n users
+# who rated both, so a couple of shared ratings do not make a perfect match.
+# The RECOMMENDER_NEIGHBORS most similar movies of every movie are stored in
+# movie_neighbors and the endpoints only read them: similar movies are one
+# movie's list, a user's recommendations the merged lists of their ratings.
+#
+# NumPy and SciPy are imported by the build only, so web workers never load
+# them. The build multiplies the sparse movie x user matrix by its transpose
+# in blocks of movies on RECOMMENDER_WORKERS threads (the sparse products and
+# partitions release the GIL), each holding at most RECOMMENDER_BLOCK_CELLS
+# dense similarities.
+#
+#     python -m app.recommendations          # refresh from new ratings
+#     python -m app.recommendations --full   # rebuild every list
+#
+# A refresh recomputes the lists of the movies rated since the last run and
+# merges their new similarities into the other lists. Lists can come up short
+# that way, and deleted ratings are only dropped by a full build, which should
+# still run periodically.
+RECOMMENDER_NEIGHBORS = int(os.getenv("RECOMMENDER_NEIGHBORS", "50"))
+RECOMMENDER_SHRINKAGE = float(os.getenv("RECOMMENDER_SHRINKAGE", "10"))
+RECOMMENDER_WORKERS = int(os.getenv("RECOMMENDER_WORKERS", str(os.cpu_count() or 1)))
+RECOMMENDER_BLOCK_CELLS = int(os.getenv("RECOMMENDER_BLOCK_CELLS", "5000000"))
+# Most recent ratings of a user that their recommendations are drawn from
+RECOMMENDER_USER_HISTORY = int(os.getenv("RECOMMENDER_USER_HISTORY", "200"))
+
+# Rows fetched per round trip when loading the ratings, and written per INSERT
+LOAD_BATCH = 100000
+WRITE_CHUNK = 10000
+
+# (movie ids, neighbour ids, similarities) as parallel arrays
+Neighbors = Tuple["np.ndarray", "np.ndarray", "np.ndarray"]
+
+
+def _chunks(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+# The ratings table as a sparse movie x user matrix of unit vectors
+class RatingMatrix:
+    def __init__(self, db: Session):
+        import numpy as np
+        from scipy import sparse
+
+        rating = models.Rating
+        result = db.execute(
+            select(rating.movie_id, rating.user_id, rating.rating)
+            .where(rating.rating.is_not(None))
+            .execution_options(yield_per=LOAD_BATCH)
+        )
+        # fromiter over the flattened rows; np.array on a list of rows is several times slower
+        batches = [
+            np.fromiter(itertools.chain.from_iterable(rows), dtype=np.float64, count=3 * len(rows)).reshape(-1, 3)
+            for rows in result.partitions()
+        ]
+        data = np.concatenate(batches) if batches else np.empty((0, 3))
+
+        self.movie_ids, movie_index = np.unique(data[:, 0].astype(np.int64), return_inverse=True)
+        user_ids, user_index = np.unique(data[:, 1].astype(np.int64), return_inverse=True)
+        shape = (len(self.movie_ids), len(user_ids))
+        counts = np.bincount(movie_index, minlength=shape[0])
+        means = np.bincount(movie_index, weights=data[:, 2], minlength=shape[0]) / np.maximum(counts, 1)
+
+        centred = sparse.csr_matrix((data[:, 2] - means[movie_index], (movie_index, user_index)),
+                                    shape=shape, dtype=np.float32)
+        norms = np.sqrt(np.asarray(centred.multiply(centred).sum(axis=1)).ravel())
+        # Movies rated the same by everyone stay zero vectors, similar to nothing
+        norms[norms == 0] = 1
+        self.vectors = sparse.csr_matrix(centred.multiply((1 / norms)[:, None]), dtype=np.float32)
+        self.vectors_t = self.vectors.T.tocsr()
+        self.rated = sparse.csr_matrix((np.ones(len(data), dtype=np.float32), (movie_index, user_index)), shape=shape)
+        self.rated_t = self.rated.T.tocsr()
+
+    def __len__(self):
+        return len(self.movie_ids)
+
+    # Row index of each movie id, -1 for movies without ratings
+    def rows_of(self, movie_ids: Iterable[int]) -> "np.ndarray":
+        import numpy as np
+
+        movie_ids = np.asarray(list(movie_ids), dtype=np.int64)
+        if not len(self):
+            return np.full(len(movie_ids), -1)
+        rows = np.minimum(np.searchsorted(self.movie_ids, movie_ids), len(self) - 1)
+        return np.where(self.movie_ids[rows] == movie_ids, rows, -1)
+
+    # Blocks of rows small enough to keep their dense similarities in memory
+    def blocks(self, rows: "np.ndarray") -> List["np.ndarray"]:
+        size = max(1, RECOMMENDER_BLOCK_CELLS // max(len(self), 1))
+        return [rows[start:start + size] for start in range(0, len(rows), size)]
+
+    # Dense similarities of the given rows to every movie, 0 to themselves
+    def similarities(self, rows: "np.ndarray") -> "np.ndarray":
+        import numpy as np
+
+        similarities = (self.vectors[rows] @ self.vectors_t).toarray()
+        if RECOMMENDER_SHRINKAGE:
+            common = (self.rated[rows] @ self.rated_t).toarray()
+            similarities *= common / (common + RECOMMENDER_SHRINKAGE)
+        similarities[np.arange(len(rows)), rows] = 0
+        return similarities
+
+    # The k most similar movies of each row with a positive similarity
+    def top(self, rows: "np.ndarray", similarities: "np.ndarray", k: int) -> Neighbors:
+        import numpy as np
+
+        k = min(k, len(self))
+        top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        values = np.take_along_axis(similarities, top, axis=1)
+        keep = values > 0
+        movie_ids = np.broadcast_to(self.movie_ids[rows][:, None], top.shape)
+        return movie_ids[keep], self.movie_ids[top[keep]], values[keep]
+
+
+def _map_blocks(fn, blocks: list) -> list:
+    with ThreadPoolExecutor(max(1, RECOMMENDER_WORKERS)) as pool:
+        return list(pool.map(fn, blocks))
+
+
+def _write(db: Session, neighbors: Iterable[Neighbors]):
+    for movie_ids, neighbor_ids, similarities in neighbors:
+        rows = [
+            {"movie_id": movie_id, "neighbor_id": neighbor_id, "similarity": similarity}
+            for movie_id, neighbor_id, similarity in zip(movie_ids.tolist(), neighbor_ids.tolist(), similarities.tolist())
+        ]
+        for chunk in _chunks(rows, WRITE_CHUNK):
+            db.execute(insert(models.MovieNeighbor.__table__), chunk)
+
+
+# Cut the lists of the given movies back to RECOMMENDER_NEIGHBORS entries
+def _trim(db: Session, movie_ids: Iterable[int]):
+    neighbor = models.MovieNeighbor
+    for chunk in _chunks(sorted(movie_ids), WRITE_CHUNK):
+        position = func.row_number().over(
+            partition_by=neighbor.movie_id, order_by=(neighbor.similarity.desc(), neighbor.neighbor_id.desc())
+        )
+        ranked = (
+            select(neighbor.movie_id, neighbor.neighbor_id, position.label("position"))
+            .where(neighbor.movie_id.in_(chunk))
+            .subquery()
+        )
+        db.execute(delete(neighbor).where(tuple_(neighbor.movie_id, neighbor.neighbor_id).in_(
+            select(ranked.c.movie_id, ranked.c.neighbor_id).where(ranked.c.position > RECOMMENDER_NEIGHBORS)
+        )))
+
+
+def _latest_rating(db: Session):
+    return db.scalar(select(func.max(models.Rating.rated_at)))
+
+
+# Replace every list in one transaction; readers keep the previous lists until it commits
+def build(db: Session):
+    import numpy as np
+
+    through = _latest_rating(db)
+    matrix = RatingMatrix(db)
+    neighbors = _map_blocks(
+        lambda rows: matrix.top(rows, matrix.similarities(rows), RECOMMENDER_NEIGHBORS),
+        matrix.blocks(np.arange(len(matrix))),
+    )
+    db.execute(delete(models.MovieNeighbor))
+    _write(db, neighbors)
+    db.add(models.NeighborBuild(ratings_through=through, movies=len(matrix), incremental=False))
+    db.commit()
+    logger.info("Built neighbour lists of %d movies", len(matrix))
+
+
+# Recompute the lists of the movies rated since the last build or refresh and
+# merge their new similarities into the lists of the other movies. Falls back
+# to a full build when there is no previous run.
+def refresh(db: Session):
+    import numpy as np
+
+    last = db.scalars(select(models.NeighborBuild).order_by(models.NeighborBuild.id.desc()).limit(1)).first()
+    if last is None or last.ratings_through is None:
+        return build(db)
+    through = _latest_rating(db)
+    changed = db.scalars(
+        select(models.Rating.movie_id).where(models.Rating.rated_at > last.ratings_through).distinct()
+    ).all()
+    if not changed:
+        logger.info("No new ratings since %s", last.ratings_through)
+        return
+
+    matrix = RatingMatrix(db)
+    rows = matrix.rows_of(changed)
+    rows = rows[rows >= 0]
+    is_changed = np.zeros(len(matrix), dtype=bool)
+    is_changed[rows] = True
+    # A new similarity enters another movie's list if it beats the list's last
+    # entry, or if the list is not full
+    neighbor = models.MovieNeighbor
+    threshold = np.zeros(len(matrix), dtype=np.float32)
+    full_lists = db.execute(
+        select(neighbor.movie_id, func.min(neighbor.similarity))
+        .group_by(neighbor.movie_id).having(func.count() >= RECOMMENDER_NEIGHBORS)
+    ).all()
+    if full_lists:
+        movie_ids, minimums = zip(*full_lists)
+        full_rows = matrix.rows_of(movie_ids)
+        threshold[full_rows[full_rows >= 0]] = np.asarray(minimums, dtype=np.float32)[full_rows >= 0]
+
+    def refresh_block(block):
+        similarities = matrix.similarities(block)
+        block_rows, others = np.nonzero((similarities > threshold) & ~is_changed)
+        entering = (matrix.movie_ids[others], matrix.movie_ids[block[block_rows]], similarities[block_rows, others])
+        return matrix.top(block, similarities, RECOMMENDER_NEIGHBORS), entering
+
+    results = _map_blocks(refresh_block, matrix.blocks(rows))
+    for chunk in _chunks(sorted(set(changed)), WRITE_CHUNK):
+        db.execute(delete(neighbor).where(neighbor.movie_id.in_(chunk)))
+        db.execute(delete(neighbor).where(neighbor.neighbor_id.in_(chunk)))
+    _write(db, [lists for lists, _ in results])
+    _write(db, [entering for _, entering in results])
+    _trim(db, {movie_id for _, (movie_ids, _, _) in results for movie_id in movie_ids.tolist()})
+    db.add(models.NeighborBuild(ratings_through=through, movies=len(rows), incremental=True))
+    db.commit()
+    logger.info("Refreshed neighbour lists of %d rated movies", len(rows))
+
+
+# Drop deleted movies from every list
+def remove_movies(db: Session, movie_ids: Iterable[int]):
+    movie_ids = list(movie_ids)
+    if movie_ids:
+        neighbor = models.MovieNeighbor
+        db.execute(delete(neighbor).where(neighbor.movie_id.in_(movie_ids) | neighbor.neighbor_id.in_(movie_ids)))
+
+
+# A movie's stored neighbours, most similar first
+def similar(db: Session, movie_id: int, limit: int = 10):
+    neighbor = models.MovieNeighbor
+    return db.execute(
+        select(neighbor.neighbor_id, neighbor.similarity)
+        .where(neighbor.movie_id == movie_id)
+        .order_by(neighbor.similarity.desc(), neighbor.neighbor_id.desc())
+        .limit(limit)
+    ).all()
+
+
+# (movie_id, score) recommendations for a user: the neighbours of their most
+# most recently given or replaced ratings, each weighted by how far the user's rating is above the
+# rated movie's average, without the movies they rated already
+def for_user(db: Session, user_id: int, limit: int = 10):
+    rating, neighbor = models.Rating, models.MovieNeighbor
+    recent = (
+        select(rating.movie_id, rating.rating)
+        .where(rating.user_id == user_id, rating.rating.is_not(None))
+        .order_by(rating.rated_at.desc().nulls_last(), rating.id.desc())
+        .limit(RECOMMENDER_USER_HISTORY)
+        .subquery()
+    )
+    score = func.sum(neighbor.similarity * (recent.c.rating - models.Movie.rating_average))
+    return db.execute(
+        select(neighbor.neighbor_id, score.label("score"))
+        .join(recent, neighbor.movie_id == recent.c.movie_id)
+        .join(models.Movie, models.Movie.id == recent.c.movie_id)
+        .where(neighbor.neighbor_id.not_in(select(rating.movie_id).where(rating.user_id == user_id)))
+        .group_by(neighbor.neighbor_id)
+        .having(score > 0)
+        .order_by(score.desc(), neighbor.neighbor_id.desc())
+        .limit(limit)
+    ).all()
+
+
+if __name__ == "__main__":
+    from app.database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Build or refresh the similar-movie lists")
+    parser.add_argument("--full", action="store_true", help="rebuild every list instead of refreshing")
+    args = parser.parse_args()
+    with SessionLocal() as db:
+        if args.full:
+            build(db)
+        else:
+            refresh(db)
@@ -1,6 +1,6 @@
-from pydantic import BaseModel, Field, EmailStr
+from pydantic import BaseModel, Field, EmailStr, field_validator
 from datetime import date, datetime
-from typing import List, Optional
+from typing import List, Literal, Optional
 
 class Token(BaseModel):
     access_token: str
@@ -64,7 +64,7 @@ class MovieBase(BaseModel):
     rating: Optional[float] = Field(None, description="Rating of the movie")
     genre_ids: Optional[List[int]] = Field(default=[], description="List of genre IDs associated with the movie")
     director_id: Optional[int] = Field(None, description="ID of the director of the movie")
-    # cast_ids: Optional[List[int]] = Field(default=[], description="List of actor IDs who acted in the movie")
+    cast_ids: Optional[List[int]] = Field(default=[], description="List of actor IDs who acted in the movie")
     language: Optional[str] = Field(None, description="Language of the movie")
     trailer_url: Optional[str] = Field(None, description="URL of the movie trailer")
 
@@ -78,10 +78,66 @@ class Movie(MovieBase):
     id: int = Field(..., description="Unique identifier for the movie")
     created_at: datetime = Field(..., description="Timestamp when the movie was created")
     updated_at: datetime = Field(..., description="Timestamp when the movie was last updated")
+    rating_count: int = Field(default=0, description="Number of user ratings of the movie")
+    rating_average: Optional[float] = Field(None, description="Average user rating of the movie")
 
     class Config:
         from_attributes = True
 
+# Compact people records embedded in movie details
+class ActorSummary(BaseModel):
+    id: int = Field(..., description="Unique identifier for the actor")
+    name: str = Field(..., description="Name of the actor")
+
+    class Config:
+        from_attributes = True
+
+class DirectorSummary(BaseModel):
+    id: int = Field(..., description="Unique identifier for the director")
+    name: str = Field(..., description="Name of the director")
+
+    class Config:
+        from_attributes = True
+
+class MovieDetail(Movie):
+    genres: List[Genre] = Field(default=[], description="Genres of the movie")
+    cast: List[ActorSummary] = Field(default=[], description="Actors who acted in the movie")
+    director: Optional[DirectorSummary] = Field(None, description="Director of the movie")
+
+# One entry of GET /movies/batch, in the requested order; unknown ids are
+# returned with found=false instead of failing the whole batch
+class MovieBatchItem(BaseModel):
+    id: int = Field(..., description="Requested movie ID")
+    found: bool = Field(..., description="Whether a movie with this ID exists")
+    movie: Optional[MovieDetail] = Field(None, description="The movie, if found")
+
+# Sort keys and filters of GET /movies/; every set filter must match, ranges are inclusive
+MovieSortKey = Literal["created_at", "release_date", "rating", "duration", "title"]
+SortOrder = Literal["asc", "desc"]
+
+class MovieFilters(BaseModel):
+    genre_id: Optional[int] = Field(None, description="Only movies with this genre")
+    director_id: Optional[int] = Field(None, description="Only movies by this director")
+    actor_id: Optional[int] = Field(None, description="Only movies with this actor in the cast")
+    language: Optional[str] = Field(None, description="Only movies in this language")
+    released_from: Optional[date] = Field(None, description="Earliest release date")
+    released_to: Optional[date] = Field(None, description="Latest release date")
+    min_rating: Optional[float] = Field(None, description="Lowest average user rating")
+    max_rating: Optional[float] = Field(None, description="Highest average user rating")
+    min_duration: Optional[int] = Field(None, description="Shortest duration in minutes")
+    max_duration: Optional[int] = Field(None, description="Longest duration in minutes")
+
+# Bulk ingestion result for POST /movies/bulk
+class BulkIngestError(BaseModel):
+    line: int = Field(..., description="Line number of the rejected row in the NDJSON body")
+    error: str = Field(..., description="Why the row was rejected")
+
+class BulkIngestResult(BaseModel):
+    received: int = Field(default=0, description="Number of non-empty lines received")
+    inserted: int = Field(default=0, description="Number of movies inserted")
+    failed: int = Field(default=0, description="Number of rejected rows")
+    errors: List[BulkIngestError] = Field(default=[], description="Rejected rows, capped at BULK_MAX_REPORTED_ERRORS")
+
 # Rating Schema
 class RatingBase(BaseModel):
     rating: float = Field(..., description="Rating given to the movie")
@@ -97,6 +153,36 @@ class Rating(RatingBase):
     class Config:
        from_attributes = True
 
+class RatingSummary(BaseModel):
+    movie_id: int = Field(..., description="ID of the rated movie")
+    rating_count: int = Field(..., description="Number of ratings of the movie")
+    rating_sum: float = Field(..., description="Sum of all ratings of the movie")
+    average: Optional[float] = Field(None, description="Average rating, or null if the movie has no ratings")
+
+# One entry of GET /movies/top
+LeaderboardWindow = Literal["all", "week"]
+
+class LeaderboardEntry(BaseModel):
+    rank: int = Field(..., description="Position in the leaderboard, starting at 1")
+    score: float = Field(..., description="Bayesian average rating used for the ranking")
+    votes: int = Field(..., description="Number of ratings within the window")
+    average: float = Field(..., description="Plain average rating within the window")
+    movie: Movie = Field(..., description="The ranked movie")
+
+# Entries of GET /movies/{movie_id}/similar and GET /users/me/recommendations
+class SimilarMovie(BaseModel):
+    similarity: float = Field(..., description="Similarity of the users' ratings of the two movies, up to 1")
+    movie: Movie = Field(..., description="The similar movie")
+
+class Recommendation(BaseModel):
+    score: float = Field(..., description="Relevance for the user; higher is better")
+    movie: Movie = Field(..., description="The recommended movie")
+
+# Acknowledgement of a rating queued by the write-behind rating buffer
+class RatingAccepted(RatingBase):
+    movie_id: int = Field(..., description="ID of the movie being rated")
+    user_id: int = Field(..., description="ID of the user who gave the rating")
+
 # User Schema
 class UserBase(BaseModel):
     username: str = Field(..., description="Username of the user")
@@ -111,6 +197,12 @@ class User(UserBase):
     is_active: bool = Field(default=True, description="Indicates if the user is active")
     comments: List[int] = Field(default=[], description="List of comment IDs made by the user")
 
+    # User.comments holds Comment rows; only their ids are exposed
+    @field_validator("comments", mode="before")
+    @classmethod
+    def comment_ids(cls, comments):
+        return [getattr(comment, "id", comment) for comment in comments]
+
     class Config:
         from_attributes = True
 
@@ -122,6 +214,15 @@ class Token(BaseModel):
 class TokenData(BaseModel):
     username: Optional[str] = None
 
+# Compact record of an authenticated user, cached per token by auth.get_current_user
+class Principal(BaseModel):
+    id: int = Field(..., description="Unique identifier for the user")
+    username: str = Field(..., description="Username of the user")
+    is_active: bool = Field(default=True, description="Indicates if the user is active")
+
+    class Config:
+        from_attributes = True
+
 class UserLogin(BaseModel):
     username: str = Field(..., description="Username of the user")
     password: str = Field(..., description="Password of the user")
@@ -139,6 +240,9 @@ class Comment(CommentBase):
     user_id: int = Field(..., description="ID of the user who made the comment")
     parent_id: Optional[int] = Field(None, description="ID of the parent comment if it is a reply")
     replies: List["Comment"] = Field(default=[], description="List of replies to this comment")
+    reply_count: int = Field(default=0, description="Number of direct replies, including any not nested in `replies`")
+    replies_cursor: Optional[str] = Field(None, description="Cursor for GET /comments/{id}/replies continuing after "
+                                                            "the last nested reply, when only some are nested")
 
     class Config:
        from_attributes = True
@@ -0,0 +1,156 @@
+import re
+from collections import defaultdict
+from typing import Iterable, List, Optional
+
+from fastapi import HTTPException, status
+from sqlalchemy import Float, Integer, bindparam, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+import app.models as models
+from app.pagination import Page, page_of, seek
+
+# Full-text index over movie titles, descriptions and cast/director names.
+# SQLite uses an FTS5 table whose rowid is the movie id; Postgres a table of
+# weighted tsvectors with a GIN index. Both are written in the same
+# transaction as the movie change by the crud functions and bulk ingestion.
+
+SEARCH_DDL = {
+    "sqlite": [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS movie_search USING fts5(title, description, people)",
+    ],
+    "postgresql": [
+        "CREATE TABLE IF NOT EXISTS movie_search ("
+        " movie_id INTEGER PRIMARY KEY REFERENCES movies (id) ON DELETE CASCADE,"
+        " document TSVECTOR NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS ix_movie_search_document ON movie_search USING GIN (document)",
+    ],
+}
+
+# bm25 weights for (title, description, people); lower scores rank first
+SQLITE_MATCHES = """
+    SELECT rowid AS id, bm25(movie_search, 10.0, 1.0, 5.0) AS rank
+    FROM movie_search WHERE movie_search MATCH :query
+"""
+POSTGRES_MATCHES = """
+    SELECT movie_id AS id, -ts_rank(document, query) AS rank
+    FROM movie_search, websearch_to_tsquery('english', :query) AS query
+    WHERE document @@ query
+"""
+POSTGRES_UPSERT = """
+    INSERT INTO movie_search (movie_id, document) VALUES (
+        :id,
+        setweight(to_tsvector('english', :title), 'A')
+        || setweight(to_tsvector('english', :description), 'C')
+        || setweight(to_tsvector('simple', :people), 'B'))
+    ON CONFLICT (movie_id) DO UPDATE SET document = EXCLUDED.document
+"""
+
+
+def _dialect(db: Session) -> str:
+    return db.get_bind().dialect.name
+
+
+def create_search_index(engine: Engine):
+    statements = SEARCH_DDL.get(engine.dialect.name, [])
+    with engine.begin() as conn:
+        for statement in statements:
+            conn.execute(text(statement))
+
+
+def _documents(db: Session, movie_ids: List[int]) -> List[dict]:
+    actors = defaultdict(list)
+    rows = db.execute(
+        select(models.movie_actor_association.c.movie_id, models.Actor.name)
+        .join(models.Actor, models.Actor.id == models.movie_actor_association.c.actor_id)
+        .where(models.movie_actor_association.c.movie_id.in_(movie_ids))
+    )
+    for movie_id, name in rows:
+        actors[movie_id].append(name)
+
+    rows = db.execute(
+        select(models.Movie.id, models.Movie.title, models.Movie.description, models.Director.name.label("director"))
+        .outerjoin(models.Director, models.Director.id == models.Movie.director_id)
+        .where(models.Movie.id.in_(movie_ids))
+    )
+    return [
+        {
+            "id": row.id,
+            "title": row.title,
+            "description": row.description or "",
+            "people": " ".join(filter(None, [row.director, *actors[row.id]])),
+        }
+        for row in rows
+    ]
+
+
+# (Re)index movies inside the caller's transaction
+def index_movies(db: Session, movie_ids: Iterable[int]):
+    movie_ids = list(movie_ids)
+    dialect = _dialect(db)
+    if not movie_ids or dialect not in SEARCH_DDL:
+        return
+    documents = _documents(db, movie_ids)
+    if dialect == "sqlite":
+        remove_movies(db, movie_ids)
+        if documents:
+            db.execute(
+                text("INSERT INTO movie_search (rowid, title, description, people) VALUES (:id, :title, :description, :people)"),
+                documents,
+            )
+    elif documents:
+        db.execute(text(POSTGRES_UPSERT), documents)
+
+
+def remove_movies(db: Session, movie_ids: Iterable[int]):
+    movie_ids = list(movie_ids)
+    dialect = _dialect(db)
+    if not movie_ids or dialect not in SEARCH_DDL:
+        return
+    column = "rowid" if dialect == "sqlite" else "movie_id"
+    db.execute(
+        text(f"DELETE FROM movie_search WHERE {column} IN :ids").bindparams(bindparam("ids", expanding=True)),
+        {"ids": movie_ids},
+    )
+
+
+# Rebuild the whole index in batches, e.g. after restoring a dump
+def rebuild_index(db: Session, batch_size: int = 5000):
+    last_id = 0
+    while True:
+        movie_ids = db.scalars(
+            select(models.Movie.id).where(models.Movie.id > last_id).order_by(models.Movie.id).limit(batch_size)
+        ).all()
+        if not movie_ids:
+            break
+        index_movies(db, movie_ids)
+        db.commit()
+        last_id = movie_ids[-1]
+
+
+# Turn free text into an FTS5 query: every word must match, the last one as
+# a prefix, and user input never reaches the FTS5 query syntax
+def _fts5_query(query: str) -> str:
+    words = re.findall(r"\w+", query)
+    if not words:
+        return ""
+    return " ".join(f'"{word}"' for word in words) + "*"
+
+
+# Ranked matches as a cursor page of (id, rank) rows
+def search_movie_ids(db: Session, query: str, cursor: Optional[str] = None, limit: int = 10) -> Page:
+    dialect = _dialect(db)
+    if dialect == "sqlite":
+        query = _fts5_query(query)
+        sql = SQLITE_MATCHES
+    elif dialect == "postgresql":
+        sql = POSTGRES_MATCHES
+    else:
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail="Search is not supported on this database")
+    if not query.strip():
+        return Page([], None)
+
+    matches = text(sql).bindparams(query=query).columns(id=Integer, rank=Float).subquery("matches")
+    columns = [matches.c.rank, matches.c.id]
+    rows = db.execute(seek(select(matches), columns, cursor=cursor, limit=limit)).all()
+    return page_of(rows, columns, limit)
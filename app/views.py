@@ -0,0 +1,146 @@
+from typing import List, Optional
+
+import orjson
+from fastapi import HTTPException, Request, Response, status
+from sqlalchemy.orm import Session
+
+import app.cache as cache
+import app.conditional as conditional
+import app.crud as crud
+import app.database as database
+import app.schemas as schemas
+from app.pagination import NEXT_CURSOR_HEADER
+
+# The read endpoints' logic (caching, conditional GETs, cursor headers, 404s),
+# shared by both routers: app.main calls these from its threadpool handlers
+# and app.async_routes through AsyncSession.run_sync, which passes them a
+# sync Session driving the async connection. Each returns the endpoint's result.
+
+
+def _not_found(what: str):
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"{what} not found")
+
+
+# Responses are served from the in-process movie cache when possible
+def movie_list(db: Session, request: Request, skip: int, limit: int, cursor: Optional[str],
+               sort: schemas.MovieSortKey, order: schemas.SortOrder, filters: schemas.MovieFilters):
+    filter_params = filters.model_dump(exclude_none=True)
+    key = cache.movie_list_key(skip=skip, limit=limit, cursor=cursor, sort=sort, order=order, **filter_params)
+    cached = cache.movie_cache.get(key)
+    if cached is None and conditional.is_conditional(request):
+        # Revalidate from the page's ids and updated_at before loading the movies
+        versions = crud.get_movie_versions(db, skip=skip, limit=limit, cursor=cursor,
+                                           filters=filters, sort=sort, order=order)
+        etag = conditional.movie_list_etag((row.id, row.updated_at) for row in versions.items)
+        if conditional.not_modified(request, etag):
+            return conditional.not_modified_response(etag, next_cursor=versions.next_cursor)
+    if cached is None:
+        since = cache.movie_cache.generation()
+        page = crud.get_movie_rows(db, skip=skip, limit=limit, cursor=cursor, filters=filters, sort=sort, order=order)
+        filtered = bool(filter_params) or (sort, order) != ("created_at", "asc")
+        cached = cache.cache_movie_page(key, page, skip=skip, cursor=cursor, filtered=filtered,
+                                        since=since, settle=database.replica_settle(db))
+    elif conditional.not_modified(request, cached.etag):
+        return conditional.not_modified_response(cached.etag, next_cursor=cached.next_cursor)
+    return cache.json_response(cached.body, cached.next_cursor, headers=conditional.validator_headers(cached.etag))
+
+def top_movies(db: Session, window: schemas.LeaderboardWindow, genre_id: Optional[int], limit: int):
+    return crud.get_leaderboard(db, window=window, genre_id=genre_id, limit=limit)
+
+# Cached movies come from the movie cache, the rest are loaded with one query
+def movie_batch(db: Session, ids: List[int]):
+    movies = {movie_id: cache.movie_cache.get(cache.movie_key(movie_id)) for movie_id in ids}
+    missing = [movie_id for movie_id, cached in movies.items() if cached is None]
+    since = cache.movie_cache.generation()
+    for db_movie in crud.get_movies_by_ids(db, missing, profile="detail"):
+        if db_movie is not None:
+            movies[db_movie.id] = cache.cache_movie_detail(db_movie, since=since, settle=database.replica_settle(db))
+    return cache.json_response(cache.movie_batch_body(ids, movies))
+
+def movie_detail(db: Session, request: Request, movie_id: int):
+    cached = cache.movie_cache.get(cache.movie_key(movie_id))
+    if cached is None and conditional.is_conditional(request):
+        # Revalidate from updated_at alone before loading relationships
+        version = crud.get_movie_version(db, movie_id=movie_id)
+        if version is None:
+            _not_found("Movie")
+        validators = conditional.movie_validators(version.id, version.updated_at)
+        if conditional.not_modified(request, *validators):
+            return conditional.not_modified_response(*validators)
+    if cached is None:
+        since = cache.movie_cache.generation()
+        db_movie = crud.get_movie_by_id(db, movie_id=movie_id, profile="detail")
+        if db_movie is None:
+            _not_found("Movie")
+        cached = cache.cache_movie_detail(db_movie, since=since, settle=database.replica_settle(db))
+    elif conditional.not_modified(request, cached.etag, cached.last_modified):
+        return conditional.not_modified_response(cached.etag, cached.last_modified)
+    return cache.json_response(cached.body, headers=conditional.validator_headers(cached.etag, cached.last_modified))
+
+def rating_summary(db: Session, movie_id: int):
+    summary = crud.get_rating_summary(db, movie_id=movie_id)
+    if summary is None:
+        _not_found("Movie")
+    return summary
+
+def similar_movies(db: Session, movie_id: int, limit: int):
+    similar = crud.get_similar_movies(db, movie_id=movie_id, limit=limit)
+    if similar is None:
+        _not_found("Movie")
+    return similar
+
+def movie_ratings(db: Session, movie_id: int, limit: int, cursor: Optional[str]):
+    if crud.get_movie_version(db, movie_id=movie_id) is None:
+        _not_found("Movie")
+    page = crud.get_rating_rows(db=db, movie_id=movie_id, limit=limit, cursor=cursor)
+    return cache.json_response(orjson.dumps(page.items), page.next_cursor)
+
+def comment_threads(db: Session, response: Response, movie_id: int, limit: int, cursor: Optional[str], max_depth: int):
+    if crud.get_movie_version(db, movie_id=movie_id) is None:
+        _not_found("Movie")
+    page = crud.get_comment_threads(db=db, movie_id=movie_id, cursor=cursor, limit=limit, max_depth=max_depth)
+    if page.next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = page.next_cursor
+    return page.items
+
+def comment_replies(db: Session, response: Response, comment_id: int, limit: int, cursor: Optional[str], max_depth: int):
+    if crud.get_comment_by_id(db, comment_id=comment_id) is None:
+        _not_found("Comment")
+    page = crud.get_comment_replies(db=db, comment_id=comment_id, cursor=cursor, limit=limit, max_depth=max_depth)
+    if page.next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = page.next_cursor
+    return page.items
+
+def actor(db: Session, actor_id: int):
+    detail = crud.get_actor_detail(db, actor_id=actor_id)
+    if detail is None:
+        _not_found("Actor")
+    return detail
+
+def actor_movies(db: Session, actor_id: int, limit: int, cursor: Optional[str]):
+    if crud.get_actor(db, actor_id=actor_id) is None:
+        _not_found("Actor")
+    page = crud.get_actor_movie_rows(db, actor_id=actor_id, cursor=cursor, limit=limit)
+    return cache.json_response(orjson.dumps(page.items), page.next_cursor)
+
+def director(db: Session, director_id: int):
+    detail = crud.get_director_detail(db, director_id=director_id)
+    if detail is None:
+        _not_found("Director")
+    return detail
+
+def director_movies(db: Session, director_id: int, limit: int, cursor: Optional[str]):
+    if crud.get_director(db, director_id=director_id) is None:
+        _not_found("Director")
+    page = crud.get_director_movie_rows(db, director_id=director_id, cursor=cursor, limit=limit)
+    return cache.json_response(orjson.dumps(page.items), page.next_cursor)
+
+# Served from the in-memory genre registry
+def genre_list(db: Session):
+    return cache.json_response(crud.get_genres_json(db))
+
+def genre(db: Session, genre_id: int):
+    found = crud.get_genre(db, genre_id=genre_id)
+    if found is None:
+        _not_found("Genre")
+    return found
@@ -0,0 +1,110 @@
+"""Compare requests/sec of the sync and async (DATABASE_MODE=async) read paths.
+
+Seeds a throwaway SQLite file, then drives the app in-process once per mode
+with a fixed number of concurrent clients:
+
+    python benchmarks/bench_async.py --movies 2000 --concurrency 100 --duration 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BENCH_ENV = {
+    "SECRET_KEY": "benchmark",
+    "ALGORITHM": "HS256",
+    "ACCESS_TOKEN_EXPIRE_MINUTES": "30",
+}
+
+
+def seed(database_url, movies):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    import app.models as models
+
+    engine = create_engine(database_url)
+    models.Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    genres = [models.Genre(name=f"Genre {i}") for i in range(20)]
+    actors = [models.Actor(name=f"Actor {i}") for i in range(200)]
+    directors = [models.Director(name=f"Director {i}") for i in range(50)]
+    for i in range(movies):
+        db.add(models.Movie(
+            title=f"Movie {i}",
+            description="A benchmark movie",
+            director=directors[i % len(directors)],
+            genres=[genres[i % len(genres)]],
+            cast=[actors[i % len(actors)], actors[(i * 7 + 1) % len(actors)]],
+        ))
+    db.commit()
+    db.close()
+    engine.dispose()
+
+
+async def drive(movies, concurrency, duration):
+    import httpx
+    from app.main import app
+
+    transport = httpx.ASGITransport(app=app)
+    completed = 0
+    deadline = time.perf_counter() + duration
+
+    async def client_loop(client):
+        nonlocal completed
+        while time.perf_counter() < deadline:
+            if random.random() < 0.5:
+                response = await client.get("/movies/", params={"limit": 20})
+            else:
+                response = await client.get(f"/movies/{random.randint(1, movies)}")
+            response.raise_for_status()
+            completed += 1
+
+    started = time.perf_counter()
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await asyncio.gather(*(client_loop(client) for _ in range(concurrency)))
+    return completed / (time.perf_counter() - started)
+
+
+def run_mode(mode, database_url, args):
+    env = dict(os.environ, **BENCH_ENV, DATABASE_URL=database_url, DATABASE_MODE=mode, PYTHONPATH=ROOT)
+    output = subprocess.run(
+        [sys.executable, __file__, "--worker", "--movies", str(args.movies),
+         "--concurrency", str(args.concurrency), "--duration", str(args.duration)],
+        env=env, check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])["requests_per_second"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--movies", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        rps = asyncio.run(drive(args.movies, args.concurrency, args.duration))
+        print(json.dumps({"requests_per_second": rps}))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database_url = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        seed(database_url, args.movies)
+        results = {mode: run_mode(mode, database_url, args) for mode in ("sync", "async")}
+
+    for mode, rps in results.items():
+        print(f"{mode:>5}: {rps:8.1f} req/s")
+    print(f"async/sync: {results['async'] / results['sync']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Per-request logging overhead on the request thread.
+
+Each simulated request sets a request id and emits --lines INFO records with
+arguments, which is what the signup path does. Modes:
+
+    off      logging disabled (baseline)
+    sync     the previous setup: a StreamHandler writing on the calling thread
+    queue    logger.configure_logging: QueueHandler + background JSON listener
+    sampled  queue with LOG_SAMPLE_RATE=--sample-rate
+
+The sink sleeps --sink-delay-ms per write to stand in for a slow or contended
+stdout/pipe; with 0 it is an in-memory buffer.
+
+    python benchmarks/bench_logging.py --requests 2000 --lines 3 --sink-delay-ms 0.2
+"""
+import argparse
+import io
+import logging
+import os
+import statistics
+import sys
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+class SlowSink(io.StringIO):
+    def __init__(self, delay):
+        super().__init__()
+        self.delay = delay
+
+    def write(self, text):
+        if self.delay:
+            time.sleep(self.delay)
+        return super().write(text)
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+def reset_root():
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+
+
+def setup(mode, sink, sample_rate):
+    import logger as app_logger
+
+    app_logger.stop_logging()
+    reset_root()
+    logging.disable(logging.NOTSET)
+    if mode == "off":
+        logging.disable(logging.CRITICAL)
+    elif mode == "sync":
+        handler = logging.StreamHandler(sink)
+        handler.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+        logging.getLogger().addHandler(handler)
+        logging.getLogger().setLevel(logging.INFO)
+    else:
+        app_logger.LOG_SAMPLE_RATE = sample_rate if mode == "sampled" else 1.0
+        app_logger.configure_logging(stream=sink, force=True)
+    return logging.getLogger("bench")
+
+
+def run(log, lines, requests):
+    import logger as app_logger
+
+    samples = []
+    for i in range(requests):
+        token = app_logger.request_id.set(uuid.uuid4().hex)
+        started = time.perf_counter()
+        for line in range(lines):
+            log.info("Handled step %d of request %d for user %s", line, i, "bench")
+        samples.append(time.perf_counter() - started)
+        app_logger.request_id.reset(token)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--lines", type=int, default=3)
+    parser.add_argument("--sink-delay-ms", type=float, default=0.2)
+    parser.add_argument("--sample-rate", type=float, default=0.1)
+    args = parser.parse_args()
+
+    import logger as app_logger
+
+    print(f"{args.lines} INFO lines per request, {args.requests} requests, sink delay {args.sink_delay_ms} ms")
+    for mode in ("off", "sync", "queue", "sampled"):
+        sink = SlowSink(args.sink_delay_ms / 1000)
+        log = setup(mode, sink, args.sample_rate)
+        samples = run(log, args.lines, args.requests)
+        app_logger.stop_logging()
+        written = sink.getvalue().count("\n")
+        print(f"{mode:>8}: mean {statistics.mean(samples) * 1e6:8.1f} us  p99 {percentile(samples, 99) * 1e6:8.1f} us"
+              f"  ({written} lines written)")
+    logging.disable(logging.NOTSET)
+
+
+if __name__ == "__main__":
+    main()
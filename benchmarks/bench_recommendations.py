@@ -0,0 +1,124 @@
+"""Build and serving cost of the item-item recommendations.
+
+Seeds a SQLite file with --ratings ratings of --movies movies by --users
+users (popularity is skewed, and users fall into taste groups that like and
+dislike different movies), then reports:
+
+    load     reading the ratings into the sparse matrix
+    build    a full build of every neighbour list, in total
+    refresh  an incremental refresh after --new-ratings more ratings
+    lookups  latency percentiles of GET /movies/{movie_id}/similar and
+             GET /users/me/recommendations style reads
+
+    python benchmarks/bench_recommendations.py --ratings 5000000 --workers 8
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+GROUPS = 8
+
+
+def seed(db, args):
+    from sqlalchemy import insert
+    import app.models as models
+
+    rng = random.Random(42)
+    db.execute(insert(models.User), [
+        {"username": f"user{i}", "email": f"user{i}@example.com", "password_hash": "unused"}
+        for i in range(1, args.users + 1)
+    ])
+    db.execute(insert(models.Movie), [{"title": f"Movie {i}"} for i in range(args.movies)])
+    group_of_movie = [rng.randrange(GROUPS) for _ in range(args.movies)]
+    per_user = max(1, args.ratings // args.users)
+    batch = []
+    for user_id in range(1, args.users + 1):
+        group = user_id % GROUPS
+        # Zipf-like popularity: low movie ids are rated far more often
+        movie_ids = {int(args.movies ** rng.random()) for _ in range(per_user)}
+        for movie_id in movie_ids:
+            liked = group_of_movie[movie_id - 1] == group
+            batch.append({"movie_id": movie_id, "user_id": user_id,
+                          "rating": float(rng.randint(6, 10) if liked else rng.randint(1, 6))})
+        if len(batch) >= 100000:
+            db.execute(insert(models.Rating), batch)
+            batch = []
+    if batch:
+        db.execute(insert(models.Rating), batch)
+    db.commit()
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+def report(name, samples):
+    print(f"{name:>16}: p50 {statistics.median(samples) * 1000:7.2f} ms  p99 {percentile(samples, 99) * 1000:7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--movies", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=50000)
+    parser.add_argument("--ratings", type=int, default=2_000_000)
+    parser.add_argument("--new-ratings", type=int, default=10000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--lookups", type=int, default=500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import sessionmaker
+        import app.crud as crud
+        import app.models as models
+        import app.recommendations as recommendations
+
+        recommendations.RECOMMENDER_WORKERS = args.workers
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        models.Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+
+        started = time.perf_counter()
+        seed(db, args)
+        print(f"seeded {db.query(models.Rating).count()} ratings in {time.perf_counter() - started:.1f}s")
+
+        started = time.perf_counter()
+        matrix = recommendations.RatingMatrix(db)
+        print(f"{'load':>16}: {time.perf_counter() - started:7.1f} s  ({len(matrix)} movies)")
+        del matrix
+
+        started = time.perf_counter()
+        recommendations.build(db)
+        print(f"{'build':>16}: {time.perf_counter() - started:7.1f} s  ({args.workers} workers, includes load and write)")
+
+        rng = random.Random(7)
+        crud.upsert_ratings(db, {
+            (rng.randint(1, args.users), rng.randint(1, args.movies)): float(rng.randint(1, 10))
+            for _ in range(args.new_ratings)
+        })
+        started = time.perf_counter()
+        recommendations.refresh(db)
+        print(f"{'refresh':>16}: {time.perf_counter() - started:7.1f} s  (after {args.new_ratings} new ratings)")
+
+        for name, lookup in (
+            ("similar", lambda: crud.get_similar_movies(db, rng.randint(1, args.movies), limit=10)),
+            ("recommendations", lambda: crud.get_recommendations(db, rng.randint(1, args.users), limit=10)),
+        ):
+            samples = []
+            for _ in range(args.lookups):
+                started = time.perf_counter()
+                lookup()
+                samples.append(time.perf_counter() - started)
+            report(name, samples)
+
+
+if __name__ == "__main__":
+    main()
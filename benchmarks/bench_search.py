@@ -0,0 +1,108 @@
+"""Benchmark GET /movies/search style queries over a large synthetic catalog.
+
+Seeds a SQLite file with --movies movies (1M by default), builds the FTS5
+index and reports index build time plus per-query latency percentiles:
+
+    python benchmarks/bench_search.py --movies 1000000 --queries 200
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+WORDS = (
+    "love war night city dark star storm river ghost king queen secret last lost "
+    "summer winter blood fire ice dream road home journey island empire shadow"
+).split()
+NAMES = "anna ben carla david emma frank grace hugo iris jack kate leo maria nick olga paul".split()
+SURNAMES = "smith jones brown taylor wilson evans thomas walker white hall young king".split()
+
+
+def seed(db, movies, batch_size=10000):
+    from sqlalchemy import insert
+    import app.models as models
+
+    rng = random.Random(42)
+    db.execute(insert(models.Director), [{"name": f"{rng.choice(NAMES)} {rng.choice(SURNAMES)}"} for _ in range(5000)])
+    db.execute(insert(models.Actor), [{"name": f"{rng.choice(NAMES)} {rng.choice(SURNAMES)}"} for _ in range(20000)])
+    for start in range(0, movies, batch_size):
+        count = min(batch_size, movies - start)
+        db.execute(insert(models.Movie), [
+            {
+                "title": " ".join(rng.sample(WORDS, 3)).title(),
+                "description": " ".join(rng.choices(WORDS, k=20)),
+                "director_id": rng.randint(1, 5000),
+            }
+            for _ in range(count)
+        ])
+        db.execute(insert(models.movie_actor_association), [
+            {"movie_id": movie_id, "actor_id": actor_id}
+            for movie_id in range(start + 1, start + count + 1)
+            for actor_id in rng.sample(range(1, 20001), 3)
+        ])
+        db.commit()
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--movies", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import sessionmaker
+        import app.crud as crud
+        import app.models as models
+        import app.search as search
+
+        engine = create_engine(os.environ["DATABASE_URL"])
+        models.Base.metadata.create_all(bind=engine)
+        search.create_search_index(engine)
+        db = sessionmaker(bind=engine)()
+
+        started = time.perf_counter()
+        seed(db, args.movies)
+        print(f"seeded {args.movies} movies in {time.perf_counter() - started:.1f}s")
+
+        started = time.perf_counter()
+        search.rebuild_index(db)
+        print(f"built search index in {time.perf_counter() - started:.1f}s")
+
+        rng = random.Random(7)
+        terms = [" ".join(rng.sample(WORDS + NAMES, rng.randint(1, 2))) for _ in range(args.queries)]
+        first_page, next_page = [], []
+        for term in terms:
+            started = time.perf_counter()
+            page = crud.search_movies(db, term, limit=args.limit)
+            first_page.append(time.perf_counter() - started)
+            if page.next_cursor:
+                started = time.perf_counter()
+                crud.search_movies(db, term, cursor=page.next_cursor, limit=args.limit)
+                next_page.append(time.perf_counter() - started)
+            db.expunge_all()
+
+        for label, samples in (("first page", first_page), ("next page", next_page)):
+            if samples:
+                print(f"{label:>10}: p50 {percentile(samples, 50) * 1000:7.1f} ms"
+                      f"  p95 {percentile(samples, 95) * 1000:7.1f} ms"
+                      f"  mean {statistics.mean(samples) * 1000:7.1f} ms  ({len(samples)} queries)")
+        db.close()
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Worker cold start: import time, startup time and first request latency.
+
+Each run is a fresh interpreter that imports app.main, runs the application
+startup (lifespan) and serves one GET /movies/. Database connections opened
+before the first request are counted; a cold start should open none.
+
+    python benchmarks/bench_startup.py --runs 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+WORKER = r"""
+import json, time
+started = time.perf_counter()
+from sqlalchemy import event
+from sqlalchemy.pool import Pool
+connections = []
+event.listen(Pool, "connect", lambda *args: connections.append(time.perf_counter()))
+from fastapi.testclient import TestClient
+import app.main
+imported = time.perf_counter()
+with TestClient(app.main.app) as client:
+    ready = time.perf_counter()
+    before_request = len(connections)
+    response = client.get("/movies/")
+    served = time.perf_counter()
+assert response.status_code == 200, response.text
+print(json.dumps({
+    "import": imported - started,
+    "startup": ready - imported,
+    "first_request": served - ready,
+    "connections_before_first_request": before_request,
+}))
+"""
+
+
+def seed(database_url):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    import app.models as models
+    import app.search as search
+
+    engine = create_engine(database_url)
+    models.Base.metadata.create_all(bind=engine)
+    search.create_search_index(engine)
+    with sessionmaker(bind=engine)() as db:
+        db.add_all(models.Movie(title=f"Movie {i}", description="A benchmark movie") for i in range(100))
+        db.commit()
+    engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        env.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        env.setdefault("SECRET_KEY", "bench-secret")
+        env.setdefault("ALGORITHM", "HS256")
+        env.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT, env.get("PYTHONPATH")]))
+        os.environ.update((key, env[key]) for key in ("DATABASE_URL", "SECRET_KEY", "ALGORITHM", "ACCESS_TOKEN_EXPIRE_MINUTES"))
+        seed(env["DATABASE_URL"])
+
+        results = []
+        for _ in range(args.runs):
+            output = subprocess.run([sys.executable, "-c", WORKER], env=env, cwd=ROOT, capture_output=True,
+                                    text=True, check=True).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"median of {args.runs} cold starts")
+    for key in ("import", "startup", "first_request"):
+        samples = [result[key] for result in results]
+        print(f"{key:>16}: {statistics.median(samples) * 1000:7.1f} ms  (min {min(samples) * 1000:.1f} ms)")
+    total = statistics.median(r["import"] + r["startup"] + r["first_request"] for r in results)
+    print(f"{'total':>16}: {total * 1000:7.1f} ms")
+    print(f"connections opened before the first request: {max(r['connections_before_first_request'] for r in results)}")
+
+
+if __name__ == "__main__":
+    main()
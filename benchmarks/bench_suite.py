@@ -0,0 +1,381 @@
+"""Latency and throughput of every endpoint in app/main.py on a seeded dataset.
+
+Seeds a SQLite file with a synthetic catalog (users, genres, actors,
+directors, movies, millions of ratings and deep comment threads), drives the
+app in-process with concurrent clients and reports p50/p95/p99 latency and
+throughput per endpoint. Results are written as JSON; pass a previous result
+file to --compare to flag p95 regressions (exit status 1).
+
+    python benchmarks/bench_suite.py --database /tmp/catalog.db --output run.json
+    python benchmarks/bench_suite.py --database /tmp/catalog.db --compare run.json
+
+An existing --database file is reused, together with the dataset settings
+saved next to it, so the seeding cost is paid once.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Callable, NamedTuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BENCH_ENV = {
+    "SECRET_KEY": "benchmark",
+    "ALGORITHM": "HS256",
+    "ACCESS_TOKEN_EXPIRE_MINUTES": "30",
+    # The in-process client logs every request at INFO
+    "LOG_LEVELS": "httpx=WARNING",
+}
+PASSWORD = "benchmark"
+WORDS = (
+    "love war night city dark star storm river ghost king queen secret last lost "
+    "summer winter blood fire ice dream road home journey island empire shadow"
+).split()
+LANGUAGES = ["en", "fr", "de", "es", "ja", "ko", "it"]
+DATASET_SETTINGS = ("users", "genres", "directors", "actors", "movies", "ratings", "comment_threads", "comment_depth", "seed")
+
+
+# Dataset
+
+def _insert(db, table, rows, batch_size=20000):
+    from sqlalchemy import insert
+
+    for start in range(0, len(rows), batch_size):
+        db.execute(insert(table), rows[start:start + batch_size])
+
+
+def seed(database_url, args):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    import app.crud as crud
+    import app.hashing as hashing
+    import app.leaderboards as leaderboards
+    import app.models as models
+    import app.recommendations as recommendations
+    import app.search as search
+
+    rng = random.Random(args.seed)
+    engine = create_engine(database_url)
+    models.Base.metadata.create_all(bind=engine)
+    search.create_search_index(engine)
+    db = sessionmaker(bind=engine)()
+
+    password_hash = hashing.pwd_context.hash(PASSWORD)
+    _insert(db, models.User, [
+        {"username": f"user{i}", "email": f"user{i}@example.com", "password_hash": password_hash}
+        for i in range(1, args.users + 1)
+    ])
+    _insert(db, models.Genre, [{"name": f"Genre {i}"} for i in range(1, args.genres + 1)])
+    _insert(db, models.Director, [{"name": f"Director {i}"} for i in range(1, args.directors + 1)])
+    _insert(db, models.Actor, [{"name": f"Actor {i}"} for i in range(1, args.actors + 1)])
+
+    for start in range(0, args.movies, 10000):
+        ids = range(start + 1, min(start + 10000, args.movies) + 1)
+        genres = {movie_id: rng.sample(range(1, args.genres + 1), rng.randint(1, 3)) for movie_id in ids}
+        _insert(db, models.Movie, [
+            {
+                "id": movie_id,
+                "title": " ".join(rng.sample(WORDS, 3)).title(),
+                "description": " ".join(rng.choices(WORDS, k=20)),
+                "release_date": date(1950, 1, 1) + timedelta(days=rng.randrange(27000)),
+                "duration": rng.randint(70, 200),
+                "language": rng.choice(LANGUAGES),
+                "director_id": rng.randint(1, args.directors),
+                "genre_id": genres[movie_id][0],
+                "owner_id": 1,
+            }
+            for movie_id in ids
+        ])
+        _insert(db, models.MovieGenre, [
+            {"movie_id": movie_id, "genre_id": genre_id} for movie_id in ids for genre_id in genres[movie_id]
+        ])
+        _insert(db, models.movie_actor_association, [
+            {"movie_id": movie_id, "actor_id": actor_id}
+            for movie_id in ids for actor_id in rng.sample(range(1, args.actors + 1), rng.randint(3, 5))
+        ])
+        db.commit()
+
+    # Each user rates distinct movies
+    per_user, extra = divmod(args.ratings, args.users)
+    batch = []
+    for user_id in range(1, args.users + 1):
+        count = min(args.movies, per_user + (user_id <= extra))
+        batch += [
+            {"movie_id": movie_id, "user_id": user_id, "rating": float(rng.randint(1, 10))}
+            for movie_id in rng.sample(range(1, args.movies + 1), count)
+        ]
+        if len(batch) >= 100000:
+            _insert(db, models.Rating, batch)
+            db.commit()
+            batch = []
+    _insert(db, models.Rating, batch)
+    db.commit()
+
+    # Threads are a chain of --comment-depth replies with a sibling at every level
+    comments, comment_id = [], 0
+    for _ in range(args.comment_threads):
+        movie_id = rng.randint(1, args.movies)
+        comment_id += 1
+        comments.append({"id": comment_id, "movie_id": movie_id, "user_id": rng.randint(1, args.users),
+                         "content": "Thread", "parent_id": None})
+        parent_id = comment_id
+        for depth in range(args.comment_depth):
+            for sibling in range(2):
+                comment_id += 1
+                comments.append({"id": comment_id, "movie_id": movie_id, "user_id": rng.randint(1, args.users),
+                                 "content": f"Reply {depth}.{sibling}", "parent_id": parent_id})
+            parent_id = comment_id
+    _insert(db, models.Comment, comments)
+    db.commit()
+
+    crud.recompute_rating_aggregates(db)
+    search.rebuild_index(db)
+    leaderboards.rebuild(db)
+    recommendations.build(db)
+    db.close()
+    engine.dispose()
+
+
+# Scenarios: one per endpoint of app/main.py, run in order. `build` turns the
+# request number into (method, url, httpx request kwargs); `share` scales
+# --requests for endpoints that are expensive by design (bcrypt, exports).
+# Writes only touch seeded movies through updates, ratings and comments;
+# DELETE removes the movies created by the POST scenarios before it.
+
+class Scenario(NamedTuple):
+    route: str
+    build: Callable
+    share: float = 1.0
+
+
+def scenarios(args, ctx):
+    rng = random.Random(args.seed)
+    movie = lambda: rng.randint(1, args.movies)
+    comment = lambda: rng.randint(1, ctx["comments"])
+    auth = {"headers": ctx["auth"]}
+    new_movie = lambda i: {"title": f"Benchmark {i}", "description": "Added by the benchmark",
+                           "release_date": "2001-01-01", "duration": 100, "language": "en",
+                           "director_id": 1, "genre_ids": [1, 2], "cast_ids": [1, 2]}
+    return [
+        Scenario("POST /token", lambda i: ("POST", "/token", {"json": {"username": "user1", "password": PASSWORD}}), 0.1),
+        Scenario("POST /login", lambda i: ("POST", "/login", {"data": {"username": "user1", "password": PASSWORD}}), 0.1),
+        Scenario("POST /signup", lambda i: ("POST", "/signup", {"json": {
+            "username": f"bench{ctx['run']}-{i}", "email": f"bench{ctx['run']}-{i}@example.com", "password": PASSWORD}}), 0.1),
+        Scenario("GET /users/me/", lambda i: ("GET", "/users/me/", auth)),
+        Scenario("GET /users/me/recommendations", lambda i: ("GET", "/users/me/recommendations", auth)),
+        Scenario("GET /movies/", lambda i: ("GET", "/movies/", {"params": {"limit": 20, "skip": rng.randrange(0, 100) * 20}})),
+        Scenario("GET /movies/ filtered", lambda i: ("GET", "/movies/", {"params": {
+            "genre_id": rng.randint(1, args.genres), "language": rng.choice(LANGUAGES),
+            "sort": rng.choice(["release_date", "rating", "duration", "title"]), "order": "desc", "limit": 20}})),
+        Scenario("GET /movies/top", lambda i: ("GET", "/movies/top", {"params": {
+            "genre_id": rng.randint(1, args.genres), "window": rng.choice(["all", "week"]), "limit": 20}})),
+        Scenario("GET /movies/search", lambda i: ("GET", "/movies/search", {"params": {"q": " ".join(rng.sample(WORDS, 2))}})),
+        Scenario("GET /movies/export", lambda i: ("GET", "/movies/export", {"params": {
+            "updated_since": (datetime.now(timezone.utc) - timedelta(hours=1)).isoformat()}}), 0.05),
+        Scenario("GET /movies/batch", lambda i: ("GET", "/movies/batch", {"params": [("ids", movie()) for _ in range(30)]})),
+        Scenario("GET /movies/{movie_id}", lambda i: ("GET", f"/movies/{movie()}", {})),
+        Scenario("GET /movies/{movie_id}/rating-summary", lambda i: ("GET", f"/movies/{movie()}/rating-summary", {})),
+        Scenario("GET /movies/{movie_id}/similar", lambda i: ("GET", f"/movies/{movie()}/similar", {})),
+        Scenario("GET /movies/{movie_id}/ratings", lambda i: ("GET", f"/movies/{movie()}/ratings", {})),
+        Scenario("GET /movies/{movie_id}/comments", lambda i: ("GET", f"/movies/{movie()}/comments", {"params": {"max_depth": 10}})),
+        Scenario("GET /comments/{comment_id}/replies", lambda i: ("GET", f"/comments/{comment()}/replies", {})),
+        Scenario("POST /movies/", lambda i: ("POST", "/movies/", dict(auth, json=new_movie(i)))),
+        Scenario("POST /movies/bulk", lambda i: ("POST", "/movies/bulk", dict(
+            auth, content="\n".join(json.dumps(new_movie(f"{i}.{n}")) for n in range(100))))),
+        Scenario("PUT /movies/{movie_id}", lambda i: ("PUT", f"/movies/{movie()}", dict(auth, json=new_movie(i)))),
+        Scenario("DELETE /movies/{movie_id}", lambda i: ("DELETE", f"/movies/{ctx['last_movie'] - i}", auth)),
+        Scenario("POST /movies/{movie_id}/rate", lambda i: ("POST", f"/movies/{movie()}/rate", dict(
+            auth, json={"movie_id": 0, "rating": float(rng.randint(1, 10))}))),
+        Scenario("POST /movies/{movie_id}/comments", lambda i: ("POST", f"/movies/{movie()}/comments", dict(
+            auth, json={"content": "Benchmark comment"}))),
+        Scenario("POST /comments/{comment_id}/reply", lambda i: ("POST", f"/comments/{comment()}/reply", dict(
+            auth, json={"content": "Benchmark reply"}))),
+        Scenario("GET /genres/", lambda i: ("GET", "/genres/", {})),
+        Scenario("GET /genres/{genre_id}", lambda i: ("GET", f"/genres/{rng.randint(1, args.genres)}", {})),
+        Scenario("POST /genres/", lambda i: ("POST", "/genres/", dict(auth, json={"name": f"Benchmark {ctx['run']}-{i}"})), 0.1),
+        Scenario("DELETE /genres/{genre_id}", lambda i: ("DELETE", f"/genres/{ctx['last_genre'] - i}", auth), 0.1),
+        Scenario("GET /actors/{actor_id}", lambda i: ("GET", f"/actors/{rng.randint(1, args.actors)}", {})),
+        Scenario("GET /actors/{actor_id}/movies", lambda i: ("GET", f"/actors/{rng.randint(1, args.actors)}/movies", {})),
+        Scenario("GET /directors/{director_id}", lambda i: ("GET", f"/directors/{rng.randint(1, args.directors)}", {})),
+        Scenario("GET /directors/{director_id}/movies", lambda i: (
+            "GET", f"/directors/{rng.randint(1, args.directors)}/movies", {})),
+        Scenario("GET /hashing/stats", lambda i: ("GET", "/hashing/stats", {})),
+        Scenario("GET /cache/stats", lambda i: ("GET", "/cache/stats", {})),
+        Scenario("GET /ratings/buffer/stats", lambda i: ("GET", "/ratings/buffer/stats", {})),
+        Scenario("GET /metrics", lambda i: ("GET", "/metrics", {})),
+    ]
+
+
+# Driver
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+async def run_scenario(client, scenario, requests, concurrency):
+    latencies, errors = [], 0
+    numbers = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in numbers:
+            method, url, kwargs = scenario.build(i)
+            started = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            await response.aread()
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, requests))))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": requests,
+        "errors": errors,
+        "concurrency": min(concurrency, requests),
+        "throughput_rps": requests / elapsed,
+        "mean_ms": sum(latencies) / len(latencies) * 1000,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+async def drive(args):
+    import httpx
+    from sqlalchemy import func, select
+    import app.hashing as hashing
+    import app.models as models
+    from app.database import SessionLocal
+    from app.main import app
+
+    with SessionLocal() as db:
+        ctx = {"comments": db.scalar(select(func.max(models.Comment.id))), "run": int(time.time())}
+
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            response = await client.post("/token", json={"username": "user1", "password": PASSWORD})
+            response.raise_for_status()
+            ctx["auth"] = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+            for scenario in scenarios(args, ctx):
+                with SessionLocal() as db:
+                    ctx["last_movie"] = db.scalar(select(func.max(models.Movie.id)))
+                    ctx["last_genre"] = db.scalar(select(func.max(models.Genre.id)))
+                requests = max(1, int(args.requests * scenario.share))
+                results[scenario.route] = await run_scenario(client, scenario, requests, args.concurrency)
+                print(f"{scenario.route:<40} p50 {results[scenario.route]['p50_ms']:8.1f} ms"
+                      f"  p95 {results[scenario.route]['p95_ms']:8.1f} ms"
+                      f"  p99 {results[scenario.route]['p99_ms']:8.1f} ms"
+                      f"  {results[scenario.route]['throughput_rps']:8.1f} req/s"
+                      f"  errors {results[scenario.route]['errors']}", file=sys.stderr)
+    finally:
+        hashing.pool.shutdown()
+
+    covered = {scenario.route.split(" ")[0] + " " + scenario.route.split(" ")[1] for scenario in scenarios(args, ctx)}
+    routes = {
+        f"{method} {route.path}"
+        for route in app.routes if getattr(route, "include_in_schema", False)
+        for method in route.methods
+    }
+    return results, sorted(routes - covered)
+
+
+def compare(results, baseline_path, tolerance):
+    with open(baseline_path) as f:
+        baseline = json.load(f)["endpoints"]
+    regressions = []
+    for route, result in results.items():
+        if route not in baseline:
+            continue
+        ratio = result["p95_ms"] / baseline[route]["p95_ms"]
+        flag = "REGRESSION" if ratio > 1 + tolerance else ""
+        print(f"{route:<40} p95 {baseline[route]['p95_ms']:8.1f} -> {result['p95_ms']:8.1f} ms ({ratio:5.2f}x) {flag}")
+        if flag:
+            regressions.append(route)
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", help="SQLite file to seed, or to reuse if it exists (default: a temporary file)")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--genres", type=int, default=30)
+    parser.add_argument("--directors", type=int, default=2000)
+    parser.add_argument("--actors", type=int, default=20000)
+    parser.add_argument("--movies", type=int, default=50000)
+    parser.add_argument("--ratings", type=int, default=2_000_000)
+    parser.add_argument("--comment-threads", type=int, default=5000)
+    parser.add_argument("--comment-depth", type=int, default=12)
+    parser.add_argument("--requests", type=int, default=500, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="bench-results.json")
+    parser.add_argument("--compare", help="previous result file to compare p95 latencies against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 slowdown before flagging, as a fraction")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = args.database or os.path.join(tmp, "bench.db")
+        database_url = f"sqlite:///{database}"
+        for key, value in dict(BENCH_ENV, DATABASE_URL=database_url).items():
+            os.environ.setdefault(key, value)
+
+        seed_seconds = None
+        settings_path = database + ".json"
+        if os.path.exists(database):
+            with open(settings_path) as f:
+                vars(args).update(json.load(f))
+        else:
+            started = time.perf_counter()
+            seed(database_url, args)
+            seed_seconds = time.perf_counter() - started
+            with open(settings_path, "w") as f:
+                json.dump({key: getattr(args, key) for key in DATASET_SETTINGS}, f)
+            print(f"seeded {database} in {seed_seconds:.1f}s", file=sys.stderr)
+
+        results, uncovered = asyncio.run(drive(args))
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "seed_seconds": seed_seconds,
+        "endpoints": results,
+        "uncovered_routes": uncovered,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"wrote {args.output}", file=sys.stderr)
+    if uncovered:
+        print(f"routes without a scenario: {', '.join(uncovered)}", file=sys.stderr)
+
+    if args.compare and compare(results, args.compare, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,8 @@
+import os
+
+# app.auth refuses to import without these; deployments set them in .env
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
+# bcrypt on threads; the suite has no use for a process pool
+os.environ.setdefault("HASH_EXECUTOR", "thread")
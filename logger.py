@@ -1,46 +1,189 @@
-# import logging
-# import logging.handlers
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import uuid
+import zlib
+from datetime import datetime, timezone
+from typing import Dict, Optional
 
-# # logging.basicConfig(filename="log.txt", level=logging.DEBUG)
+# Log records are put on an in-memory queue by the calling thread and written
+# by a background listener, so a slow stdout never blocks a request. The
+# listener thread starts with the first record, not at import, and the app
+# stops it at shutdown.
+#
+#   LOG_LEVEL        root level (default INFO)
+#   LOG_LEVELS       per-logger levels, e.g. "app.metrics=WARNING,sqlalchemy.engine=INFO"
+#   LOG_FORMAT       "json" (default) or "text"
+#   LOG_SAMPLE_RATE  fraction of INFO and lower records kept (default 1.0); the
+#                    decision is made per request id, so a sampled request
+#                    keeps all of its lines. Warnings and errors are never sampled.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
 
-# PAPERTRAIL_HOST = 'logs2.papertrailapp.com'
-# PAPERTRAIL_PORT = 50951
+REQUEST_ID_HEADER = "X-Request-ID"
 
+request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
 
-# logging.basicConfig(
-#     level=logging.DEBUG,
-#     format="%(asctime)s %(levelname)s %(name)s %(message)s"
-# )
+# Attributes every LogRecord has; anything else was passed through extra=
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id"}
 
-# def get_logger(name):
-#     logger = logging.getLogger(name)
-#     return logger
+_lock = threading.Lock()
+_listener: Optional[logging.handlers.QueueListener] = None
+_running = False
 
 
-# # logger = logging.getLogger(__name__)
+def parse_levels(spec: str) -> Dict[str, str]:
+    levels = {}
+    for item in spec.split(","):
+        name, sep, level = item.partition("=")
+        if sep and name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
 
-# # logger.debug("This message will be recorded.")
-# # logger.info("This message will be recorded.")
-# # logger.warning("This message will be recorded.")
-# # logger.error("This message will be recorded.")
-# # logger.critical("This message will be recorded.")
 
-import logging
-import os
+# One JSON object per line
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, default=str)
 
-import logging
 
-def setup_logger(name: str) -> logging.Logger:
-    logger = logging.getLogger(name)
-    if not logger.hasHandlers():
-        handler = logging.StreamHandler()
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        handler.setFormatter(formatter)
-        logger.addHandler(handler)
-        logger.setLevel(logging.INFO)
-    return logger
-
-# Get a logger with the given name
+# Runs on the calling thread: stamps the request id and drops sampled-out records
+class ContextFilter(logging.Filter):
+    def __init__(self, sample_rate: float = 1.0):
+        super().__init__()
+        self.sample_rate = sample_rate
+        self._threshold = int(sample_rate * 0x100000000)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id.get()
+        if self.sample_rate >= 1.0 or record.levelno > logging.INFO:
+            return True
+        key = record.request_id or f"{record.thread}:{record.relativeCreated}"
+        return zlib.crc32(key.encode()) < self._threshold
+
+
+# The message and traceback are rendered on the calling thread, since args may
+# reference objects that change after the call returns; JSON encoding and the
+# write itself happen on the listener thread
+class _QueueHandler(logging.handlers.QueueHandler):
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if not _running:
+            start_logging()
+        super().enqueue(record)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def configure_logging(stream=None, force: bool = False) -> Optional[logging.handlers.QueueListener]:
+    global _listener, _running
+    with _lock:
+        if _listener is not None and not force:
+            return _listener
+        if _running:
+            _listener.stop()
+            _running = False
+
+        output = logging.StreamHandler(stream or sys.stderr)
+        if LOG_FORMAT == "json":
+            output.setFormatter(JsonFormatter())
+        else:
+            output.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s"))
+
+        log_queue = queue.SimpleQueue()
+        handler = _QueueHandler(log_queue)
+        handler.addFilter(ContextFilter(LOG_SAMPLE_RATE))
+
+        root = logging.getLogger()
+        for existing in list(root.handlers):
+            if isinstance(existing, _QueueHandler):
+                root.removeHandler(existing)
+        root.addHandler(handler)
+        root.setLevel(LOG_LEVEL)
+        for name, level in parse_levels(LOG_LEVELS).items():
+            logging.getLogger(name).setLevel(level)
+
+        _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+        return _listener
+
+
+# Start the listener thread; called with the first queued record
+def start_logging():
+    global _running
+    with _lock:
+        if _listener is not None and not _running:
+            _listener.start()
+            _running = True
+
+
+# Flush everything still queued and stop the listener thread; called at app
+# shutdown and at interpreter exit. A record logged afterwards starts it again.
+def stop_logging():
+    global _running
+    with _lock:
+        if _running:
+            _listener.stop()
+            _running = False
+
+atexit.register(stop_logging)
+
+
+# Get a logger with the given name, setting up the pipeline on first use
 def get_logger(name: str) -> logging.Logger:
-    return setup_logger(name)
+    configure_logging()
+    return logging.getLogger(name)
+
+
+# ASGI middleware: takes the request id from X-Request-ID or generates one,
+# exposes it to log records through the context and echoes it in the response
+class RequestIdMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        header = REQUEST_ID_HEADER.lower().encode()
+        incoming = dict(scope["headers"]).get(header, b"").decode("latin-1")[:128]
+        current = incoming or uuid.uuid4().hex
+        token = request_id.set(current)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message = dict(message, headers=list(message.get("headers", [])) + [(header, current.encode("latin-1"))])
+            await send(message)
 
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id.reset(token)
@@ -0,0 +1,207 @@
+import csv
+import io
+
+import orjson
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+
+import app.auth as auth
+import app.cache as cache
+import app.crud as crud
+import app.database as database
+import app.genres as genres
+import app.main as main
+import app.migrate as migrate
+import app.models as models
+import app.schemas as schemas
+
+SESSION_FACTORIES = (database.SessionLocal, database.ReadSessionLocal,
+                     database.AsyncSessionLocal, database.AsyncReadSessionLocal)
+
+
+def _unbind_engines():
+    database._engines.clear()
+    for factory in SESSION_FACTORIES:
+        factory.configure(bind=None)
+
+
+# The app's engines pointed at a fresh, migrated SQLite file, with empty in-process caches
+@pytest.fixture()
+def database_url(tmp_path, monkeypatch):
+    url = f"sqlite:///{tmp_path / 'app.db'}"
+    monkeypatch.setattr(database, "DATABASE_URL", url)
+    _unbind_engines()
+    migrate.migrate(database.get_engine())
+    cache.movie_cache.clear()
+    cache.principal_cache.clear()
+    genres.registry.invalidate()
+    yield url
+    _unbind_engines()
+
+
+@pytest.fixture()
+def client(database_url):
+    # The lifespan disposes the engines on exit
+    with TestClient(main.create_app()) as client:
+        yield client
+
+
+# The app with DATABASE_MODE=async, its read endpoints served by app.async_routes
+@pytest.fixture()
+def async_client(database_url, monkeypatch):
+    monkeypatch.setattr(main, "DATABASE_MODE", "async")
+    with TestClient(main.create_app()) as client:
+        yield client
+
+
+# The app reading from a second SQLite file as its replica, which never
+# receives the primary's writes
+@pytest.fixture()
+def replica_client(database_url, tmp_path, monkeypatch):
+    url = f"sqlite:///{tmp_path / 'replica.db'}"
+    replica = create_engine(url)
+    migrate.migrate(replica)
+    replica.dispose()
+    monkeypatch.setattr(database, "READ_DATABASE_URL", url)
+    with TestClient(main.create_app()) as client:
+        yield client
+
+
+# Authorization headers of a new user, created without the bcrypt work of /signup
+def login(username: str, active: bool = True) -> dict:
+    with database.SessionLocal() as db:
+        user = crud.create_user(db, schemas.UserCreate(username=username, email=f"{username}@example.com",
+                                                       password="unused"), hashed_password="unused")
+        if not active:
+            crud.deactivate_user(db, user.id)
+    return {"Authorization": f"Bearer {auth.create_access_token({'sub': username})}"}
+
+
+def test_genre_endpoints(client):
+    owner, inactive = login("owner"), login("inactive", active=False)
+    drama = client.post("/genres/", json={"name": "Drama"}, headers=owner).json()
+    assert client.post("/genres/", json={"name": "Drama"}, headers=owner).status_code == 400
+    assert client.post("/genres/", json={"name": "Comedy"}).status_code == 401
+    movie = client.post("/movies/", json={"title": "Drama Movie", "genre_ids": [drama["id"]]}, headers=owner).json()
+    assert movie["genre_ids"] == [drama["id"]]
+    assert client.get("/genres/").json() == [drama]
+    assert client.get(f"/genres/{drama['id']}").json() == drama
+
+    assert client.delete(f"/genres/{drama['id']}").status_code == 401
+    assert client.delete(f"/genres/{drama['id']}", headers=inactive).status_code == 400
+    assert client.delete(f"/genres/{drama['id']}", headers=owner).json() == drama
+    assert client.delete(f"/genres/{drama['id']}", headers=owner).status_code == 404
+    assert client.get(f"/genres/{drama['id']}").status_code == 404
+    assert client.get("/genres/").json() == []
+    assert client.get(f"/movies/{movie['id']}").json()["genre_ids"] == []
+
+
+def test_async_read_endpoints(async_client):
+    owner = login("owner")
+    movie = async_client.post("/movies/", json={"title": "Async Movie", "description": "Served async"}, headers=owner).json()
+    comment = async_client.post(f"/movies/{movie['id']}/comments", json={"content": "First"}, headers=owner).json()
+    async_client.post(f"/comments/{comment['id']}/reply", json={"content": "Reply"}, headers=owner)
+
+    listing = async_client.get("/movies/")
+    assert [item["id"] for item in listing.json()] == [movie["id"]]
+    assert "async" in database._engines
+
+    detail = async_client.get(f"/movies/{movie['id']}")
+    assert detail.json()["title"] == "Async Movie"
+    cache.movie_cache.clear()
+    # Revalidated from the movie's version query alone, then from the cached entry
+    for _ in range(2):
+        assert async_client.get(f"/movies/{movie['id']}", headers={"If-None-Match": detail.headers["ETag"]}).status_code == 304
+        async_client.get(f"/movies/{movie['id']}")
+    assert async_client.get("/movies/999").status_code == 404
+
+    threads = async_client.get(f"/movies/{movie['id']}/comments").json()
+    assert [(c["content"], [r["content"] for r in c["replies"]]) for c in threads] == [("First", ["Reply"])]
+    assert async_client.get("/movies/999/comments").status_code == 404
+
+
+def test_reads_follow_the_writing_clients_cookie(replica_client, monkeypatch):
+    owner = login("owner")
+    movie = replica_client.post("/movies/", json={"title": "Fresh"}, headers=owner)
+    assert database.READ_PRIMARY_COOKIE in movie.cookies
+    movie_id = movie.json()["id"]
+
+    # The writer reads its write from the primary; any other client reads the replica
+    assert replica_client.get(f"/movies/{movie_id}/rating-summary").status_code == 200
+    with TestClient(replica_client.app) as other:
+        assert other.get(f"/movies/{movie_id}/rating-summary").status_code == 404
+        # The replica may not have the write that just emptied the cache yet,
+        # so what it returns is not cached until READ_YOUR_WRITES_SECONDS passed
+        assert other.get("/movies/").json() == []
+        assert cache.movie_cache.get(cache.movie_list_key(skip=0, limit=10, cursor=None, sort="created_at", order="asc")) is None
+        monkeypatch.setattr(database, "READ_YOUR_WRITES_SECONDS", 0)
+        assert other.get("/movies/").json() == []
+        assert cache.movie_cache.get(cache.movie_list_key(skip=0, limit=10, cursor=None, sort="created_at", order="asc")) is not None
+
+
+def test_export_streams_ndjson_and_csv(client):
+    owner = login("owner")
+    drama = client.post("/genres/", json={"name": "Drama"}, headers=owner).json()
+    first = client.post("/movies/", json={"title": "First, Part \"One\"", "genre_ids": [drama["id"]],
+                                          "release_date": "2001-02-03"}, headers=owner).json()
+    second = client.post("/movies/", json={"title": "Second"}, headers=owner).json()
+
+    assert client.get("/movies/export").status_code == 401
+    response = client.get("/movies/export", headers=owner)
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    rows = [orjson.loads(line) for line in response.text.splitlines()]
+    assert [(row["id"], row["title"], row["genre_ids"]) for row in rows] == [
+        (first["id"], first["title"], [drama["id"]]), (second["id"], "Second", [])]
+    assert rows[0]["release_date"] == "2001-02-03"
+    assert rows[1]["updated_at"] == second["updated_at"]
+
+    response = client.get("/movies/export", params={"format": "csv"}, headers=owner)
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [(row["id"], row["title"], row["genre_ids"]) for row in rows] == [
+        (str(first["id"]), first["title"], str(drama["id"])), (str(second["id"]), "Second", "")]
+
+    # Only the movies changed since a timestamp, oldest change first
+    updated = client.put(f"/movies/{first['id']}", json={"title": "First, revised"}, headers=owner).json()
+    response = client.get("/movies/export", params={"updated_since": second["updated_at"]}, headers=owner)
+    assert [orjson.loads(line)["title"] for line in response.text.splitlines()] == ["Second", "First, revised"]
+    response = client.get("/movies/export", params={"format": "csv", "updated_since": updated["updated_at"]}, headers=owner)
+    assert [row["title"] for row in csv.DictReader(io.StringIO(response.text))] == ["First, revised"]
+
+
+def test_update_movie_replaces_genres_and_cast(client):
+    owner = login("owner")
+    drama = client.post("/genres/", json={"name": "Drama"}, headers=owner).json()
+    comedy = client.post("/genres/", json={"name": "Comedy"}, headers=owner).json()
+    with database.SessionLocal() as db:
+        actor = models.Actor(name="Lead")
+        db.add(actor)
+        db.commit()
+        actor_id = actor.id
+    movie = client.post("/movies/", json={"title": "Switch", "genre_ids": [drama["id"]]}, headers=owner).json()
+    client.post(f"/movies/{movie['id']}/rate", json={"movie_id": movie["id"], "rating": 8.0}, headers=owner)
+    before = client.get(f"/movies/{movie['id']}")
+
+    updated = client.put(f"/movies/{movie['id']}", json={"title": "Switch", "genre_ids": [comedy["id"], drama["id"]],
+                                                          "cast_ids": [actor_id]}, headers=owner)
+    assert updated.status_code == 200
+    detail = client.get(f"/movies/{movie['id']}", headers={"If-None-Match": before.headers["ETag"]})
+    assert detail.status_code == 200
+    assert sorted(detail.json()["genre_ids"]) == sorted([comedy["id"], drama["id"]])
+    with database.SessionLocal() as db:
+        assert db.get(models.Movie, movie["id"]).genre_id == comedy["id"]
+    assert [actor["id"] for actor in detail.json()["cast"]] == [actor_id]
+    assert [entry["movie"]["id"] for entry in client.get("/movies/top", params={"genre_id": comedy["id"]}).json()] == [movie["id"]]
+    assert [movie["title"] for movie in client.get("/movies/search", params={"q": "lead"}).json()] == ["Switch"]
+
+    # Fields not sent are kept; sent lists replace, empty ones clear
+    client.put(f"/movies/{movie['id']}", json={"title": "Switch", "cast_ids": []}, headers=owner)
+    detail = client.get(f"/movies/{movie['id']}").json()
+    assert (sorted(detail["genre_ids"]), detail["cast"]) == (sorted([comedy["id"], drama["id"]]), [])
+    client.put(f"/movies/{movie['id']}", json={"title": "Switch", "genre_ids": [drama["id"]]}, headers=owner)
+    assert client.get("/movies/top", params={"genre_id": comedy["id"]}).json() == []
+
+    response = client.put(f"/movies/{movie['id']}", json={"title": "Switch", "genre_ids": [999]}, headers=owner)
+    assert response.status_code == 400
+    assert client.get(f"/movies/{movie['id']}").json()["genre_ids"] == [drama["id"]]
@@ -0,0 +1,1036 @@
+import json
+import re
+from datetime import date
+
+import orjson
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import app.crud as crud
+import app.genres as genres
+import app.leaderboards as leaderboards
+import app.models as models
+import app.schemas as schemas
+
+# In-memory SQLite database shared by every connection of the engine
+engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+@pytest.fixture()
+def db():
+    models.Base.metadata.create_all(bind=engine)
+    # The registry would otherwise keep the genres of the previous test's database
+    genres.registry.invalidate()
+    leaderboards.invalidate_priors()
+    session = TestingSessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+        models.Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture()
+def catalog(db):
+    genres = [models.Genre(name=f"Genre {i}") for i in range(3)]
+    actors = [models.Actor(name=f"Actor {i}") for i in range(5)]
+    director = models.Director(name="Jane Smith")
+    for i in range(100):
+        db.add(models.Movie(
+            title=f"Movie {i}",
+            director=director,
+            genres=[genres[i % 3], genres[(i + 1) % 3]],
+            cast=[actors[i % 5], actors[(i + 2) % 5]],
+        ))
+    db.commit()
+    db.expunge_all()
+    return db
+
+
+def add_users(db, *user_ids):
+    db.add_all([models.User(id=user_id, username=f"user{user_id}", email=f"user{user_id}@example.com",
+                            password_hash="unused") for user_id in user_ids])
+    db.commit()
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(engine, "before_cursor_execute", self)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(engine, "before_cursor_execute", self)
+
+
+@pytest.mark.parametrize("limit", [10, 100])
+def test_movie_summary_page_query_count(catalog, limit):
+    with QueryCounter() as counter:
+        page = crud.get_movies(catalog, limit=limit, profile="summary")
+        movies = [schemas.Movie.model_validate(movie) for movie in page.items]
+
+    assert len(movies) == limit
+    assert movies[0].genre_ids and movies[0].cast_ids
+    # movies + genres + cast, regardless of the page size
+    assert counter.count == 3
+
+
+def test_movie_detail_query_count(catalog):
+    with QueryCounter() as counter:
+        movie = crud.get_movie_by_id(catalog, movie_id=1, profile="detail")
+        detail = schemas.MovieDetail.model_validate(movie)
+
+    assert detail.director.name == "Jane Smith"
+    assert len(detail.genres) == 2 and len(detail.cast) == 2
+    # movie joined with its director + genres + cast
+    assert counter.count == 3
+
+
+def test_movie_rows_serialize_like_the_response_model(catalog):
+    with QueryCounter() as counter:
+        rows = crud.get_movie_rows(catalog, limit=10, sort="title")
+    # movies + genre ids + cast ids
+    assert counter.count == 3
+
+    movies = crud.get_movies(catalog, limit=10, sort="title")
+    expected = [schemas.Movie.model_validate(movie).model_dump(mode="json") for movie in movies.items]
+    for movie in expected:
+        movie["genre_ids"].sort()
+        movie["cast_ids"].sort()
+    assert json.loads(orjson.dumps(rows.items)) == expected
+    assert rows.next_cursor == movies.next_cursor
+
+
+def test_movie_batch_keeps_order_and_marks_missing(catalog):
+    with QueryCounter() as counter:
+        movies = crud.get_movies_by_ids(catalog, [7, 1000, 3, 7], profile="detail")
+        details = [schemas.MovieDetail.model_validate(movie) for movie in movies if movie is not None]
+
+    assert [movie and movie.id for movie in movies] == [7, None, 3, 7]
+    assert details[0].director.name == "Jane Smith"
+    # one IN query for every movie + genres + cast
+    assert counter.count == 3
+
+
+def test_movie_versions_match_the_page_in_one_query(catalog):
+    page = crud.get_movies(catalog, limit=10, sort="title", order="desc")
+    with QueryCounter() as counter:
+        versions = crud.get_movie_versions(catalog, limit=10, sort="title", order="desc")
+
+    assert counter.count == 1
+    assert [(row.id, row.updated_at) for row in versions.items] == [(movie.id, movie.updated_at) for movie in page.items]
+    assert versions.next_cursor == page.next_cursor
+
+
+def test_rating_bumps_movie_version(db):
+    movie = models.Movie(title="Epic Movie")
+    db.add(movie)
+    db.commit()
+    before = crud.get_movie_version(db, movie_id=movie.id)
+
+    crud.create_rating(db, schemas.RatingCreate(rating=8.0, movie_id=movie.id), user_id=1)
+    assert crud.get_movie_version(db, movie_id=movie.id).updated_at > before.updated_at
+    assert crud.get_movie_version(db, movie_id=movie.id + 1) is None
+
+
+def test_unknown_movie_profile(db):
+    with pytest.raises(ValueError):
+        crud.get_movies(db, profile="everything")
+
+
+def _movie_query_plan(db, **kwargs):
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        crud.get_movies(db, **kwargs)
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+    statement, parameters = statements[0]
+    with engine.connect() as conn:
+        return [row[3] for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)]
+
+
+# (filters, sort, order, index the movie page must be read through)
+MOVIE_LIST_PLANS = [
+    *[({}, sort, order, f"ix_movies_{column}_id")
+      for sort, column in [("created_at", "created_at"), ("release_date", "release_date"), ("rating", "rating_average"),
+                           ("duration", "duration"), ("title", "title")]
+      for order in ("asc", "desc")],
+    ({"genre_id": 1}, "created_at", "asc", "ix_movie_genre_genre_id_movie_id"),
+    ({"actor_id": 1}, "created_at", "asc", "ix_movie_actor_actor_id_movie_id"),
+    ({"director_id": 1}, "created_at", "asc", "ix_movies_director_id_created_at_id"),
+    ({"language": "en"}, "created_at", "asc", "ix_movies_language_created_at_id"),
+    ({"released_from": date(2000, 1, 1), "released_to": date(2010, 1, 1)}, "release_date", "desc", "ix_movies_release_date_id"),
+    ({"min_rating": 3.0, "max_rating": 4.0}, "rating", "desc", "ix_movies_rating_average_id"),
+    ({"min_duration": 90, "max_duration": 120}, "duration", "asc", "ix_movies_duration_id"),
+    ({"released_from": date(2000, 1, 1)}, "created_at", "asc", "ix_movies_created_at_id"),
+    ({"genre_id": 1, "language": "en"}, "title", "asc", "ix_movie_genre_genre_id_movie_id"),
+    ({"actor_id": 1, "min_duration": 90}, "duration", "desc", "ix_movie_actor_actor_id_movie_id"),
+]
+
+
+@pytest.mark.parametrize("filters,sort,order,index", MOVIE_LIST_PLANS)
+def test_movie_list_filters_and_sorts_use_indexes(db, filters, sort, order, index):
+    plan = _movie_query_plan(db, filters=schemas.MovieFilters(**filters), sort=sort, order=order)
+
+    assert any(index in step for step in plan), plan
+    # No table is read without an index
+    assert not any(re.fullmatch(r"SCAN \w+", step) for step in plan), plan
+    if not filters:
+        assert not any("TEMP B-TREE" in step for step in plan), plan
+
+
+def test_movie_list_sort_pages_nulls_last(db):
+    for i, duration in enumerate([120, None, 90, 120, None, 100]):
+        db.add(models.Movie(title=f"Movie {i}", duration=duration))
+    db.commit()
+
+    ids, cursor = [], None
+    while True:
+        page = crud.get_movies(db, limit=2, cursor=cursor, sort="duration", order="desc")
+        ids += [movie.id for movie in page.items]
+        cursor = page.next_cursor
+        if cursor is None:
+            break
+    assert ids == [4, 1, 6, 3, 5, 2]
+
+    with pytest.raises(HTTPException):
+        crud.get_movies(db, cursor=crud.get_movies(db, limit=1, sort="title").next_cursor)
+
+
+def test_rating_aggregates_follow_creates_and_deletes(db):
+    movie = models.Movie(title="Epic Movie")
+    db.add(movie)
+    db.commit()
+
+    first = crud.create_rating(db, schemas.RatingCreate(rating=8.0, movie_id=movie.id), user_id=1)
+    crud.create_rating(db, schemas.RatingCreate(rating=6.0, movie_id=movie.id), user_id=2)
+    summary = crud.get_rating_summary(db, movie_id=movie.id)
+    assert (summary.rating_count, summary.rating_sum, summary.average) == (2, 14.0, 7.0)
+
+    crud.delete_rating(db, rating_id=first.id)
+    summary = crud.get_rating_summary(db, movie_id=movie.id)
+    assert (summary.rating_count, summary.rating_sum, summary.average) == (1, 6.0, 6.0)
+
+    crud.recompute_rating_aggregates(db)
+    assert crud.get_rating_summary(db, movie_id=movie.id) == summary
+    assert crud.get_rating_summary(db, movie_id=movie.id + 1) is None
+
+
+def test_comment_threads_load_in_fixed_queries(db):
+    movie = models.Movie(title="Epic Movie")
+    db.add(movie)
+    db.commit()
+    movie_id = movie.id
+    for thread in range(3):
+        parent = models.Comment(movie_id=movie_id, user_id=1, content=f"Thread {thread}")
+        db.add(parent)
+        db.flush()
+        # A chain of replies five levels deep under every thread
+        for depth in range(5):
+            reply = models.Comment(movie_id=movie_id, user_id=1, content=f"Reply {depth}", parent_id=parent.id)
+            db.add(reply)
+            db.flush()
+            parent = reply
+    db.commit()
+    db.expunge_all()
+
+    with QueryCounter() as counter:
+        page = crud.get_comment_threads(db, movie_id=movie_id, limit=2, max_depth=3)
+    # thread page + one recursive CTE
+    assert counter.count == 2
+    assert [thread.content for thread in page.items] == ["Thread 0", "Thread 1"]
+
+    depth, node = 0, page.items[0]
+    while node.replies:
+        depth, node = depth + 1, node.replies[0]
+    assert depth == 3
+
+    rest = crud.get_comment_threads(db, movie_id=movie_id, cursor=page.next_cursor, limit=2)
+    assert [thread.content for thread in rest.items] == ["Thread 2"]
+    assert rest.next_cursor is None
+
+    replies = crud.get_comment_replies(db, comment_id=page.items[0].id, max_depth=0)
+    assert [reply.content for reply in replies.items] == ["Reply 0"]
+    assert replies.items[0].replies == []
+    assert replies.items[0].reply_count == 1
+
+
+def test_comment_threads_cap_replies_per_comment(db, monkeypatch):
+    monkeypatch.setattr(crud, "COMMENT_MAX_REPLIES", 2)
+    movie = models.Movie(title="Talked About")
+    db.add(movie)
+    db.commit()
+    root = models.Comment(movie_id=movie.id, user_id=1, content="Root")
+    db.add(root)
+    db.flush()
+    replies = [models.Comment(movie_id=movie.id, user_id=1, content=f"Reply {i}", parent_id=root.id) for i in range(5)]
+    db.add_all(replies)
+    db.flush()
+    db.add_all([models.Comment(movie_id=movie.id, user_id=1, content=f"Reply 0.{i}", parent_id=replies[0].id)
+                for i in range(3)])
+    db.commit()
+    movie_id, reply_id = movie.id, replies[0].id
+
+    with QueryCounter() as counter:
+        thread, = crud.get_comment_threads(db, movie_id=movie_id, max_depth=2).items
+    assert counter.count == 2
+    assert [reply.content for reply in thread.replies] == ["Reply 0", "Reply 1"]
+    assert [reply.content for reply in thread.replies[0].replies] == ["Reply 0.0", "Reply 0.1"]
+    assert (thread.reply_count, thread.replies[0].reply_count, thread.replies[1].reply_count) == (5, 3, 0)
+    assert thread.replies[1].replies_cursor is None
+
+    # The truncated branches continue through the replies endpoint
+    rest = crud.get_comment_replies(db, comment_id=thread.id, cursor=thread.replies_cursor)
+    assert [reply.content for reply in rest.items] == ["Reply 2", "Reply 3", "Reply 4"]
+    rest = crud.get_comment_replies(db, comment_id=reply_id, cursor=thread.replies[0].replies_cursor)
+    assert [reply.content for reply in rest.items] == ["Reply 0.2"]
+
+    # Below max_depth only the count is known
+    thread, = crud.get_comment_threads(db, movie_id=movie_id, max_depth=1).items
+    assert (thread.replies[0].replies, thread.replies[0].reply_count, thread.replies[0].replies_cursor) == ([], 3, None)
+
+
+def test_request_stats_count_queries_and_render(monkeypatch):
+    import app.metrics as metrics
+
+    metered = create_engine("sqlite://", poolclass=StaticPool)
+    metrics.instrument_engine(metered, "test")
+    stats = metrics.RequestStats({"type": "http", "endpoint": test_request_stats_count_queries_and_render})
+    token = metrics._request_stats.set(stats)
+    monkeypatch.setattr(metrics, "SLOW_QUERY_MS", 0)
+    try:
+        with metered.connect() as conn:
+            for _ in range(3):
+                conn.exec_driver_sql("SELECT 1")
+            with pytest.raises(Exception):
+                conn.exec_driver_sql("SELECT * FROM missing_table")
+            # the failed statement's start time is not left on the connection
+            assert conn.info["query_started"] == []
+    finally:
+        metrics._request_stats.reset(token)
+    assert stats.queries == 3 and stats.sql_seconds > 0
+
+    text = metrics.render()
+    assert 'db_slow_queries_total{route="test_request_stats_count_queries_and_render"} 3' in text
+    assert 'db_pool_checkout_wait_seconds_count{pool="test"} 1' in text
+
+
+def test_log_records_are_json_with_request_id():
+    import io
+    import logger as app_logger
+
+    stream = io.StringIO()
+    app_logger.configure_logging(stream=stream, force=True)
+    # The listener thread starts with the first record
+    assert not app_logger._running
+    token = app_logger.request_id.set("req-1")
+    try:
+        app_logger.get_logger("app.test").warning("Rated %s", "movie", extra={"movie_id": 7})
+        assert app_logger._running
+    finally:
+        app_logger.request_id.reset(token)
+        app_logger.stop_logging()
+    assert not app_logger._running
+    entry = json.loads(stream.getvalue().splitlines()[-1])
+    assert entry["message"] == "Rated movie"
+    assert (entry["level"], entry["request_id"], entry["movie_id"]) == ("WARNING", "req-1", 7)
+    assert app_logger.parse_levels("app.metrics=warning, sqlalchemy.engine=INFO,bad") == {
+        "app.metrics": "WARNING", "sqlalchemy.engine": "INFO"}
+
+
+def test_pool_options_and_read_your_writes(monkeypatch):
+    import time
+    from starlette.requests import Request
+    import app.database as database
+
+    assert {"pool_size", "max_overflow", "pool_timeout", "pool_pre_ping"} <= set(database.engine_options("sqlite:///movies.db"))
+    assert "pool_size" not in database.engine_options("sqlite://")
+
+    def request(until=None):
+        headers = [(b"cookie", f"{database.READ_PRIMARY_COOKIE}={until}".encode())] if until else []
+        return Request({"type": "http", "headers": headers})
+
+    now = time.time()
+    assert not database.reads_from_primary(request())
+    assert database.reads_from_primary(request(now + 1))
+    assert not database.reads_from_primary(request(now - 1))
+    # a cookie can not pin a client to the primary beyond the window
+    assert not database.reads_from_primary(request(now + database.READ_YOUR_WRITES_SECONDS + 60))
+
+
+def test_upsert_ratings_replaces_and_moves_aggregates(db):
+    movies = [models.Movie(title="Premiere"), models.Movie(title="Sequel")]
+    db.add_all(movies)
+    db.commit()
+    premiere, sequel = movies[0].id, movies[1].id
+    add_users(db, 1, 2, 3)
+    crud.create_rating(db, schemas.RatingCreate(movie_id=premiere, rating=4.0), user_id=1)
+    crud.create_rating(db, schemas.RatingCreate(movie_id=premiere, rating=6.0), user_id=1)
+
+    with QueryCounter() as counter:
+        # movie 999 and user 4 do not exist
+        written = crud.upsert_ratings(db, {(1, premiere): 10.0, (2, premiere): 2.0, (2, sequel): 8.0,
+                                           (3, 999): 5.0, (4, sequel): 1.0})
+    # movie ids, user ids, previous ratings, one upsert, one aggregate update
+    # per movie, then the leaderboards: buckets, genres, two windows, delete,
+    # insert (the priors were read by the first rating)
+    assert counter.count == 12
+    assert written == {premiere, sequel}
+
+    db.expire_all()
+    assert db.query(models.Rating).filter(models.Rating.movie_id == premiere).count() == 2
+    summary = crud.get_rating_summary(db, movie_id=premiere)
+    assert (summary.rating_count, summary.rating_sum, summary.average) == (2, 12.0, 6.0)
+    summary = crud.get_rating_summary(db, movie_id=sequel)
+    assert (summary.rating_count, summary.rating_sum) == (1, 8.0)
+    crud.recompute_rating_aggregates(db)
+    assert crud.get_rating_summary(db, movie_id=premiere).rating_sum == 12.0
+
+
+def test_leaderboards_update_incrementally_and_rebuild(db, monkeypatch):
+    import app.leaderboards as leaderboards
+
+    monkeypatch.setattr(leaderboards, "LEADERBOARD_MIN_VOTES", 2.0)
+    drama, comedy = models.Genre(name="Drama"), models.Genre(name="Comedy")
+    movies = [models.Movie(title="Acclaimed", genres=[drama]), models.Movie(title="Fluke", genres=[comedy]),
+              models.Movie(title="Panned", genres=[drama])]
+    db.add_all(movies)
+    db.commit()
+    acclaimed, fluke, panned = (movie.id for movie in movies)
+    add_users(db, 1)
+
+    for user_id in range(1, 5):
+        crud.create_rating(db, schemas.RatingCreate(movie_id=acclaimed, rating=9.0), user_id=user_id)
+        crud.create_rating(db, schemas.RatingCreate(movie_id=panned, rating=2.0), user_id=user_id)
+    leaderboards.rebuild(db)
+    # one perfect vote does not beat four very good ones
+    crud.upsert_ratings(db, {(1, fluke): 10.0, (1, panned): 3.0})
+
+    def ranking(**kwargs):
+        return [(entry.movie.title, entry.votes) for entry in crud.get_leaderboard(db, **kwargs)]
+
+    assert ranking() == [("Acclaimed", 4), ("Fluke", 1), ("Panned", 4)]
+    assert ranking(window="week", genre_id=drama.id) == [("Acclaimed", 4), ("Panned", 4)]
+    assert ranking(genre_id=comedy.id, limit=1) == [("Fluke", 1)]
+    assert crud.get_leaderboard(db)[0].score == pytest.approx((36.0 + 2 * 5.5) / (4 + 2))
+
+    crud.delete_rating(db, db.query(models.Rating).filter(models.Rating.movie_id == fluke).one().id)
+    assert ranking(genre_id=comedy.id) == []
+
+    incremental = {window: ranking(window=window) for window in leaderboards.WINDOWS}
+    leaderboards.rebuild(db)
+    assert {window: ranking(window=window) for window in leaderboards.WINDOWS} == incremental
+
+
+def test_leaderboard_priors_fall_back_and_stay_off_the_write_path(db):
+    from datetime import datetime, timedelta
+
+    def stored():
+        return dict(db.query(models.LeaderboardPrior.period, models.LeaderboardPrior.mean).all())
+
+    leaderboards.rebuild(db)
+    assert stored() == {"all": leaderboards.LEADERBOARD_DEFAULT_PRIOR, "week": leaderboards.LEADERBOARD_DEFAULT_PRIOR}
+
+    # Rated only before the week, so the week falls back to the all-time mean
+    movie = models.Movie(title="Classic", rating_count=2, rating_sum=16.0, rating_average=8.0)
+    db.add(movie)
+    db.flush()
+    db.add_all([models.Rating(movie_id=movie.id, user_id=user_id, rating=8.0,
+                              rated_at=datetime.utcnow() - timedelta(days=30)) for user_id in (1, 2)])
+    db.commit()
+    leaderboards.rebuild(db)
+    assert stored() == {"all": 8.0, "week": 8.0}
+
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        crud.create_rating(db, schemas.RatingCreate(movie_id=movie.id, rating=2.0), user_id=3)
+        assert not [statement for statement in statements if "leaderboard_priors" in statement]
+        leaderboards.invalidate_priors()
+        crud.create_rating(db, schemas.RatingCreate(movie_id=movie.id, rating=4.0), user_id=3)
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    assert len([statement for statement in statements if "leaderboard_priors" in statement]) == 1
+    assert not [statement for statement in statements if "sum(movies" in statement]
+    week = crud.get_leaderboard(db, window="week")[0]
+    assert week.score == pytest.approx((4.0 + leaderboards.LEADERBOARD_MIN_VOTES * 8.0) / (1 + leaderboards.LEADERBOARD_MIN_VOTES))
+
+
+def test_recommendations_build_refresh_and_lookup(db, monkeypatch):
+    import app.recommendations as recommendations
+
+    movies = [models.Movie(title=title) for title in ("Alien", "Aliens", "Notting Hill", "Love Actually", "Prometheus")]
+    db.add_all(movies)
+    db.commit()
+    alien, aliens, notting_hill, love_actually, prometheus = (movie.id for movie in movies)
+    add_users(db, *range(1, 14))
+    # users 1-6 like the science fiction and dislike the romances, users 7-12 the other way round
+    ratings = {}
+    for user_id in range(1, 13):
+        likes_scifi = user_id <= 6
+        for movie_id in (alien, aliens):
+            ratings[user_id, movie_id] = 9.0 if likes_scifi else 2.0
+        for movie_id in (notting_hill, love_actually):
+            ratings[user_id, movie_id] = 2.0 if likes_scifi else 9.0
+    crud.upsert_ratings(db, ratings)
+    recommendations.build(db)
+
+    similar = crud.get_similar_movies(db, alien)
+    assert [entry.movie.title for entry in similar] == ["Aliens"]
+    assert 0 < similar[0].similarity < 1
+    assert crud.get_similar_movies(db, prometheus) == []
+    assert crud.get_similar_movies(db, 999) is None
+
+    crud.upsert_ratings(db, {(13, alien): 10.0, (13, notting_hill): 1.0})
+    assert [entry.movie.title for entry in crud.get_recommendations(db, user_id=13)] == ["Aliens"]
+    assert crud.get_recommendations(db, user_id=999) == []
+
+    # the refresh picks up the new movie's ratings and adds it to the other lists
+    crud.upsert_ratings(db, {(user_id, prometheus): ratings[user_id, alien] for user_id in range(1, 13)})
+    recommendations.refresh(db)
+    assert {entry.movie.title for entry in crud.get_similar_movies(db, prometheus)} == {"Alien", "Aliens"}
+    assert "Prometheus" in {entry.movie.title for entry in crud.get_similar_movies(db, aliens)}
+    assert [entry.movie.title for entry in crud.get_recommendations(db, user_id=13)][:2] in (
+        ["Aliens", "Prometheus"], ["Prometheus", "Aliens"])
+
+    # rating a movie again makes it the most recent rating, whatever its id
+    monkeypatch.setattr(recommendations, "RECOMMENDER_USER_HISTORY", 1)
+    add_users(db, 14)
+    crud.upsert_ratings(db, {(14, notting_hill): 10.0})
+    crud.upsert_ratings(db, {(14, alien): 10.0})
+    assert [entry.movie.title for entry in crud.get_recommendations(db, user_id=14)][:1] in (["Aliens"], ["Prometheus"])
+    crud.upsert_ratings(db, {(14, notting_hill): 9.0})
+    assert [entry.movie.title for entry in crud.get_recommendations(db, user_id=14)] == ["Love Actually"]
+
+
+def test_filmographies_page_movie_ids_from_indexes(catalog):
+    db = catalog
+    actor = db.query(models.Actor).filter(models.Actor.name == "Actor 0").one()
+    director = db.query(models.Director).one()
+
+    with QueryCounter() as counter:
+        detail = crud.get_actor_detail(db, actor.id)
+    # the actor, then the movie ids from the association table
+    assert counter.count == 2
+    assert detail.name == "Actor 0" and len(detail.movies) == 40 and detail.movies == sorted(detail.movies)
+    assert crud.get_actor_detail(db, 999) is None
+
+    seen, cursor = [], None
+    while True:
+        with QueryCounter() as counter:
+            page = crud.get_actor_movie_rows(db, actor.id, cursor=cursor, limit=15)
+        # ids, movie rows, genre ids, cast ids
+        assert counter.count == 4
+        assert all(actor.id in row["cast_ids"] for row in page.items)
+        seen += [row["id"] for row in page.items]
+        cursor = page.next_cursor
+        if cursor is None:
+            break
+    assert seen == detail.movies
+
+    assert crud.get_director_detail(db, director.id).movies == crud.get_director_movie_ids(db, director.id)
+    page = crud.get_director_movie_rows(db, director.id, limit=10)
+    assert [row["title"] for row in page.items] == [f"Movie {i}" for i in range(10)]
+    next_page = crud.get_director_movie_rows(db, director.id, cursor=page.next_cursor, limit=10)
+    assert next_page.items[0]["title"] == "Movie 10"
+
+
+def test_genre_registry_validates_movie_genres_and_follows_writes(db):
+    import app.search as search
+    # create_movie indexes the movie; the FTS table is not part of the metadata
+    search.create_search_index(engine)
+    drama = crud.create_genre(db, schemas.GenreCreate(name="Drama"))
+    comedy = crud.create_genre(db, schemas.GenreCreate(name="Comedy"))
+    actor = models.Actor(name="Actor")
+    db.add(actor)
+    db.commit()
+    with pytest.raises(HTTPException):
+        crud.create_genre(db, schemas.GenreCreate(name="Drama"))
+    # A name taken by another worker since the snapshot loaded hits the unique index
+    db.add(models.Genre(name="Western"))
+    db.commit()
+    with pytest.raises(HTTPException) as exc:
+        crud.create_genre(db, schemas.GenreCreate(name="Western"))
+    assert exc.value.status_code == 400
+    version = genres.registry.stats()["version"]
+
+    movie = schemas.MovieCreate(title="Both", genre_ids=[comedy.id, drama.id, comedy.id], cast_ids=[actor.id])
+    with QueryCounter() as counter:
+        db_movie = crud.create_movie(db, movie, user_id=1)
+    # actor ids, movie, movie_genre rows, movie_actor rows, four to index it for search,
+    # refresh; no genre query
+    assert counter.count == 9
+    assert db_movie.genre_id == comedy.id and sorted(db_movie.genre_ids) == sorted([drama.id, comedy.id])
+    assert genres.registry.stats()["version"] == version
+    with pytest.raises(HTTPException):
+        crud.create_movie(db, schemas.MovieCreate(title="Unknown", genre_ids=[999]), user_id=1)
+
+    # A genre added behind the registry's back, as by another worker, is found on a miss
+    horror = models.Genre(name="Horror")
+    db.add(horror)
+    db.commit()
+    assert crud.create_movie(db, schemas.MovieCreate(title="Scary", genre_ids=[horror.id]), user_id=1).genre_ids == [horror.id]
+    assert [genre.name for genre in crud.get_genres(db)] == ["Drama", "Comedy", "Western", "Horror"]
+
+    before = crud.get_movie_version(db, db_movie.id).updated_at
+    assert crud.delete_genre(db, comedy.id).name == "Comedy"
+    db.expire_all()
+    assert db_movie.genre_id is None and db_movie.genre_ids == [drama.id]
+    assert crud.get_movie_version(db, db_movie.id).updated_at > before
+    assert crud.get_genre(db, comedy.id) is None and crud.get_genre(db, drama.id).name == "Drama"
+    assert crud.delete_genre(db, comedy.id) is None
+    assert orjson.loads(crud.get_genres_json(db)) == [
+        {"id": drama.id, "name": "Drama"}, {"id": drama.id + 2, "name": "Western"}, {"id": horror.id, "name": "Horror"}]
+
+
+# The tables a database created before any migration has data in
+BASELINE_SCHEMA = [
+    "CREATE TABLE genres (id INTEGER NOT NULL PRIMARY KEY, name VARCHAR NOT NULL UNIQUE)",
+    "CREATE TABLE movies (id INTEGER NOT NULL PRIMARY KEY, title VARCHAR NOT NULL, description TEXT,"
+    " release_date DATE, duration INTEGER, rating FLOAT, language VARCHAR, poster_url VARCHAR,"
+    " trailer_url VARCHAR, created_at DATETIME, updated_at DATETIME, genre_id INTEGER REFERENCES genres (id),"
+    " director_id INTEGER, owner_id INTEGER)",
+    "CREATE TABLE movie_genre (movie_id INTEGER NOT NULL REFERENCES movies (id),"
+    " genre_id INTEGER NOT NULL REFERENCES genres (id), PRIMARY KEY (movie_id, genre_id))",
+    "CREATE TABLE ratings (id INTEGER NOT NULL PRIMARY KEY, movie_id INTEGER REFERENCES movies (id),"
+    " user_id INTEGER, rating FLOAT)",
+]
+
+
+def test_migrate_backfills_a_baseline_database(tmp_path):
+    import app.leaderboards as leaderboards
+    import app.migrate as migrate
+    import app.search as search
+
+    baseline = create_engine(f"sqlite:///{tmp_path / 'baseline.db'}")
+    with baseline.begin() as conn:
+        for statement in BASELINE_SCHEMA:
+            conn.exec_driver_sql(statement)
+        conn.exec_driver_sql("INSERT INTO genres (id, name) VALUES (1, 'Drama'), (2, 'Comedy')")
+        conn.exec_driver_sql("INSERT INTO movies (id, title, genre_id) VALUES"
+                             " (1, 'Acclaimed Drama', 1), (2, 'Funny Comedy', 2), (3, 'Unrated', NULL)")
+        conn.exec_driver_sql("INSERT INTO ratings (movie_id, user_id, rating) VALUES (1, 1, 9), (1, 2, 7), (2, 1, 4)")
+
+    migrate.migrate(baseline)
+    # a second run finds nothing left to do
+    migrate.migrate(baseline)
+
+    with sessionmaker(bind=baseline)() as db:
+        movies = {movie.id: movie for movie in db.query(models.Movie)}
+        assert [(movies[i].rating_count, movies[i].rating_sum, movies[i].rating_average) for i in (1, 2, 3)] == [
+            (2, 16.0, 8.0), (1, 4.0, 4.0), (0, 0.0, None)]
+        assert [movies[i].genre_ids for i in (1, 2, 3)] == [[1], [2], []]
+        assert db.query(models.MovieGenre).count() == 2
+        assert [entry.movie_id for entry in leaderboards.top(db, "all")] == [1, 2]
+        assert [entry.movie_id for entry in leaderboards.top(db, "all", genre_id=2)] == [2]
+        assert [row.id for row in search.search_movie_ids(db, "comedy").items] == [2]
+    baseline.dispose()
+
+
+def test_movie_cache_tags_follow_writes(db):
+    import app.cache as cache
+    import app.search as search
+
+    search.create_search_index(engine)
+    cache.movie_cache.clear()
+    movies = [crud.create_movie(db, schemas.MovieCreate(title=f"Movie {i}"), user_id=1).id for i in range(3)]
+    pages = {
+        "head": dict(skip=0, limit=1, sort="created_at"),
+        "tail": dict(skip=0, limit=10, sort="created_at"),
+        "offset": dict(skip=1, limit=1, sort="created_at"),
+        "filtered": dict(skip=0, limit=10, sort="title"),
+    }
+    keys = {name: cache.movie_list_key(cursor=None, order="asc", **params) for name, params in pages.items()}
+    keys.update({f"movie {i}": cache.movie_key(movie_id) for i, movie_id in enumerate(movies)})
+
+    def fill():
+        cache.movie_cache.clear()
+        for name, params in pages.items():
+            page = crud.get_movie_rows(db, filters=schemas.MovieFilters(), **params)
+            cache.cache_movie_page(keys[name], page, skip=params["skip"], filtered=name == "filtered")
+        for movie_id in movies:
+            cache.cache_movie_detail(crud.get_movie_by_id(db, movie_id, profile="detail"))
+
+    def dropped():
+        return {name for name, key in keys.items() if cache.movie_cache.get(key) is None}
+
+    fill()
+    assert dropped() == set()
+    crud.update_movie(db, movies[2], schemas.MovieUpdate(title="Movie 2 (Director's Cut)"))
+    assert dropped() == {"tail", "filtered", "movie 2"}
+
+    fill()
+    crud.create_rating(db, schemas.RatingCreate(rating=8.0, movie_id=movies[0]), user_id=1)
+    assert dropped() == {"head", "tail", "filtered", "movie 0"}
+
+    fill()
+    crud.create_movie(db, schemas.MovieCreate(title="Movie 3"), user_id=1)
+    assert dropped() == {"tail", "filtered"}
+
+    fill()
+    crud.delete_movie(db, movies[0])
+    assert dropped() == {"head", "tail", "offset", "filtered", "movie 0"}
+
+    # A fill that read the movie before a write to it is not cached
+    stale_fills = cache.movie_cache.stats()["stale_fills"]
+    since = cache.movie_cache.generation()
+    db_movie = crud.get_movie_by_id(db, movies[1], profile="detail")
+    crud.update_movie(db, movies[1], schemas.MovieUpdate(title="Movie 1 (Remastered)"))
+    cache.cache_movie_detail(db_movie, since=since)
+    assert cache.movie_cache.get(keys["movie 1"]) is None
+    assert cache.movie_cache.stats()["stale_fills"] == stale_fills + 1
+    # Nor is one that started before the cache was cleared, but later fills are
+    since = cache.movie_cache.generation()
+    db_movie = crud.get_movie_by_id(db, movies[1], profile="detail")
+    cache.movie_cache.clear()
+    cache.cache_movie_detail(db_movie, since=since)
+    assert cache.movie_cache.get(keys["movie 1"]) is None
+    cache.cache_movie_detail(db_movie, since=cache.movie_cache.generation())
+    assert cache.movie_cache.get(keys["movie 1"]) is not None
+
+
+def test_ingest_ndjson_reports_bad_rows_and_keeps_going(db, monkeypatch):
+    import asyncio
+    import app.ingest as ingest
+    import app.search as search
+
+    search.create_search_index(engine)
+    drama, director, actor = models.Genre(name="Drama"), models.Director(name="Jane Smith"), models.Actor(name="Actor")
+    db.add_all([drama, director, actor])
+    db.commit()
+    monkeypatch.setattr(ingest, "BULK_MAX_LINE_BYTES", 200)
+
+    # Fail any chunk holding "Broken", as a constraint violation would
+    insert_movies = ingest._insert_movies
+    def failing_insert(db, rows, owner_id):
+        if any(movie.title == "Broken" for _, movie in rows):
+            raise ingest.SQLAlchemyError("broken row")
+        insert_movies(db, rows, owner_id)
+    monkeypatch.setattr(ingest, "_insert_movies", failing_insert)
+
+    lines = [
+        {"title": "One", "genre_ids": [drama.id], "director_id": director.id, "cast_ids": [actor.id]},
+        "{not json",
+        {"title": "Two"},
+        {"title": "Unknown genre", "genre_ids": [999]},
+        {"title": "Unknown people", "director_id": 999, "cast_ids": [actor.id, 998]},
+        {"title": "Long", "description": "x" * 500},
+        "",
+        {"title": "Broken"},
+        {"title": "Three"},
+        {"description": "no title"},
+        {"title": "Four"},
+    ]
+    body = b"\n".join(line.encode() if isinstance(line, str) else orjson.dumps(line) for line in lines)
+
+    async def stream(size):
+        for start in range(0, len(body), size):
+            yield body[start:start + size]
+
+    # Pieces of the body that split lines, and chunks of two rows
+    for size in (7, 64, len(body)):
+        result = asyncio.run(ingest.ingest_ndjson(stream(size), db, owner_id=1, chunk_size=2))
+        assert (result.received, result.inserted, result.failed) == (10, 4, 6)
+        assert [(error.line, error.error) for error in result.errors] == [
+            (2, result.errors[0].error),
+            (4, "Unknown genre ids [999]"),
+            (5, "Unknown director id 999, actor ids [998]"),
+            (6, "Line longer than 200 bytes"),
+            (8, "broken row"),
+            (10, result.errors[5].error),
+        ]
+        assert "title" in result.errors[5].error
+    titles = [title for title, in db.query(models.Movie.title).order_by(models.Movie.id)]
+    assert titles == ["One", "Two", "Three", "Four"] * 3
+    movie = db.query(models.Movie).filter(models.Movie.title == "One").first()
+    assert ([g.id for g in movie.genres], movie.director_id, [a.id for a in movie.cast]) == ([drama.id], director.id, [actor.id])
+
+
+def test_principal_cache_reuses_expires_and_drops_principals(db):
+    import time
+    from datetime import timedelta
+    import app.auth as auth
+    import app.cache as cache
+
+    cache.principal_cache.clear()
+    user = crud.create_user(db, schemas.UserCreate(username="critic", email="critic@example.com", password="unused"),
+                            hashed_password="unused")
+    user_id = user.id
+    token = auth.create_access_token({"sub": "critic"})
+
+    principal = auth.get_current_user(db=db, token=token)
+    with QueryCounter() as counter:
+        assert auth.get_current_user(db=db, token=token) is principal
+    assert counter.count == 0
+
+    # Kept for the cache TTL, or until the token expires if that comes first
+    def ttl(token):
+        return cache.principal_cache._entries[cache.token_key(token)].expires_at - time.monotonic()
+    assert ttl(token) == pytest.approx(cache.principal_cache.ttl, abs=1)
+    short = auth.create_access_token({"sub": "critic"}, expires_delta=timedelta(seconds=5))
+    auth.get_current_user(db=db, token=short)
+    assert 0 < ttl(short) <= 5
+
+    crud.deactivate_user(db, user_id)
+    with QueryCounter() as counter:
+        assert not auth.get_current_user(db=db, token=token).is_active
+    assert counter.count == 1
+
+    crud.delete_user(db, user_id)
+    with pytest.raises(HTTPException) as exc_info:
+        auth.get_current_user(db=db, token=token)
+    assert exc_info.value.status_code == 401
+
+
+def test_hashing_pool_limits_queues_rejects_and_shuts_down():
+    import asyncio
+    import threading
+    import app.hashing as hashing
+
+    running, peak, gate = [0], [0], threading.Event()
+
+    def work(value):
+        running[0] += 1
+        peak[0] = max(peak[0], running[0])
+        gate.wait(5)
+        running[0] -= 1
+        return value
+
+    async def until(condition):
+        while not condition():
+            await asyncio.sleep(0.001)
+
+    async def scenario(pool):
+        first = asyncio.create_task(pool.run(work, 1))
+        await until(lambda: pool.in_flight == 1)
+        second = asyncio.create_task(pool.run(work, 2))
+        await until(lambda: pool.queued == 1)
+        # The one slot is busy and the queue full
+        with pytest.raises(HTTPException) as exc_info:
+            await pool.run(work, 3)
+        assert (exc_info.value.status_code, exc_info.value.headers) == (503, {"Retry-After": "1"})
+        gate.set()
+        return await asyncio.gather(first, second)
+
+    # Two workers, but only one hash at a time
+    pool = hashing.HashingPool("thread", workers=2, concurrency=1, max_queue=1)
+    assert asyncio.run(scenario(pool)) == [1, 2]
+    assert peak[0] == 1
+    stats = pool.stats()
+    assert (stats["completed"], stats["rejected"], stats["max_queued"], stats["queued"], stats["in_flight"]) == (2, 1, 1, 0, 0)
+
+    # HASH_MAX_QUEUE=0 runs what can start at once and rejects the rest
+    gate.clear()
+    pool = hashing.HashingPool("thread", workers=1, concurrency=1, max_queue=0)
+
+    async def no_queue():
+        assert await pool.run(str.upper, "free") == "FREE"
+        first = asyncio.create_task(pool.run(work, 1))
+        await until(lambda: pool.in_flight == 1)
+        with pytest.raises(HTTPException):
+            await pool.run(work, 2)
+        gate.set()
+        return await first
+    assert asyncio.run(no_queue()) == 1
+    assert pool.stats()["rejected"] == 1
+
+    # Shutting down drops the executor; the next hash starts a new one
+    executor = pool._executor
+    pool.shutdown()
+    assert pool._executor is None and executor._shutdown
+    assert asyncio.run(pool.run(str.upper, "again")) == "AGAIN"
+    assert pool._executor is not executor
+    pool.shutdown()
+
+
+def test_search_ranks_follows_writes_and_pages(db):
+    from sqlalchemy import text
+    import app.search as search
+
+    search.create_search_index(engine)
+    # The FTS5 table is not part of the models' metadata, so it outlives other tests
+    db.execute(text("DELETE FROM movie_search"))
+    director, actor = models.Director(name="Ridley Scott"), models.Actor(name="Sigourney Weaver")
+    db.add_all([director, actor])
+    db.commit()
+
+    def create(title, description=None, **kwargs):
+        return crud.create_movie(db, schemas.MovieCreate(title=title, description=description, **kwargs), user_id=1).id
+
+    in_description = create("Deep Space", "A crew meets a weaver of webs")
+    in_title = create("The Weaver")
+    in_cast = create("Alien", "In space no one can hear you scream", director_id=director.id, cast_ids=[actor.id])
+
+    def titles(query, **kwargs):
+        return [movie.title for movie in crud.search_movies(db, query, **kwargs).items]
+
+    # Title matches outrank cast and director names, which outrank descriptions
+    assert titles("weaver") == ["The Weaver", "Alien", "Deep Space"]
+    assert titles("ridley") == titles("scott alien") == ["Alien"]
+    # The last word matches as a prefix
+    assert titles("weav") == ["The Weaver", "Alien", "Deep Space"]
+
+    pages, cursor = [], None
+    while True:
+        page = crud.search_movies(db, "weaver", cursor=cursor, limit=1)
+        pages += [movie.id for movie in page.items]
+        if page.next_cursor is None:
+            break
+        cursor = page.next_cursor
+    assert pages == [in_title, in_cast, in_description]
+
+    crud.update_movie(db, in_title, schemas.MovieUpdate(title="The Spinner"))
+    assert titles("weaver") == ["Alien", "Deep Space"]
+    assert titles("spinner") == ["The Spinner"]
+    crud.delete_movie(db, in_cast)
+    assert titles("weaver") == ["Deep Space"]
+    assert titles("ridley") == []
+
+    # FTS5 operators, columns and quotes in the input are matched as plain words
+    assert search._fts5_query('deep OR "space" title:x NEAR(a*') == '"deep" "OR" "space" "title" "x" "NEAR" "a"*'
+    assert search._fts5_query('"*() -') == ""
+    assert titles('space" OR "weaver') == []
+    assert titles("deep -space") == ["Deep Space"]
+    assert titles('"(*') == []
+
+
+def test_rating_buffer_flushes_requeues_and_rejects(monkeypatch):
+    import asyncio
+    import threading
+    from sqlalchemy.exc import IntegrityError, OperationalError
+    import app.cache as cache
+    import app.rating_buffer as rating_buffer
+
+    batches, fail, gate = [], [False], threading.Event()
+    gate.set()
+
+    def write(ratings):
+        gate.wait(5)
+        if fail[0]:
+            fail[0] = False
+            raise OperationalError("INSERT", {}, Exception("database down"))
+        # User 99 was deleted after rating, which no retry can fix
+        if any(user_id == 99 for user_id, _ in ratings):
+            raise IntegrityError("INSERT", {}, Exception("foreign key violation"))
+        batches.append(dict(ratings))
+        return {movie_id for _, movie_id in ratings}
+    monkeypatch.setattr(rating_buffer, "_write", write)
+
+    def new_buffer(flush_size=100, flush_interval=60.0, max_pending=100):
+        buffer = rating_buffer.RatingBuffer(flush_size, flush_interval, max_pending)
+        for movie_id in (1, 2, 3):
+            cache.known_movies.set(movie_id, True)
+        return buffer
+
+    async def until(condition):
+        for _ in range(2000):
+            if condition():
+                return
+            await asyncio.sleep(0.001)
+        raise AssertionError("timed out")
+
+    async def at_flush_size():
+        buffer = new_buffer(flush_size=2)
+        await buffer.add(None, 1, 1, 5.0)
+        await asyncio.sleep(0.01)
+        assert batches == []
+        await buffer.add(None, 1, 1, 6.0)
+        await buffer.add(None, 2, 1, 7.0)
+        await until(lambda: batches)
+        assert batches == [{(1, 1): 6.0, (2, 1): 7.0}]
+        await buffer.stop()
+    asyncio.run(at_flush_size())
+
+    async def on_interval():
+        buffer = new_buffer(flush_interval=0.02)
+        await buffer.add(None, 1, 2, 4.0)
+        await until(lambda: len(batches) == 2)
+        assert batches[-1] == {(1, 2): 4.0}
+        await buffer.stop()
+    asyncio.run(on_interval())
+
+    async def drained_on_stop():
+        buffer = new_buffer()
+        await buffer.add(None, 3, 3, 8.0)
+        await buffer.stop()
+        assert batches[-1] == {(3, 3): 8.0}
+        assert (buffer.pending, buffer.written) == ({}, 1)
+    asyncio.run(drained_on_stop())
+
+    async def requeued_after_a_failed_flush():
+        batches.clear()
+        buffer = new_buffer()
+        await buffer.add(None, 1, 1, 2.0)
+        await buffer.add(None, 2, 1, 3.0)
+        fail[0] = True
+        gate.clear()
+        flush = asyncio.create_task(buffer.flush())
+        await until(lambda: not buffer.pending)
+        # Queued while the failing flush runs, so newer than what it held
+        await buffer.add(None, 1, 1, 9.0)
+        gate.set()
+        await flush
+        assert buffer.pending == {(1, 1): 9.0, (2, 1): 3.0}
+        assert buffer.stats()["failed_flushes"] == 1
+        await buffer.flush()
+        assert batches == [{(1, 1): 9.0, (2, 1): 3.0}]
+        await buffer.stop()
+    asyncio.run(requeued_after_a_failed_flush())
+
+    async def bad_rows_dropped():
+        batches.clear()
+        buffer = new_buffer()
+        for user_id in (1, 99, 2):
+            await buffer.add(None, user_id, 1, 5.0)
+        await buffer.flush()
+        assert batches == [{(1, 1): 5.0}, {(2, 1): 5.0}]
+        assert (buffer.pending, buffer.written, buffer.dropped) == ({}, 2, 1)
+        await buffer.stop()
+    asyncio.run(bad_rows_dropped())
+
+    async def deleted_movie():
+        buffer = new_buffer()
+        existing, lookups = {2}, []
+        def get_movie_version(db, movie_id):
+            lookups.append(movie_id)
+            return movie_id if movie_id in existing else None
+        monkeypatch.setattr(crud, "get_movie_version", get_movie_version)
+        cache.known_movies.clear()
+        await buffer.add(None, 1, 2, 5.0)
+        await buffer.add(None, 2, 2, 5.0)
+        assert lookups == [2]
+        existing.clear()
+        cache.invalidate_movie(2, deleted=True)
+        with pytest.raises(HTTPException) as exc_info:
+            await buffer.add(None, 1, 2, 5.0)
+        assert exc_info.value.status_code == 404
+        await buffer.stop()
+    asyncio.run(deleted_movie())
+
+    async def full():
+        buffer = new_buffer(max_pending=2)
+        await buffer.add(None, 1, 1, 1.0)
+        await buffer.add(None, 2, 1, 1.0)
+        with pytest.raises(HTTPException) as exc_info:
+            await buffer.add(None, 3, 1, 1.0)
+        assert exc_info.value.status_code == 503
+        # Re-rating a queued pair takes no room
+        await buffer.add(None, 1, 1, 2.0)
+        assert (buffer.pending[1, 1], buffer.rejected) == (2.0, 1)
+        await buffer.stop()
+    asyncio.run(full())